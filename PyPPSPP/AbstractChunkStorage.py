@@ -16,11 +16,15 @@ You should have received a copy of the GNU Lesser General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import asyncio
+
 class AbstractChunkStorage():
     """Abstract class for for concrete chunk storage implementors"""
+    BLOCKING_IO = False     # GetChunkData / SaveChunkData might block the event loop
 
     def __init__(self, swarm):
         self._swarm = swarm
+        self._chunk_size = swarm.chunk_size
 
     def Initialize(self):
         """Initialize the storage engine"""
@@ -38,6 +42,39 @@ class AbstractChunkStorage():
         """Save given chunk in storage"""
         pass
 
+    def read_chunk(self, chunk_id, urgent = False):
+        """Get awaitable of the indicated chunk. Storages doing
+           blocking I/O read it without blocking the event loop.
+        """
+        return self._done_future(self.GetChunkData(chunk_id))
+
+    def write_chunk(self, chunk_id, data):
+        """Save given chunk. Returns awaitable done once saved"""
+        return self._done_future(self.SaveChunkData(chunk_id, data))
+
+    def prefetch(self, start_chunk, end_chunk):
+        """Hint that the given range of chunks will be read soon"""
+        pass
+
+    def get_stats(self):
+        """Get storage statistics dict"""
+        return {}
+
+    def drain(self):
+        """Get awaitable done once all pending writes are saved"""
+        return self._done_future(None)
+
+    def _done_future(self, result):
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(result)
+        return future
+
+    def get_file_range(self, start_chunk, end_chunk):
+        """Get (file, offset, count) of the given chunks range
+           for zero-copy sending or None if not supported.
+           The caller owns the file and closes it"""
+        return None
+
     def PostComplete(self):
         """Called when all chunks are onboard"""
         pass
\ No newline at end of file
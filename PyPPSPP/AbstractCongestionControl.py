@@ -0,0 +1,103 @@
+"""
+PyPPSPP, a Python3 implementation of Peer-to-Peer Streaming Peer Protocol
+Copyright (C) 2016,2017  J. Poderys, Technical University of Denmark
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from RTOEstimator import RTOEstimator
+
+class AbstractCongestionControl(object):
+    """Abstract class for concrete congestion controllers. Keeps track
+       of the data in flight and the congestion timeout. All times are
+       in seconds of the event loop clock, all sizes are in bytes.
+    """
+    MSS = 1500          # Sender's Maximum Segment Size (Using MTU of Ethernet)
+
+    # Pacing rate is cwnd / SRTT scaled by PACING_GAIN. Pacing exactly at
+    # cwnd / SRTT keeps flightsize below cwnd, so cwnd could never grow.
+    PACING_GAIN = 1.5
+
+    def __init__(self):
+        self._flightsize = 0            # Bytes sent but not acknowledged
+        self._cwnd = 0                  # Amount of data that can be outstanding in an RTT
+        self._cto = RTOEstimator()      # Congestion timeout
+        self._last_ack_rx = None
+        self._last_datasend = None
+
+    @property
+    def timeout(self):
+        """Current congestion timeout (s). Also the retransmission timeout of the sender"""
+        return self._cto.rto
+
+    def backoff(self):
+        """Double the timeout after a retransmission timeout [RFC6298] 5.5"""
+        self._cto.backoff()
+
+    def on_send(self, outbound_data, now):
+        """Account data that was put on the wire"""
+        # Start the congestion timer when going from idle to busy
+        if self._flightsize == 0:
+            self._last_ack_rx = now
+
+        self._flightsize += outbound_data
+        self._last_datasend = now
+
+    def on_ack(self, bytes_acked, delays, now, rtt = None):
+        """Account acknowledged data. delays are one-way delay samples [uS]
+           and rtt is an optional round-trip time sample (s).
+        """
+        self._last_ack_rx = now
+        self._flightsize = max([0, self._flightsize - bytes_acked]) # Prevent negative flightsizes
+
+        if rtt is not None:
+            self._cto.update(rtt)
+
+    def on_loss(self, now, bytes_lost = 0):
+        """Lost data is no longer counted as being in flight"""
+        self._flightsize = max([0, self._flightsize - bytes_lost])
+
+    def check_timeout(self, now):
+        """Check if no ACKs were received within the congestion timeout.
+           All data in flight is then considered lost. Returns True on timeout.
+        """
+        if self._flightsize == 0 or self._last_ack_rx is None:
+            return False
+
+        if now - self._last_ack_rx < self._cto.rto:
+            return False
+
+        self._cto.backoff()
+        self._flightsize = 0
+        self._last_ack_rx = now
+        return True
+
+    def next_send_time(self, outbound_data, now):
+        """Get the earliest time outbound_data bytes can be sent
+           or None if sending must wait for ACKs.
+        """
+        pass
+
+    def _paced_send_time(self, outbound_data, now):
+        """Window based sending paced over the smoothed RTT"""
+        # Always allow one packet if nothing is in flight
+        if self._flightsize != 0 and self._flightsize + outbound_data > self._cwnd:
+            return None
+
+        srtt = self._cto.srtt
+        if self._last_datasend is None or srtt is None:
+            return now
+
+        send_interval = outbound_data * srtt / (self._cwnd * AbstractCongestionControl.PACING_GAIN)
+        return max(now, self._last_datasend + send_interval)
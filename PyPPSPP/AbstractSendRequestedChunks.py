@@ -16,13 +16,137 @@ You should have received a copy of the GNU Lesser General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import asyncio
+import logging
+import functools
+from struct import Struct
+
+from Messages import MsgData, MsgIntegrity, MsgSignedIntegrity
+
 class AbstractSendRequestedChunks(object):
     """description of class"""
-
+    CHANNEL = Struct('>I')              # Channel id of the peer before the messages
 
     def __init__(self, swarm, member):
         self._swarm = swarm
         self._member = member
 
+        self._read_chunks = {}      # chunk_id -> data read from the storage
+        self._reads = set()         # Chunks being read from the storage
+
     def SendAndSchedule(self):
-        pass
\ No newline at end of file
+        pass
+
+    def on_ack(self, chunk_ids, delay_samples):
+        """Called with newly acknowledged chunk ids and one-way delay samples"""
+        pass
+
+    def _integrity_messages(self, start_chunk, end_chunk, resend = False):
+        """INTEGRITY messages with the uncle hashes the peer needs to verify
+           the chunks. Sent before the DATA [RFC7574] 5.3. Hashes the peer
+           calculates from the chunks of the range and hashes already sent to
+           the peer are skipped, unless the chunks are sent again.
+        """
+        integrity = self._swarm.integrity
+        messages = []
+        if integrity is None:
+            return messages
+
+        sent = self._member.set_hashes_sent
+        added = set()
+        for node in integrity.range_uncles(start_chunk, end_chunk):
+            if node in sent and not resend:
+                continue
+
+            node_hash = integrity.get_hash(node)
+            if node_hash is None:
+                # We do not know it either (i.e. resumed download)
+                continue
+
+            msg = MsgIntegrity.MsgIntegrity()
+            (msg.start_chunk, msg.end_chunk) = integrity.node_to_range(node)
+            msg.hash_data = node_hash
+            messages.append(msg)
+            added.add(node)
+
+            # Signed munro of a live stream follows its hash
+            signature = integrity.get_signature(node)
+            if signature is not None:
+                msg = MsgSignedIntegrity.MsgSignedIntegrity(integrity.SIGNATURE_ALG)
+                (msg.start_chunk, msg.end_chunk) = integrity.node_to_range(node)
+                (msg.timestamp, msg.signature) = signature
+                messages.append(msg)
+
+        sent.update(added)
+        return messages
+
+    def _build_data(self, md, resend = False):
+        """Build the channel, INTEGRITY messages of the chunks and the DATA
+           into one buffer. Payload is left out if md.data is None - it is
+           sent from the file.
+        """
+        messages = self._integrity_messages(md.start_chunk, md.end_chunk, resend)
+        size = MsgData.MsgData.HEADER_SIZE if md.data is None else md.GetSize()
+        wb = bytearray(AbstractSendRequestedChunks.CHANNEL.size + sum(msg.GetSize() for msg in messages) + size)
+
+        AbstractSendRequestedChunks.CHANNEL.pack_into(wb, 0, self._member.remote_channel)
+        offset = AbstractSendRequestedChunks.CHANNEL.size
+        for msg in messages:
+            offset = msg.BuildInto(wb, offset)
+        if md.data is None:
+            md.BuildHeaderInto(wb, offset)
+        else:
+            md.BuildInto(wb, offset)
+        return wb
+
+    def _get_chunk_data(self, chunk_id, urgent = False):
+        """Get chunk data without blocking the event loop. Returns None
+           if the chunk is being read from the storage. The caller should
+           then park the sender - it is woken up once the data is ready.
+           Chunk the storage can not give is dropped from the requested
+           chunks and the sender is woken up to send the next one.
+        """
+        storage = self._swarm._chunk_storage
+        if not storage.BLOCKING_IO:
+            data = storage.GetChunkData(chunk_id)
+            if data is None:
+                self._drop_chunk(chunk_id)
+            return data
+
+        data = self._read_chunks.pop(chunk_id, None)
+        if data is not None:
+            return data
+
+        if chunk_id not in self._reads:
+            self._reads.add(chunk_id)
+            storage.read_chunk(chunk_id, urgent).add_done_callback(
+                functools.partial(self._chunk_read, chunk_id))
+        return None
+
+    def _chunk_read(self, chunk_id, future):
+        """Storage read completed"""
+        self._reads.discard(chunk_id)
+
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logging.error('Reading chunk %s failed: %s', chunk_id, future.exception())
+            self._drop_chunk(chunk_id)
+            return
+        if future.result() is None:
+            self._drop_chunk(chunk_id)
+            return
+
+        # Peer might not be interested anymore
+        if chunk_id in self._member.set_requested:
+            self._read_chunks[chunk_id] = future.result()
+            self._member.wake_sender()
+
+    def _drop_chunk(self, chunk_id):
+        """Stop sending the chunk that can not be read. Otherwise it stays
+           the next chunk to send and the sender stalls on it.
+        """
+        self._member.set_requested.discard(chunk_id)
+
+        # Sender parks itself after the failed read - wake it up after that
+        asyncio.get_event_loop().call_soon(self._member.wake_sender)
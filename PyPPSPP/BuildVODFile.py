@@ -17,7 +17,9 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 """
-Helper program to build VOD file
+Helper program to build VOD file. Chunks are written to the file
+and hashed as they are packed, so the file is built in one pass
+using constant memory.
 """
 
 import logging
@@ -25,7 +27,7 @@ import asyncio
 import binascii
 import os
 
-from MerkleHashTree import MerkleHashTree
+from MerkleHashTree import MerkleTreeBuilder
 from GlobalParams import GlobalParams
 from MemoryChunkStorage import MemoryChunkStorage
 from ContentGenerator import ContentGenerator
@@ -33,83 +35,104 @@ from ContentGenerator import ContentGenerator
 
 logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(asctime)s %(message)s')
 
+WINDOW_CHUNKS = 1024    # Packed chunks kept in memory. Must hold the largest A/V frame
+
 class FakeSwarm(object):
     """Fake Swarm object to be inserted instead of real swarm"""
     
-    def __init__(self):
+    def __init__(self, chunk_size, on_chunks_packed):
         """Build required parameters"""
-        self.discard_wnd = None
+        self.discard_wnd = WINDOW_CHUNKS
+        self.chunk_size = chunk_size
         self.set_have = set()
+        self.set_missing = set()
         self.live = True
         self.live_src = True
         self._have_ranges = []
         self._last_discarded_id = -1
+        self.integrity = None
+        self._on_chunks_packed = on_chunks_packed
 
     def SendHaveToMembers(self):
         """Do nothing"""
         pass
 
-def main(length, filename):
+    def chunks_available(self, chunk_ids):
+        """Chunks are packed - hand them to the writer"""
+        self._on_chunks_packed(chunk_ids)
+
+class VODFileWriter(object):
+    """Write packed chunks to the file while calculating Merkle root hash"""
+
+    def __init__(self, file_hdl):
+        self.storage = None
+        self._file_hdl = file_hdl
+        self._tree_builder = MerkleTreeBuilder('sha1')
+
+    @property
+    def num_chunks(self):
+        return self._tree_builder.num_chunks
+
+    def write_chunks(self, chunk_ids):
+        """Write chunks that were just packed into the storage"""
+        for chunk_id in chunk_ids:
+            data = self.storage.GetChunkData(chunk_id)
+            if data is None:
+                raise RuntimeError('A/V frame does not fit into {} chunks'.format(WINDOW_CHUNKS))
+
+            self._file_hdl.write(data)
+            self._tree_builder.add(data)
+
+            if self.num_chunks % 1000 == 0:
+                logging.info('Wrote chunk %s', self.num_chunks)
+
+    def get_root_hash(self):
+        return self._tree_builder.get_root()
+
+def main(length, filename, chunk_size = GlobalParams.chunk_size):
     """Generate file having length number of seconds and save to filename"""
 
     logging.info('Building VOD file. Length: %s s. Filename: %s', length, filename)
 
-    swarm = FakeSwarm()
-    storage = MemoryChunkStorage(swarm)
     generator = ContentGenerator()
-    mekle_hasher = MerkleHashTree('sha1', GlobalParams.chunk_size)
 
     fps = 10
     key = 0
     total_frames = length * fps
-    for _ in range(total_frames):
-        # Generate AV data
-        if key == min([
-            len(generator._audio_samples),
-            len(generator._video_samples)
-        ]):
-            key = 0
 
-        avdata = generator._get_next_avdata(key)
-        key += 1
-
-        # Feed it into storage
-        storage.pack_data_with_de(avdata)
-
-    storage_len = len(storage._chunks)
-    logging.info('Total frames: %s Total chunks: %s',
-                 total_frames, storage_len
-    )
+    with open(filename, 'wb') as file_hdl:
+        writer = VODFileWriter(file_hdl)
+        swarm = FakeSwarm(chunk_size, writer.write_chunks)
+        storage = MemoryChunkStorage(swarm)
+        writer.storage = storage
 
-    m = bytearray()
-    for cid in range(storage_len):
-        m.extend(storage.GetChunkData(cid))
-    mmh = mekle_hasher.get_data_hash(m)
-    logging.info('In Memory Merkle Root hash: %s', binascii.hexlify(mmh))
+        for _ in range(total_frames):
+            # Generate AV data
+            if key == min([
+                len(generator._audio_samples),
+                len(generator._video_samples)
+            ]):
+                key = 0
 
-    # Storage now has all data. Store it into file
-    num_writes = 0
-    with open(filename, 'wb') as file_hdl:
-        for chunk_id in range(storage_len):
-            data = storage.GetChunkData(chunk_id)
-            file_hdl.write(data)
-            num_writes += 1
-            if num_writes % 1000 == 0:
-                logging.info('Wrote chunk %s of %s', num_writes, storage_len)
+            avdata = generator._get_next_avdata(key)
+            key += 1
 
-    # Calculate Merkle Root Hash:
-    logging.info('Calculating Merkle root hash')
+            # Feed it into storage. Packed chunks are written right away
+            storage.pack_data_with_de(avdata)
 
-    mrh = mekle_hasher.get_file_hash(filename)
+    num_chunks = writer.num_chunks
+    mrh = writer.get_root_hash()
 
+    logging.info('Total frames: %s Total chunks: %s',
+                 total_frames, num_chunks
+    )
     logging.info('Merkle Root hash: %s', binascii.hexlify(mrh))
-    logging.info('Min %s, Max %s', min(swarm.set_have), max(swarm.set_have))
 
     with open('{}.log'.format(filename), 'w') as log_hdl:
         log_hdl.write('Filename: {}\n'.format(filename))
         log_hdl.write('Total frames: {}\n'.format(total_frames))
-        log_hdl.write('Total chunks: {}\n'.format(storage_len))
+        log_hdl.write('Total chunks: {}\n'.format(num_chunks))
         log_hdl.write('Merkle hash: {}\n'.format(binascii.hexlify(mrh)))
 
 if __name__ == '__main__':
-    main(333, 'vod333.dat')
\ No newline at end of file
+    main(333, 'vod333.dat')
@@ -0,0 +1,106 @@
+"""
+PyPPSPP, a Python3 implementation of Peer-to-Peer Streaming Peer Protocol
+Copyright (C) 2016,2017  J. Poderys, Technical University of Denmark
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from AbstractCongestionControl import AbstractCongestionControl
+
+class CUBIC(AbstractCongestionControl):
+    """Loss-based CUBIC [RFC8312] congestion control. More aggressive
+       than LEDBAT: competes for the bottleneck instead of yielding to
+       other traffic. Suitable for foreground (streaming) swarms.
+    """
+    C = 0.4             # Scaling constant of the cubic function
+    BETA = 0.7          # Multiplicative decrease factor
+    INIT_CWND = 4       #
+    MIN_CWND = 2        #
+    MSS = AbstractCongestionControl.MSS
+
+    def __init__(self):
+        super().__init__()
+
+        self._cwnd = CUBIC.INIT_CWND * CUBIC.MSS
+        self._ssthresh = float("inf")
+        self._w_max = 0                 # cwnd before the last reduction
+        self._w_est = 0                 # Estimated cwnd of Reno (TCP-friendly region)
+        self._k = 0                     # Time for cwnd to grow back to w_max (s)
+        self._epoch_start = None        # Start of the current congestion avoidance epoch
+        self._last_dataloss = None
+
+    def next_send_time(self, outbound_data, now):
+        """Send within cwnd, paced over the RTT"""
+        return self._paced_send_time(outbound_data, now)
+
+    def on_ack(self, bytes_acked, delays, now, rtt = None):
+        """Grow cwnd in slow start or along the cubic function"""
+        super().on_ack(bytes_acked, delays, now, rtt)
+
+        if bytes_acked == 0:
+            return
+
+        if self._cwnd < self._ssthresh:
+            self._cwnd += bytes_acked
+            return
+
+        if self._epoch_start is None:
+            self._epoch_start = now
+            if self._cwnd < self._w_max:
+                self._k = ((self._w_max - self._cwnd) / CUBIC.MSS / CUBIC.C) ** (1 / 3)
+            else:
+                self._k = 0
+                self._w_max = self._cwnd
+            self._w_est = self._cwnd
+
+        srtt = self._cto.srtt if self._cto.srtt is not None else 0
+        t = now - self._epoch_start + srtt
+        w_cubic = CUBIC.C * (t - self._k) ** 3 * CUBIC.MSS + self._w_max
+
+        # Do not be slower than standard TCP would be
+        self._w_est += (3 * (1 - CUBIC.BETA) / (1 + CUBIC.BETA)
+                        * bytes_acked * CUBIC.MSS / self._cwnd)
+
+        target = max([w_cubic, self._w_est])
+        if target > self._cwnd:
+            self._cwnd += (target - self._cwnd) * bytes_acked / self._cwnd
+
+    def on_loss(self, now, bytes_lost = 0):
+        """Multiplicative decrease. At most once per RTT."""
+        super().on_loss(now, bytes_lost)
+
+        rtt = self._cto.srtt if self._cto.srtt is not None else self._cto.rto
+        if self._last_dataloss is not None and now - self._last_dataloss <= rtt:
+            return
+        self._last_dataloss = now
+
+        # Fast convergence - release bandwidth to the new flows
+        if self._cwnd < self._w_max:
+            self._w_max = self._cwnd * (1 + CUBIC.BETA) / 2
+        else:
+            self._w_max = self._cwnd
+
+        self._cwnd = max([self._cwnd * CUBIC.BETA, CUBIC.MIN_CWND * CUBIC.MSS])
+        self._ssthresh = self._cwnd
+        self._epoch_start = None
+
+    def check_timeout(self, now):
+        """Restart from slow start if no ACKs were received within CTO"""
+        if not super().check_timeout(now):
+            return False
+
+        self._ssthresh = max([self._cwnd * CUBIC.BETA, CUBIC.MIN_CWND * CUBIC.MSS])
+        self._cwnd = 1 * CUBIC.MSS
+        self._epoch_start = None
+        return True
@@ -0,0 +1,99 @@
+"""
+PyPPSPP, a Python3 implementation of Peer-to-Peer Streaming Peer Protocol
+Copyright (C) 2016,2017  J. Poderys, Technical University of Denmark
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import heapq
+import itertools
+
+class ChunkIOExecutor(object):
+    """Bounded thread pool running blocking storage I/O off the event loop.
+       At most max_in_flight operations are handed to the threads at once.
+       Queued operations are started in priority order (urgent reads,
+       reads, writes) and in the order of submission within a priority.
+    """
+    PRIO_URGENT = 0
+    PRIO_READ = 1
+    PRIO_WRITE = 2
+
+    def __init__(self, max_workers = 4, max_in_flight = None):
+        self._loop = asyncio.get_event_loop()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        self._max_in_flight = max_in_flight if max_in_flight is not None else max_workers
+
+        self._queue = []                # Heap of (priority, seq, future, func, args)
+        self._seq = itertools.count()
+        self._in_flight = set()         # Futures of operations run by the threads
+
+        self.num_ops = 0
+        self.max_queued = 0
+
+    @property
+    def queued(self):
+        """Number of operations waiting for a thread"""
+        return len(self._queue)
+
+    def submit(self, priority, func, *args):
+        """Run func(*args) in the pool. Returns future of the result"""
+        future = self._loop.create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), future, func, args))
+        self.max_queued = max([self.max_queued, len(self._queue)])
+        self._dispatch()
+        return future
+
+    def barrier(self):
+        """Get future done once all operations now run by the threads complete"""
+        if not self._in_flight:
+            future = self._loop.create_future()
+            future.set_result(None)
+            return future
+        return asyncio.gather(*self._in_flight, return_exceptions = True)
+
+    def shutdown(self):
+        """Wait for operations in the threads and stop the pool.
+           Queued operations are not run.
+        """
+        for (_, _, future, _, _) in self._queue:
+            future.cancel()
+        self._queue.clear()
+        self._executor.shutdown(wait = True)
+
+    def _dispatch(self):
+        while self._queue and len(self._in_flight) < self._max_in_flight:
+            (_, _, future, func, args) = heapq.heappop(self._queue)
+            if future.cancelled():
+                continue
+
+            self.num_ops += 1
+            io_future = self._loop.run_in_executor(self._executor, func, *args)
+            self._in_flight.add(io_future)
+            io_future.add_done_callback(functools.partial(self._done, future))
+
+    def _done(self, future, io_future):
+        self._in_flight.discard(io_future)
+
+        if not future.cancelled():
+            if io_future.cancelled():
+                future.cancel()
+            elif io_future.exception() is not None:
+                future.set_exception(io_future.exception())
+            else:
+                future.set_result(io_future.result())
+
+        self._dispatch()
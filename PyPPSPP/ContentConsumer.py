@@ -23,7 +23,6 @@ import queue
 import time
 import threading
 
-from GlobalParams import GlobalParams
 from Framer import Framer
 
 class ContentConsumer(object):
@@ -154,7 +153,7 @@ class ContentConsumer(object):
         # If we have a gap - try to fill it
         if self._biggest_seen_chunk > self._next_frame:
             while True:
-                chunk = self._swarm._chunk_storage.GetChunkData(self._next_frame, ignore_missing = True)
+                chunk = self._swarm._chunk_storage.copy_chunk(self._next_frame)
                 if chunk == None:
                     # We do not have next chunk yet
                     break
@@ -166,7 +165,7 @@ class ContentConsumer(object):
         """Extrack data from chunks with DiscardEligible marks"""
 
         # Ensure that we got the exact required amount of data
-        assert len(chunk_data) == GlobalParams.chunk_size
+        assert len(chunk_data) == self._swarm.chunk_size
 
         # Get the lock
         with self._data_lock:
@@ -265,7 +264,7 @@ class ContentConsumer(object):
     def feed_q_until_max(self):
         """Try feeding the frames Q until the last known chunk"""
         while True:
-            chunk = self._swarm._chunk_storage.GetChunkData(self._next_frame, ignore_missing = True)
+            chunk = self._swarm._chunk_storage.copy_chunk(self._next_frame)
             if chunk == None:
                 # We do not have next chunk yet
                 break
@@ -290,7 +289,7 @@ class ContentConsumer(object):
         while nf <= self._biggest_seen_chunk:
 
             # Get the chunk
-            chunk = self._swarm._chunk_storage.GetChunkData(nf, ignore_missing = True)
+            chunk = self._swarm._chunk_storage.copy_chunk(nf)
 
             # If Chunk is missing continue with next
             if chunk is None:
@@ -0,0 +1,253 @@
+"""
+PyPPSPP, a Python3 implementation of Peer-to-Peer Streaming Peer Protocol
+Copyright (C) 2016,2017  J. Poderys, Technical University of Denmark
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Ed25519 signatures [RFC8032] used by the live stream source to sign
+the Merkle subtree roots. The optional cryptography package does the
+work. Without it a plain Python fallback is used, see below.
+"""
+
+import binascii
+import functools
+import hashlib
+import os
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+    from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+except ImportError:
+    Ed25519PrivateKey = None
+
+SECRET_LEN = 32
+PUBLIC_LEN = 32
+SIGNATURE_LEN = 64
+
+BACKEND = 'python' if Ed25519PrivateKey is None else 'cryptography'
+
+def generate_secret():
+    """Get a new random secret key"""
+    return os.urandom(SECRET_LEN)
+
+@functools.lru_cache(maxsize = 8)
+def _private_key(secret):
+    return Ed25519PrivateKey.from_private_bytes(secret)
+
+@functools.lru_cache(maxsize = 8)
+def _public_key(public):
+    return Ed25519PublicKey.from_public_bytes(public)
+
+def public_key(secret):
+    """Get the public key of the secret key"""
+    if Ed25519PrivateKey is None:
+        return _py_public_key(secret)
+    return _private_key(bytes(secret)).public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+
+def sign(secret, msg):
+    """Sign the message. Returns the 64 byte signature"""
+    if Ed25519PrivateKey is None:
+        return _py_sign(secret, msg)
+    return _private_key(bytes(secret)).sign(bytes(msg))
+
+def verify(public, msg, signature):
+    """Check the signature of the message"""
+    if len(public) != PUBLIC_LEN or len(signature) != SIGNATURE_LEN:
+        return False
+    if Ed25519PrivateKey is None:
+        return _py_verify(public, msg, signature)
+
+    try:
+        _public_key(bytes(public)).verify(bytes(signature), bytes(msg))
+    except (InvalidSignature, ValueError):
+        return False
+    return True
+
+# ---------------------------------------------------------------------
+# Plain Python FALLBACK used only if the cryptography package is not
+# installed. It follows the reference implementation of [RFC8032] 6.
+# It is NOT constant time and slow (milliseconds per signature), so a
+# source using it must not sign data chosen by others on a shared host.
+# It is checked against the [RFC8032] 7.1 test vectors when selected.
+# ---------------------------------------------------------------------
+
+P = 2 ** 255 - 19
+L = 2 ** 252 + 27742317777372353535851937790883648493
+D = -121665 * pow(121666, P - 2, P) % P
+SQRT_M1 = pow(2, (P - 1) // 4, P)
+
+def _inv(x):
+    return pow(x, P - 2, P)
+
+def _add(p, q):
+    """Add two points in extended coordinates (X, Y, Z, T)"""
+    a = (p[1] - p[0]) * (q[1] - q[0]) % P
+    b = (p[1] + p[0]) * (q[1] + q[0]) % P
+    c = 2 * p[3] * q[3] * D % P
+    d = 2 * p[2] * q[2] % P
+    (e, f, g, h) = (b - a, d - c, d + c, b + a)
+    return (e * f % P, g * h % P, f * g % P, e * h % P)
+
+def _mul(s, p):
+    """Multiply the point by a scalar"""
+    q = (0, 1, 1, 0)
+    while s > 0:
+        if s & 1:
+            q = _add(q, p)
+        p = _add(p, p)
+        s >>= 1
+    return q
+
+def _equal(p, q):
+    return ((p[0] * q[2] - q[0] * p[2]) % P == 0 and
+            (p[1] * q[2] - q[1] * p[2]) % P == 0)
+
+def _recover_x(y, sign):
+    if y >= P:
+        return None
+    x2 = (y * y - 1) * _inv(D * y * y + 1)
+    if x2 == 0:
+        return None if sign else 0
+
+    x = pow(x2, (P + 3) // 8, P)
+    if (x * x - x2) % P != 0:
+        x = x * SQRT_M1 % P
+    if (x * x - x2) % P != 0:
+        return None
+
+    if (x & 1) != sign:
+        x = P - x
+    return x
+
+_G_Y = 4 * _inv(5) % P
+_G_X = _recover_x(_G_Y, 0)
+G = (_G_X, _G_Y, 1, _G_X * _G_Y % P)
+
+def _base_powers():
+    powers = [G]
+    for _ in range(255):
+        powers.append(_add(powers[-1], powers[-1]))
+    return powers
+
+_G_POWERS = _base_powers()              # 2^i * G. Multiples of the base point need no doublings
+
+def _mul_base(s):
+    """Multiply the base point by a scalar below 2^256"""
+    q = (0, 1, 1, 0)
+    i = 0
+    while s > 0:
+        if s & 1:
+            q = _add(q, _G_POWERS[i])
+        s >>= 1
+        i += 1
+    return q
+
+def _compress(p):
+    z_inv = _inv(p[2])
+    x = p[0] * z_inv % P
+    y = p[1] * z_inv % P
+    return (y | ((x & 1) << 255)).to_bytes(32, 'little')
+
+def _decompress(s):
+    if len(s) != 32:
+        return None
+    y = int.from_bytes(s, 'little')
+    sign = y >> 255
+    y &= (1 << 255) - 1
+
+    x = _recover_x(y, sign)
+    if x is None:
+        return None
+    return (x, y, 1, x * y % P)
+
+def _hash_int(data):
+    return int.from_bytes(hashlib.sha512(data).digest(), 'little') % L
+
+def _expand(secret):
+    if len(secret) != SECRET_LEN:
+        raise ValueError('Bad secret key length {}'.format(len(secret)))
+    h = hashlib.sha512(secret).digest()
+    a = int.from_bytes(h[:32], 'little')
+    a &= (1 << 254) - 8
+    a |= 1 << 254
+    return (a, h[32:])
+
+def _py_public_key(secret):
+    """Get the public key of the secret key"""
+    (a, _) = _expand(secret)
+    return _compress(_mul_base(a))
+
+def _py_sign(secret, msg):
+    """Sign the message. Returns the 64 byte signature"""
+    (a, prefix) = _expand(secret)
+    pub = _compress(_mul_base(a))
+    r = _hash_int(prefix + bytes(msg))
+    r_bytes = _compress(_mul_base(r))
+    h = _hash_int(r_bytes + pub + bytes(msg))
+    s = (r + h * a) % L
+    return r_bytes + s.to_bytes(32, 'little')
+
+def _py_verify(public, msg, signature):
+    a = _decompress(public)
+    if a is None:
+        return False
+    r = _decompress(signature[:32])
+    if r is None:
+        return False
+    s = int.from_bytes(signature[32:], 'little')
+    if s >= L:
+        return False
+
+    h = _hash_int(bytes(signature[:32]) + bytes(public) + bytes(msg))
+    return _equal(_mul_base(s), _add(r, _mul(h, a)))
+
+# [RFC8032] 7.1 TEST 1-3: secret key, public key, message, signature
+RFC8032_VECTORS = [
+    ('9d61b19deffd5a60ba844af492ec2cc44449c5697b326919703bac031cae7f60',
+     'd75a980182b10ab7d54bfed3c964073a0ee172f3daa62325af021a68f707511a',
+     '',
+     'e5564300c360ac729086e2cc806e828a84877f1eb8e5d974d873e065224901555fb8821590a33bacc61e39701cf9b46bd25bf5f0595bbe24655141438e7a100b'),
+    ('4ccd089b28ff96da9db6c346ec114e0f5b8a319f35aba624da8cf6ed4fb8a6fb',
+     '3d4017c3e843895a92b70aa74d1b7ebc9c982ccf2ec4968cc0cd55f12af4660c',
+     '72',
+     '92a009a9f0d4cab8720e820b5f642540a2b27b5416503f8fb3762223ebdb69da085ac1e43e15996e458f3613d0f11d8c387b2eaeb4302aeeb00d291612bb0c00'),
+    ('c5aa8df43f9f837bedb7442f31dcb7b166d38535076f094b85ce3a2e0b4458f7',
+     'fc51cd8e6218a1a38da47ed00230f0580816ed13ba3303ac5deb911548908025',
+     'af82',
+     '6291d657deec24024827e69c3abe01a30ce548a284743a445e3680d7db5ac3ac18ff9b538d16f290ae67f760984dc6594a7c15e9716ed28dc027beceea1ec40a')
+]
+
+def self_test(public_key_func = public_key, sign_func = sign, verify_func = verify):
+    """Check the implementation against the [RFC8032] test vectors. Raises AssertionError on mismatch"""
+    for (secret, public, msg, signature) in RFC8032_VECTORS:
+        (secret, public, msg, signature) = (binascii.unhexlify(x) for x in (secret, public, msg, signature))
+        if public_key_func(secret) != public:
+            raise AssertionError('Public key mismatch')
+        if sign_func(secret, msg) != signature:
+            raise AssertionError('Signature mismatch')
+        if not verify_func(public, msg, signature):
+            raise AssertionError('Valid signature rejected')
+        if verify_func(public, msg + b'x', signature):
+            raise AssertionError('Signature of other message accepted')
+
+if Ed25519PrivateKey is None:
+    self_test(_py_public_key, _py_sign, _py_verify)
+
+if __name__ == "__main__":
+    self_test()
+    self_test(_py_public_key, _py_sign, _py_verify)
+    print('Ed25519 {} backend and the fallback match [RFC8032] 7.1'.format(BACKEND))
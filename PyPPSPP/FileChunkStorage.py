@@ -17,21 +17,44 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import logging
+import asyncio
 import os
 import math
 import time
+import threading
+import collections
 
 from MerkleHashTree import MerkleHashTree
+from MerkleIntegrity import MerkleIntegrity
 from AbstractChunkStorage import AbstractChunkStorage
-from GlobalParams import GlobalParams
+from ChunkIOExecutor import ChunkIOExecutor
+from HaveSidecar import HaveSidecar
+from TreeSidecar import TreeSidecar
 
 class FileChunkStorage(AbstractChunkStorage):
-    """File based chunk storage"""
+    """File based chunk storage. Chunks are read and written using
+       positional I/O, so the file can be used by the I/O threads.
+    """
+    BLOCKING_IO = True
+    IO_THREADS = 4                      # Number of threads doing file I/O
+    WRITE_BUFFER_SIZE = 1024 * 1024     # Flush buffered chunks once this many bytes are buffered
+    WRITE_BUFFER_AGE = 0.5              # Max time a chunk waits in the write buffer (s)
+    MAX_RUN_CHUNKS = 512                # Max chunks written in one syscall
+    CACHE_SIZE = 32 * 1024 * 1024       # Max size of cached chunks (Bytes)
+    READ_AHEAD_CHUNKS = 64              # Chunks are read in aligned blocks of this many chunks
+    PREFETCH_BLOCKS = 4                 # Max blocks read ahead on a request
+    SIDECAR_INTERVAL = 1.0              # Min time between the saves of have-bitmap sidecar (s)
+    HASH_WORKERS = os.cpu_count() or 1  # Worker processes hashing the file at startup
+
+    # fsync policies
+    FSYNC_NONE = 'none'                 # Leave it to the OS
+    FSYNC_FLUSH = 'flush'               # After each flush of the write buffer
+    FSYNC_COMPLETE = 'complete'         # Once the file is complete
 
     def __init__(self, swarm):
         super().__init__(swarm)
 
-        self._mht = MerkleHashTree('sha1', GlobalParams.chunk_size)
+        self._mht = MerkleHashTree('sha1', self._chunk_size, FileChunkStorage.HASH_WORKERS)
         self._file = None
         self._file_completed = False
         self._file_size = 0
@@ -43,24 +66,66 @@ class FileChunkStorage(AbstractChunkStorage):
 
         self._num_chunks = 0
 
-    def Initialize(self, filename = None, filesize = 0):
-        self._num_chunks = math.ceil(filesize / GlobalParams.chunk_size)
+        self._io = ChunkIOExecutor(FileChunkStorage.IO_THREADS)
+        self._pending_writes = {}       # chunk_id -> data not yet written to the file
+        self._write_futures = set()
+        self._write_buffer = {}         # chunk_id -> data waiting to be flushed
+        self._buffered_bytes = 0
+        self._buffer_future = None      # Done once the buffered chunks are written
+        self._flush_handle = None
+        self._fsync = FileChunkStorage.FSYNC_NONE
+
+        self._num_chunks_written = 0
+        self._num_writes = 0
+
+        # LRU cache of chunks read from the file
+        self._cache = collections.OrderedDict()     # chunk_id -> data
+        self._cache_bytes = 0
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._block_reads = {}          # block -> (future, chunks valid in the block)
+        self._num_block_reads = 0
+
+        # Have-bitmap sidecar for resuming downloads
+        self._sidecar = None
+        self._sidecar_handle = None
+        self._sidecar_dirty = False
+        self._sidecar_saving = False
+        self._file_lock = threading.Lock()  # Used only without os.pread / os.pwrite
+
+    def Initialize(self, filename = None, filesize = 0, fsync = FSYNC_NONE):
+        self._fsync = fsync
+        self._num_chunks = math.ceil(filesize / self._chunk_size)
         
         self._file_name = filename
         self._file_size = filesize
+        self._swarm.content_size = filesize
 
-        if os.path.isfile(filename):
+        self._sidecar = HaveSidecar(filename, self._swarm.swarm_id, filesize, self._chunk_size)
+
+        # Received chunks are verified against the swarm id - the root hash
+        self._swarm.integrity = MerkleIntegrity('sha1', self._num_chunks, self._swarm.swarm_id)
+
+        have = None
+        if self._content_exists():
+            have = self._resume_state()
+
+        if have is not None and len(have) < self._num_chunks:
+            logging.info("Partially downloaded file found. Resuming download")
+            self.InitPartialFile(have)
+        elif self._content_exists():
             logging.info("File found. Checking integrity")
-            root_hash = self._mht.get_file_hash(filename)
+            tree = self._content_tree()
             
-            if root_hash is None:
+            if tree is None:
                 logging.info('Root Hash calculation failed. Creating new file')
                 self.InitNewFile()
-            elif self._swarm.swarm_id == root_hash:
+            elif self._swarm.swarm_id == tree.root:
                 logging.info("File integrity checking passed. Starting to share the file")
+                self._swarm.integrity.set_tree(tree)
                 self.InitValidFile()
             else:
-                logging.info("File integrity checking failed. Calculated hash: {}. Recreating file!".format(root_hash))
+                logging.info("File integrity checking failed. Calculated hash: {}. Recreating file!".format(tree.root))
                 self.InitNewFile()
         else:
             logging.info("No file found. Creating an empty file")
@@ -70,21 +135,377 @@ class FileChunkStorage(AbstractChunkStorage):
         self._ts_start = time.time()
         self._ts_end = None
 
+    def _content_exists(self):
+        """Is any of the shared content on the disk"""
+        return os.path.isfile(self._file_name)
+
+    def _resume_state(self):
+        """Load the chunks saved before the restart and the hashes verified
+           for them, so they can be served with their uncle hashes. None if
+           there is no usable sidecar
+        """
+        state = self._sidecar.load()
+        if state is None:
+            return None
+
+        (have, hashes) = state
+        if not self._swarm.integrity.set_known(hashes):
+            logging.info('Hashes in the sidecar do not match the swarm. Ignoring')
+            return None
+        return have
+
+    def _content_tree(self):
+        """Get Merkle hash tree of the content on the disk. Tree stored in
+           the sidecar is used while the file is not changed.
+        """
+        sidecar = self._tree_sidecar()
+        (tree, stored) = sidecar.get_tree(self._mht)
+        if stored:
+            logging.info('Loaded hash tree of the file from %s', sidecar.path)
+        return tree
+
+    def _tree_sidecar(self):
+        """Sidecar storing the hash tree of the content. None if not supported"""
+        return TreeSidecar(self._file_name, self._chunk_size, self._swarm.integrity.digest_size)
+
+    def _open_file(self, mode):
+        """Open the file holding the content"""
+        return open(self._file_name, mode)
+
     def CloseStorage(self):
-        """Close file handle"""
+        """Write out pending chunks and close file handle"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._write_buffer.clear()
+
+        if self._sidecar_handle is not None:
+            self._sidecar_handle.cancel()
+            self._sidecar_handle = None
+
+        self._io.shutdown()
+        if not self._file_completed:
+            for (chunk_id, data) in self._pending_writes.items():
+                self.SaveChunkData(chunk_id, data)
+            self._sidecar.mark(self._pending_writes.keys())
+            self._sidecar.save(self._sidecar.snapshot(self._swarm.integrity.get_known()))
+        self._pending_writes.clear()
+        self._cache.clear()
+        self._cache_bytes = 0
+
         self._file.close()
 
     def GetChunkData(self, chunk):
         """Get required chunk from file"""
-        self._file.seek(chunk * GlobalParams.chunk_size)
-        return self._file.read(GlobalParams.chunk_size)
+        data = self._get_in_memory(chunk)
+        if data is not None:
+            return data
+
+        self._cache_misses += 1
+        data = self._pread(chunk * self._chunk_size, self._chunk_size)
+        if chunk in self._swarm.set_have:
+            self._cache_put(chunk, data)
+        return data
+
+    def read_chunk(self, chunk_id, urgent = False):
+        """Read the aligned block containing the chunk in the I/O threads"""
+        data = self._get_in_memory(chunk_id)
+        if data is not None:
+            return self._done_future(data)
+
+        self._cache_misses += 1
+        priority = ChunkIOExecutor.PRIO_URGENT if urgent else ChunkIOExecutor.PRIO_READ
+        block = chunk_id // FileChunkStorage.READ_AHEAD_CHUNKS
+
+        block_read = self._block_reads.get(block)
+        if block_read is not None and chunk_id not in block_read[1]:
+            # Chunk was not on the disk when the block read started
+            return self._io.submit(priority, self._pread,
+                                   chunk_id * self._chunk_size, self._chunk_size)
+        if block_read is None:
+            block_read = self._read_block(block, priority)
+
+        future = asyncio.get_event_loop().create_future()
+        block_read[0].add_done_callback(
+            lambda f: self._chunk_from_block(chunk_id, block, future, f))
+        return future
+
+    def prefetch(self, start_chunk, end_chunk):
+        """Read ahead aligned blocks covering the requested range"""
+        first_block = start_chunk // FileChunkStorage.READ_AHEAD_CHUNKS
+        last_block = min([end_chunk // FileChunkStorage.READ_AHEAD_CHUNKS,
+                          first_block + FileChunkStorage.PREFETCH_BLOCKS - 1])
+
+        for block in range(first_block, last_block + 1):
+            if block in self._block_reads:
+                continue
+
+            first = max([start_chunk, block * FileChunkStorage.READ_AHEAD_CHUNKS])
+            last = min([end_chunk, (block + 1) * FileChunkStorage.READ_AHEAD_CHUNKS - 1])
+            if any(c in self._swarm.set_have and c not in self._cache for c in range(first, last + 1)):
+                self._read_block(block, ChunkIOExecutor.PRIO_READ)
+
+    def get_stats(self):
+        """Get chunk cache and write buffer statistics"""
+        lookups = self._cache_hits + self._cache_misses
+        stats = {
+            'cache_hits': self._cache_hits,
+            'cache_misses': self._cache_misses,
+            'cache_hit_rate': self._cache_hits / lookups if lookups else 0,
+            'cache_bytes': self._cache_bytes,
+            'cache_chunks': len(self._cache),
+            'block_reads': self._num_block_reads,
+            'chunks_written': self._num_chunks_written,
+            'writes': self._num_writes
+        }
+        return stats
+
+    def _get_in_memory(self, chunk_id):
+        """Get chunk waiting to be written or cached. None if not in memory"""
+        data = self._pending_writes.get(chunk_id)
+        if data is not None:
+            return data
+
+        data = self._cache.get(chunk_id)
+        if data is not None:
+            self._cache.move_to_end(chunk_id)
+            self._cache_hits += 1
+        return data
+
+    def _cache_put(self, chunk_id, data):
+        """Put chunk in the LRU cache, evicting least recently used chunks"""
+        old = self._cache.pop(chunk_id, None)
+        if old is not None:
+            self._cache_bytes -= len(old)
+
+        self._cache[chunk_id] = data
+        self._cache_bytes += len(data)
+
+        while self._cache_bytes > FileChunkStorage.CACHE_SIZE:
+            (_, evicted) = self._cache.popitem(last = False)
+            self._cache_bytes -= len(evicted)
+
+    def _read_block(self, block, priority):
+        """Start reading an aligned block of chunks. Returns (future, valid chunks)"""
+        first = block * FileChunkStorage.READ_AHEAD_CHUNKS
+        last = min([first + FileChunkStorage.READ_AHEAD_CHUNKS, self._num_chunks])
+
+        # Only chunks already written to the disk can be cached
+        valid = set(c for c in range(first, last)
+                    if c in self._swarm.set_have and c not in self._pending_writes)
+
+        future = self._io.submit(priority, self._pread,
+                                 first * self._chunk_size,
+                                 (last - first) * self._chunk_size)
+        self._num_block_reads += 1
+        self._block_reads[block] = (future, valid)
+        future.add_done_callback(lambda f: self._block_read(block, valid, f))
+
+        return (future, valid)
+
+    def _block_read(self, block, valid, future):
+        """Aligned block read completed - cache its chunks"""
+        del self._block_reads[block]
+
+        if future.cancelled() or future.exception() is not None:
+            return
+
+        data = future.result()
+        first = block * FileChunkStorage.READ_AHEAD_CHUNKS
+        for chunk_id in sorted(valid):
+            # Chunk might be written again in the meantime
+            if chunk_id in self._pending_writes:
+                continue
+            offset = (chunk_id - first) * self._chunk_size
+            self._cache_put(chunk_id, data[offset:offset + self._chunk_size])
+
+    def _chunk_from_block(self, chunk_id, block, future, block_future):
+        if future.cancelled():
+            return
+        if block_future.cancelled():
+            future.cancel()
+        elif block_future.exception() is not None:
+            future.set_exception(block_future.exception())
+        else:
+            offset = (chunk_id - block * FileChunkStorage.READ_AHEAD_CHUNKS) * self._chunk_size
+            future.set_result(block_future.result()[offset:offset + self._chunk_size])
+
+    def _pread(self, offset, size):
+        """Read size bytes at offset. Safe to use in I/O threads"""
+        if hasattr(os, 'pread'):
+            return os.pread(self._file.fileno(), size, offset)
+
+        with self._file_lock:
+            self._file.seek(offset)
+            return self._file.read(size)
+
+    def write_chunk(self, chunk_id, data):
+        """Buffer the chunk. Contiguous runs of buffered chunks are written
+           in the I/O threads once the buffer is full or old enough.
+           Chunk is served from memory until it is written.
+        """
+        if self._file_completed:
+            return self._done_future(None)
+
+        self._pending_writes[chunk_id] = data
+        self._write_buffer[chunk_id] = data
+        self._buffered_bytes += len(data)
+
+        if self._buffer_future is None:
+            self._buffer_future = asyncio.get_event_loop().create_future()
+        future = self._buffer_future
+
+        if self._buffered_bytes >= FileChunkStorage.WRITE_BUFFER_SIZE:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_later(
+                FileChunkStorage.WRITE_BUFFER_AGE, self._flush)
+
+        return future
+
+    def drain(self):
+        """Flush the buffer. Get awaitable done once all pending writes are saved"""
+        self._flush()
+
+        if not self._write_futures:
+            return self._done_future(None)
+        return asyncio.gather(*self._write_futures)
+
+    def _flush(self):
+        """Write buffered chunks as contiguous runs"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if not self._write_buffer:
+            return
+
+        runs = []
+        for chunk_id in sorted(self._write_buffer):
+            if runs and chunk_id == runs[-1][0] + len(runs[-1][1]) and len(runs[-1][1]) < FileChunkStorage.MAX_RUN_CHUNKS:
+                runs[-1][1].append(self._write_buffer[chunk_id])
+            else:
+                runs.append((chunk_id, [self._write_buffer[chunk_id]]))
+
+        written = self._write_buffer
+        buffer_future = self._buffer_future
+        self._write_buffer = {}
+        self._buffered_bytes = 0
+        self._buffer_future = None
+
+        self._num_chunks_written += len(written)
+        self._num_writes += len(runs)
+
+        future = self._io.submit(ChunkIOExecutor.PRIO_WRITE, self._write_runs, runs)
+        self._write_futures.add(future)
+        future.add_done_callback(lambda f: self._runs_written(written, buffer_future, f))
+
+    def _write_runs(self, runs):
+        """Write runs of chunks [(first chunk_id, [data])]. Runs in I/O threads"""
+        if self._file_completed:
+            return
+
+        for (chunk_id, buffers) in runs:
+            self._pwrite(chunk_id * self._chunk_size, buffers)
+
+        if self._fsync == FileChunkStorage.FSYNC_FLUSH:
+            self._sync()
+
+    def _pwrite(self, offset, buffers):
+        """Write buffers at offset. Safe to use in I/O threads"""
+        if hasattr(os, 'pwritev'):
+            size = sum(len(b) for b in buffers)
+            written = os.pwritev(self._file.fileno(), buffers, offset)
+            if written < size:
+                # Short write - write the rest in one go
+                os.pwrite(self._file.fileno(), b''.join(buffers)[written:], offset + written)
+            return
+
+        data = b''.join(buffers)
+        if hasattr(os, 'pwrite'):
+            os.pwrite(self._file.fileno(), data, offset)
+            return
+
+        with self._file_lock:
+            self._file.seek(offset)
+            self._file.write(data)
+            self._file.flush()
+
+    def _runs_written(self, written, buffer_future, future):
+        self._write_futures.discard(future)
+
+        # Chunk might be written again in the meantime
+        for (chunk_id, data) in written.items():
+            if self._pending_writes.get(chunk_id) is data:
+                del self._pending_writes[chunk_id]
+
+        if future.cancelled():
+            buffer_future.cancel()
+        elif future.exception() is not None:
+            logging.error('Writing %s chunks failed: %s', len(written), future.exception())
+            buffer_future.set_exception(future.exception())
+        else:
+            self._chunks_saved(written.keys())
+            buffer_future.set_result(None)
+
+    def _chunks_saved(self, chunk_ids):
+        """Record chunks saved in the file in the sidecar. Sidecar is saved in batches"""
+        self._sidecar.mark(chunk_ids)
+        self._sidecar_dirty = True
+
+        if self._sidecar_handle is None and not self._sidecar_saving:
+            self._sidecar_handle = asyncio.get_event_loop().call_later(
+                FileChunkStorage.SIDECAR_INTERVAL, self._save_sidecar)
+
+    def _save_sidecar(self):
+        """Save the sidecar in the I/O threads"""
+        self._sidecar_handle = None
+        if not self._sidecar_dirty or self._file_completed:
+            return
+
+        self._sidecar_dirty = False
+        self._sidecar_saving = True
+        snapshot = self._sidecar.snapshot(self._swarm.integrity.get_known())
+        future = self._io.submit(ChunkIOExecutor.PRIO_WRITE, self._sidecar.save, snapshot)
+        future.add_done_callback(self._sidecar_saved)
+
+    def _sidecar_saved(self, future):
+        self._sidecar_saving = False
+
+        if not future.cancelled() and future.exception() is not None:
+            logging.warning('Saving sidecar failed: %s', future.exception())
+
+        if self._file_completed:
+            # Completed while saving - sidecar is no longer needed
+            self._io.submit(ChunkIOExecutor.PRIO_WRITE, self._sidecar.remove)
+        elif self._sidecar_dirty:
+            self._sidecar_handle = asyncio.get_event_loop().call_later(
+                FileChunkStorage.SIDECAR_INTERVAL, self._save_sidecar)
+
+    def _sync(self):
+        """Flush the file to the disk. Runs in I/O threads"""
+        os.fsync(self._file.fileno())
+
+    def get_file_range(self, start_chunk, end_chunk):
+        """Get (file, offset, count) of the given chunks range.
+           Only available once the file is complete. Each transfer gets
+           own file - sendfile fallback moves the file position while
+           other transfers might be running. The caller closes it.
+        """
+        if not self._file_completed:
+            return None
+
+        offset = start_chunk * self._chunk_size
+        end = min((end_chunk + 1) * self._chunk_size, self._file_size)
+
+        return (open(self._file_name, 'br'), offset, end - offset)
 
     def PostComplete(self):
         """Post complete actions for file storage"""
         self._ts_end = time.time()
         elapsed_time = self._ts_end - self._ts_start
         elapsed_seconds = int(elapsed_time)
-        logging.info("Downloaded in {0}s. Speed: {1}Bps".format(elapsed_seconds, self._file_size / elapsed_seconds))
+        logging.info("Downloaded in {0}s. Speed: {1}Bps".format(elapsed_seconds, int(self._file_size / elapsed_time)))
 
         # Once all downlaoded - stop running the selection alg
         self._swarm.StopChunkRequesting()
@@ -92,30 +513,62 @@ class FileChunkStorage(AbstractChunkStorage):
         # Remove peers limit
         self._swarm._max_peers = None
 
+        logging.info("Wrote {0} chunks in {1} writes".format(self._num_chunks_written, self._num_writes))
+
         # Reopen in read-only
-        self._file.close()
-        self._file = open(self._file_name, 'br')
+        self.ReopenReadOnly()
         self._file_completed = True
+
+        if self._fsync != FileChunkStorage.FSYNC_NONE:
+            self._io.submit(ChunkIOExecutor.PRIO_WRITE, self._sync)
+
+        # Download can no longer be resumed
+        if self._sidecar_handle is not None:
+            self._sidecar_handle.cancel()
+            self._sidecar_handle = None
+        if not self._sidecar_saving:
+            self._io.submit(ChunkIOExecutor.PRIO_WRITE, self._sidecar.remove)
+
+        # All hashes are verified - next start does not have to hash the file
+        self._io.submit(ChunkIOExecutor.PRIO_WRITE, self._save_tree)
             
         logging.info("No more missing chunks. Reopening file read-only!")
         self.BuildHaveRanges()
         self._swarm.SendHaveToMembers()
         self._swarm.ReportData()
 
+    def _save_tree(self):
+        """Store the verified hash tree of the downloaded file. Runs in I/O thread"""
+        sidecar = self._tree_sidecar()
+        tree = self._swarm.integrity.get_tree()
+        if sidecar is None or tree is None:
+            return
+
+        try:
+            sidecar.save(tree, os.stat(self._file_name))
+        except OSError as exc:
+            logging.warning('Saving sidecar %s failed: %s', sidecar.path, exc)
+
+    def ReopenReadOnly(self):
+        """Reopen the completed file in read-only mode"""
+        # Reads running in the I/O threads might still use the old handle
+        old_file = self._file
+        self._file = self._open_file('br')
+        self._io.barrier().add_done_callback(lambda _: old_file.close())
+
     def SaveChunkData(self, chunk_id, data):
         """Save indicated chunk to file"""
         if self._file_completed == True:
             return
 
-        self._file.seek(chunk_id * GlobalParams.chunk_size)
-        self._file.write(data)
-        #logging.info("Wrote chunk {0} to file".format(chunk_id))        
+        self._pwrite(chunk_id * self._chunk_size, [data])
 
     def InitValidFile(self):
         """We have the file and it passes validation"""
-        self._file = open(self._file_name, 'br')
+        self._file = self._open_file('br')
         self._file_completed = True
         self._start_source = True
+        self._sidecar.remove()
 
         # Create set of pieces we have
         for x in range(self._num_chunks):
@@ -128,7 +581,7 @@ class FileChunkStorage(AbstractChunkStorage):
 
     def InitNewFile(self):
         """There is no file, or file is not full"""
-        self._file = open(self._file_name, 'bw')
+        self._file = self._open_file('w+b')
         self._file_completed = False
 
         for x in range(self._num_chunks):
@@ -139,6 +592,34 @@ class FileChunkStorage(AbstractChunkStorage):
 
         logging.info("Created empty file and started chunk selection")
 
+    def InitPartialFile(self, have):
+        """Resume the download. Chunks recorded in the sidecar are trusted"""
+        self._file = self._open_file('r+b')
+        self._file_completed = False
+
+        # Quick check - the file must hold all chunks recorded in the sidecar
+        lost = self._lost_chunks(have)
+        if lost:
+            logging.warning('File is shorter than recorded in the sidecar. Downloading %s chunks again', len(lost))
+            have = have - lost
+            self._sidecar.unmark(lost)
+
+        for x in range(self._num_chunks):
+            if x in have:
+                self._swarm.set_have.add(x)
+            else:
+                self._swarm.set_missing.add(x)
+
+        self.BuildHaveRanges()
+        self._swarm.StartChunkRequesting()
+
+        logging.info("Resuming download. Have {0} of {1} chunks".format(len(have), self._num_chunks))
+
+    def _lost_chunks(self, have):
+        """Get chunks recorded in the sidecar that are beyond the end of the file"""
+        file_size = os.fstat(self._file.fileno()).st_size
+        return set(c for c in have if min([(c + 1) * self._chunk_size, self._file_size]) > file_size)
+
     def BuildHaveRanges(self):
         """Populate have ranges list"""
         self._swarm._have_ranges.clear()
@@ -0,0 +1,141 @@
+"""
+PyPPSPP, a Python3 implementation of Peer-to-Peer Streaming Peer Protocol
+Copyright (C) 2016,2017  J. Poderys, Technical University of Denmark
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import bisect
+import json
+import os
+
+from HaveSidecar import HaveSidecar
+from TreeSidecar import TreeSidecar
+
+class FileManifest(object):
+    """Ordered list of files shared as one swarm. Content of the
+       swarm is the concatenation of the files. Manifest is a JSON
+       file listing the files relative to the manifest's directory:
+       {"files": [{"path": "a/b.dat", "size": 123}, ...]}
+    """
+    SIDECAR_SUFFIXES = (HaveSidecar.SUFFIX, TreeSidecar.SUFFIX)
+
+    def __init__(self, base_dir, files):
+        self.base_dir = base_dir
+        self.files = files              # [(relative path, size)]
+
+        # Offset of each file in the content
+        self._offsets = []
+        offset = 0
+        for (_, size) in files:
+            self._offsets.append(offset)
+            offset += size
+        self.total_size = offset
+
+    @classmethod
+    def load(cls, manifest_path):
+        """Load manifest from the given file"""
+        with open(manifest_path, 'r') as fp:
+            manifest = json.load(fp)
+
+        files = [(f['path'], int(f['size'])) for f in manifest['files']]
+        return cls(os.path.dirname(os.path.abspath(manifest_path)), files)
+
+    @classmethod
+    def from_directory(cls, base_dir, exclude = ()):
+        """Build manifest of all files in the directory tree. Sidecar files are skipped"""
+        exclude = set(os.path.abspath(p) for p in exclude)
+
+        files = []
+        for (dir_path, dir_names, file_names) in os.walk(base_dir):
+            dir_names.sort()
+            for name in sorted(file_names):
+                path = os.path.join(dir_path, name)
+                if os.path.abspath(path) in exclude or name.endswith(FileManifest.SIDECAR_SUFFIXES):
+                    continue
+                size = os.path.getsize(path)
+                if size > 0:
+                    files.append((os.path.relpath(path, base_dir).replace(os.sep, '/'), size))
+
+        return cls(os.path.abspath(base_dir), files)
+
+    def save(self, manifest_path):
+        """Save manifest to the given file. Paths are made relative to it"""
+        manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+        files = [{'path': os.path.relpath(self.path(i), manifest_dir).replace(os.sep, '/'), 'size': size}
+                 for (i, (_, size)) in enumerate(self.files)]
+
+        with open(manifest_path, 'w') as fp:
+            json.dump({'files': files}, fp, indent=1)
+
+    def path(self, index):
+        """Get the full path of the file"""
+        return os.path.join(self.base_dir, *self.files[index][0].split('/'))
+
+    def spans(self, offset, size):
+        """Translate content range into [(file index, offset in the file, length)]"""
+        spans = []
+        index = bisect.bisect_right(self._offsets, offset) - 1
+        end = min([offset + size, self.total_size])
+
+        while offset < end:
+            file_offset = offset - self._offsets[index]
+            length = min([self.files[index][1] - file_offset, end - offset])
+            if length > 0:
+                spans.append((index, file_offset, length))
+                offset += length
+            index += 1
+
+        return spans
+
+    def open_reader(self):
+        """Get a file like object reading the concatenated content"""
+        return ManifestReader(self)
+
+class ManifestReader(object):
+    """Sequential reader of the concatenated files of a manifest"""
+
+    def __init__(self, manifest):
+        self._manifest = manifest
+        self._index = 0
+        self._file = None
+
+    def read(self, size):
+        """Read up to size bytes continuing into the next files"""
+        parts = []
+        while size > 0 and self._index < len(self._manifest.files):
+            if self._file is None:
+                self._file = open(self._manifest.path(self._index), 'rb')
+
+            data = self._file.read(size)
+            if len(data) < size:
+                self._file.close()
+                self._file = None
+                self._index += 1
+
+            parts.append(data)
+            size -= len(data)
+
+        return b''.join(parts)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -17,6 +17,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import binascii
+import hashlib
 import argparse
 import time
 import sys
@@ -24,6 +25,10 @@ import os
 
 from MerkleHashTree import MerkleHashTree
 from GlobalParams import GlobalParams
+from FileManifest import FileManifest
+from TreeSidecar import TreeSidecar
+from LiveIntegrity import LiveIntegrity
+import Ed25519
 
 DATA_BLOCK = 1024
 
@@ -48,22 +53,82 @@ def create_file(path, size):
 
     print('File created in {} sec.'.format(time.time()-t_start))
 
-def calculate_hash(path):
-    """Calculate a hash of a given file"""
+def calculate_hash(path, chunk_size, workers):
+    """Calculate a hash of a given file using each given number of worker processes"""
 
     print('Calculating Merkle Tree Hash of file {}'.format(path))
+    file_size = os.path.getsize(path)
+
+    for num_workers in workers:
+        t_start = time.time()
+
+        mht = MerkleHashTree('sha1', chunk_size, num_workers)
+        hash = mht.get_file_hash(path)
+
+        if hash is None:
+            print('Error calculating file hash!')
+            return
+
+        t_calc = time.time() - t_start
+        print('Given file hash is: {}. Calculated by {} workers in {:.2f} s ({:.1f} MB/s).'.format(
+            str(binascii.hexlify(hash)), num_workers, t_calc, file_size / t_calc / 1000000))
+
+def create_manifest(directory, manifest_path):
+    """Create a manifest listing all files in a given directory"""
+
+    manifest = FileManifest.from_directory(directory, exclude = [manifest_path])
+    manifest.save(manifest_path)
+
+    print('Manifest {} lists {} files having a size of {} Bytes'.format(
+        manifest_path, len(manifest.files), manifest.total_size))
+
+def calculate_manifest_hash(manifest_path, chunk_size):
+    """Calculate a hash of the concatenated files listed in a manifest"""
+
+    manifest = FileManifest.load(manifest_path)
+    print('Calculating Merkle Tree Hash of {} files in manifest {}'.format(
+        len(manifest.files), manifest_path))
     t_start = time.time()
 
+    mht = MerkleHashTree('sha1', chunk_size)
+    with manifest.open_reader() as reader:
+        hash = mht.get_stream_hash(reader, manifest.total_size)
 
-    mht = MerkleHashTree('sha1', GlobalParams.chunk_size)
-    hash = mht.get_file_hash(path)
+    print('Manifest hash is: {}. Content size: {} Bytes. Calculated in {:.2f} s.'.format(
+        str(binascii.hexlify(hash)), manifest.total_size, time.time() - t_start))
 
-    if hash is None:
-        print('Error calculating file hash!')
-        return
+def refresh_sidecars(paths, chunk_size, workers):
+    """Build hash tree sidecars of the given files. Sidecars of unchanged files are kept"""
+
+    mht = MerkleHashTree('sha1', chunk_size, workers)
+    digest_size = hashlib.new('sha1').digest_size
+    t_start = time.time()
+    num_built = 0
 
-    print('Given file hash is: {}. Calculated in {:.2f} s.'.format(
-        str(binascii.hexlify(hash)), time.time() - t_start))
+    for path in paths:
+        t_file = time.time()
+        sidecar = TreeSidecar(path, chunk_size, digest_size)
+        (tree, stored) = sidecar.get_tree(mht)
+
+        if tree is None:
+            print('{}: Error calculating file hash!'.format(path))
+        elif stored:
+            print('{}: Up to date. Hash: {}'.format(path, str(binascii.hexlify(tree.root))))
+        else:
+            num_built += 1
+            print('{}: Built in {:.2f} s. Hash: {}'.format(
+                path, time.time() - t_file, str(binascii.hexlify(tree.root))))
+
+    print('Built {} of {} sidecars in {:.2f} s.'.format(num_built, len(paths), time.time() - t_start))
+
+def create_live_key(path):
+    """Create a secret key signing a live stream. Its public key is the swarm id"""
+
+    secret_key = Ed25519.generate_secret()
+    LiveIntegrity.save_secret(path, secret_key)
+
+    print('Live source key saved to {}. Swarm id: {}'.format(
+        path, binascii.hexlify(LiveIntegrity.swarm_id(secret_key)).decode()))
 
 def main(args):
     # Basic arguments corectness check
@@ -71,17 +136,50 @@ def main(args):
         print('Size and Filename are mandatory when creating a file')
         return
 
-    if args.hash and not args.filename:
-        print('Filename is mandatory when calculating a hash')
+    if args.hash and not args.filename and not args.manifest:
+        print('Filename or Manifest is mandatory when calculating a hash')
         return
 
+    if args.dir and not args.manifest and not args.sidecar:
+        print('Manifest is mandatory when listing a directory')
+        return
+
+    if args.sidecar and not args.filename and not args.manifest and not args.dir:
+        print('Filename, Manifest or Directory is mandatory when building sidecars')
+        return
+
+    # Create a live source key if required
+    if args.livekey:
+        create_live_key(args.livekey)
+
     # Create a file if required
     if args.create:
         create_file(args.filename, args.size)
 
+    # Create a manifest if required
+    if args.dir and args.manifest:
+        create_manifest(args.dir, args.manifest)
+
     # Calculate a hash if required
-    if args.hash:
-        calculate_hash(args.filename)
+    if args.hash and args.manifest:
+        calculate_manifest_hash(args.manifest, args.chunksize)
+    elif args.hash:
+        calculate_hash(args.filename, args.chunksize, args.workers)
+
+    # Build hash tree sidecars if required
+    if args.sidecar:
+        if args.dir:
+            manifest = FileManifest.from_directory(args.dir)
+        elif args.manifest:
+            manifest = FileManifest.load(args.manifest)
+        else:
+            manifest = None
+
+        if manifest is not None:
+            paths = [manifest.path(i) for i in range(len(manifest.files))]
+        else:
+            paths = [args.filename]
+        refresh_sidecars(paths, args.chunksize, max(args.workers))
 
 def parse_args():
     if len(sys.argv) == 1:
@@ -93,6 +191,12 @@ def parse_args():
     parser.add_argument('--size', help='File size in Bytes', type=int)
     parser.add_argument('--create', help='Create a file with random data having indicated size', action='store_true')
     parser.add_argument('--hash', help='Calculate hash of a given or created file', action='store_true')
+    parser.add_argument('--chunksize', help='Chunk size used in hash calculation (Bytes)', type=int, default=GlobalParams.chunk_size)
+    parser.add_argument('--workers', help='Numbers of worker processes to calculate the hash with', nargs='+', type=int, default=[os.cpu_count() or 1])
+    parser.add_argument('--manifest', help='Path to manifest of files shared as one swarm')
+    parser.add_argument('--dir', help='Create the manifest listing all files in this directory')
+    parser.add_argument('--livekey', help='Create a live source signing key in this file and print the swarm id')
+    parser.add_argument('--sidecar', help='Build or refresh hash tree sidecars of the file, manifest files or all files in --dir', action='store_true')
 
     args = parser.parse_args()
     print(vars(args))
@@ -0,0 +1,41 @@
+"""
+PyPPSPP, a Python3 implementation of Peer-to-Peer Streaming Peer Protocol
+Copyright (C) 2016,2017  J. Poderys, Technical University of Denmark
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from AbstractCongestionControl import AbstractCongestionControl
+
+class FixedRate(AbstractCongestionControl):
+    """Sending at a fixed rate without reacting to delay or loss.
+       Lost data is still retransmitted by the sending algorithm.
+    """
+    DEFAULT_RATE = 1000000      # Bytes per second
+
+    def __init__(self, rate = None):
+        super().__init__()
+
+        if rate is None:
+            rate = FixedRate.DEFAULT_RATE
+        if rate <= 0:
+            raise ValueError('Sending rate must be positive: {}'.format(rate))
+        self._rate = rate
+
+    def next_send_time(self, outbound_data, now):
+        """Space packets so the sending rate is not exceeded"""
+        if self._last_datasend is None:
+            return now
+
+        return max(now, self._last_datasend + outbound_data / self._rate)
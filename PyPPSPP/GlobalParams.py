@@ -24,7 +24,7 @@ class GlobalParams(object):
     chunk_addressing_method = 2
     chunk_size = 1024
     supported_messages_len = 2
-    supported_messages = b'11110110 11110000'
+    supported_messages = b'11110111 11110000'
     #                      +|-|-|-| |-|-|-|- HANDSHAKE
     #                       +-|-|-| |-|-|-|- DATA
     #                        +|-|-| |-|-|-|- ACK
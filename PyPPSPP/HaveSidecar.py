@@ -0,0 +1,100 @@
+"""
+PyPPSPP, a Python3 implementation of Peer-to-Peer Streaming Peer Protocol
+Copyright (C) 2016,2017  J. Poderys, Technical University of Denmark
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import os
+import struct
+
+class HaveSidecar(object):
+    """Bitmap of the chunks of a partially downloaded file that are
+       saved to the disk, followed by the hashes verified so far. Kept
+       in a small file next to the data file, so an interrupted download
+       can be resumed and the saved chunks served with their uncle hashes.
+    """
+    MAGIC = b'PPSPPHAV'
+    HEADER = struct.Struct('>8sHQI')    # Magic, swarm ID length, file size, chunk size
+    SUFFIX = '.have'
+
+    def __init__(self, filename, swarm_id, filesize, chunk_size):
+        self._path = filename + HaveSidecar.SUFFIX
+        self._swarm_id = swarm_id
+        self._filesize = filesize
+        self._chunk_size = chunk_size
+        self._num_chunks = (filesize + chunk_size - 1) // chunk_size
+        self._bitmap = bytearray((self._num_chunks + 7) // 8)
+
+    def load(self):
+        """Load the sidecar. Returns (set of chunks saved in the data file,
+           verified hashes) or None if the sidecar is missing or does not match.
+        """
+        try:
+            with open(self._path, 'rb') as fp:
+                data = fp.read()
+        except OSError:
+            return None
+
+        header_len = HaveSidecar.HEADER.size
+        if len(data) < header_len:
+            return None
+
+        (magic, id_len, filesize, chunk_size) = HaveSidecar.HEADER.unpack_from(data)
+        swarm_id = data[header_len:header_len + id_len]
+        bitmap_start = header_len + id_len
+        bitmap = data[bitmap_start:bitmap_start + len(self._bitmap)]
+        hashes = data[bitmap_start + len(self._bitmap):]
+
+        if (magic != HaveSidecar.MAGIC or swarm_id != self._swarm_id or
+                filesize != self._filesize or chunk_size != self._chunk_size or
+                len(bitmap) != len(self._bitmap) or not hashes):
+            logging.info('Sidecar %s does not match the swarm. Ignoring', self._path)
+            return None
+
+        self._bitmap[:] = bitmap
+        have = set(c for c in range(self._num_chunks)
+                   if self._bitmap[c >> 3] & (0x80 >> (c & 7)))
+        return (have, hashes)
+
+    def mark(self, chunk_ids):
+        """Mark chunks as saved in the data file"""
+        for c in chunk_ids:
+            self._bitmap[c >> 3] |= 0x80 >> (c & 7)
+
+    def unmark(self, chunk_ids):
+        """Mark chunks as not available"""
+        for c in chunk_ids:
+            self._bitmap[c >> 3] &= ~(0x80 >> (c & 7)) & 0xFF
+
+    def snapshot(self, hashes):
+        """Get serialized sidecar with the given verified hashes"""
+        return (HaveSidecar.HEADER.pack(HaveSidecar.MAGIC, len(self._swarm_id),
+                                        self._filesize, self._chunk_size) +
+                self._swarm_id + bytes(self._bitmap) + hashes)
+
+    def save(self, snapshot):
+        """Atomically replace the sidecar with the given snapshot"""
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'wb') as fp:
+            fp.write(snapshot)
+        os.replace(tmp_path, self._path)
+
+    def remove(self):
+        """Remove the sidecar once the download is complete"""
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,242 @@
+"""
+PyPPSPP, a Python3 implementation of Peer-to-Peer Streaming Peer Protocol
+Copyright (C) 2016,2017  J. Poderys, Technical University of Denmark
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Benchmark of the content integrity protection on the receive path.
+Chunks of a random file arrive in sequential or random order, each
+preceded by the INTEGRITY messages a seeder sends with it. The time
+to parse the hashes and verify the chunks is compared against no
+verification and against verifying each chunk up to the root hash
+without keeping the verified hashes. In live mode the chunks are signed
+in batches by a live source and the receiver verifies one signature per
+batch - batch of 1 is a signature per chunk.
+"""
+
+import argparse
+import io
+import json
+import random
+import time
+
+from GlobalParams import GlobalParams
+from MerkleHashTree import MerkleHashTree, bin_parent, bin_sibling
+from MerkleIntegrity import MerkleIntegrity
+from LiveIntegrity import LiveIntegrity
+from Messages import MsgIntegrity, MsgSignedIntegrity
+from Messages.MessageTypes import MsgTypes
+import Ed25519
+
+HASH_FUNC = 'sha1'
+ORDERS = ['sequential', 'random']
+
+class NoIntegrity(MerkleIntegrity):
+    """Baseline without any verification"""
+
+    def uncles(self, chunk_id):
+        return []
+
+    def verify(self, chunk_id, data, hashes):
+        return True
+
+class PathIntegrity(MerkleIntegrity):
+    """Verify each chunk up to the root hash. Verified hashes are not kept,
+       so the seeder has to send all uncle hashes with every chunk.
+    """
+
+    def verify(self, chunk_id, data, hashes):
+        tree = self._tree
+        node_hash = self._hash(data)
+        node = 2 * chunk_id
+        for _ in range(tree.height):
+            sibling = bin_sibling(node)
+            if not tree.is_content(sibling):
+                sibling_hash = bytes(self.digest_size)
+            else:
+                sibling_hash = hashes.pop(sibling, None)
+                if sibling_hash is None:
+                    self.num_incomplete += 1
+                    return None
+
+            if node > sibling:
+                node_hash = self._hash(sibling_hash + node_hash)
+            else:
+                node_hash = self._hash(node_hash + sibling_hash)
+            node = bin_parent(node)
+
+        if node_hash != tree.root:
+            self.num_failed += 1
+            return False
+
+        self.num_verified += 1
+        return True
+
+MODES = {
+    'none': NoIntegrity,
+    'cached': MerkleIntegrity,
+    'path': PathIntegrity
+}
+
+def build_datagrams(seeder, receiver, order):
+    """Get INTEGRITY messages sent by a seeder before each chunk"""
+    resend = isinstance(receiver, PathIntegrity)
+    # Munros a live receiver needs are not known before they arrive
+    uncles = seeder.uncles if isinstance(receiver, LiveIntegrity) else receiver.uncles
+
+    sent = set()
+    datagrams = []
+    for chunk_id in order:
+        wb = bytearray()
+        for node in uncles(chunk_id):
+            if node in sent and not resend:
+                continue
+            msg = MsgIntegrity.MsgIntegrity()
+            (msg.start_chunk, msg.end_chunk) = seeder.node_to_range(node)
+            msg.hash_data = seeder.get_hash(node)
+            wb.extend(msg.BuildBinaryMessage())
+            sent.add(node)
+
+            signature = seeder.get_signature(node)
+            if signature is not None:
+                msg = MsgSignedIntegrity.MsgSignedIntegrity(seeder.SIGNATURE_ALG)
+                (msg.start_chunk, msg.end_chunk) = seeder.node_to_range(node)
+                (msg.timestamp, msg.signature) = signature
+                wb.extend(msg.BuildBinaryMessage())
+        datagrams.append(bytes(wb))
+
+    return datagrams
+
+def receive(integrity, content, chunk_size, order, datagrams):
+    """Parse INTEGRITY and SIGNED_INTEGRITY messages and verify the chunks as SwarmMember does"""
+    hashes = {}
+    for (chunk_id, integrity_msgs) in zip(order, datagrams):
+        offset = 1
+        while offset < len(integrity_msgs):
+            if integrity_msgs[offset - 1] == MsgTypes.SIGNED_INTEGRITY:
+                msg = MsgSignedIntegrity.MsgSignedIntegrity(integrity.SIGNATURE_ALG)
+                offset += msg.ParseReceivedData(integrity_msgs, offset) + 1
+                if not integrity.add_signature(msg.start_chunk, msg.end_chunk, msg.timestamp, msg.signature, hashes):
+                    raise RuntimeError('Signature of chunks {}-{} failed verification'.format(msg.start_chunk, msg.end_chunk))
+                continue
+
+            msg = MsgIntegrity.MsgIntegrity()
+            offset += msg.ParseReceivedData(integrity_msgs, offset) + 1
+            node = integrity.range_to_node(msg.start_chunk, msg.end_chunk)
+            hashes[node] = msg.hash_data
+
+        data = content[chunk_id * chunk_size:(chunk_id + 1) * chunk_size]
+        if not integrity.verify(chunk_id, data, hashes):
+            raise RuntimeError('Chunk {} failed verification'.format(chunk_id))
+
+def live_source(content, chunk_size, sig_batch, seed):
+    """Sign the content as a live source. Returns (source, swarm id, signed chunks, time)"""
+    secret_key = random.Random(seed).getrandbits(256).to_bytes(Ed25519.SECRET_LEN, 'little')
+    swarm_id = LiveIntegrity.swarm_id(secret_key)
+    source = LiveIntegrity(HASH_FUNC, swarm_id, chunk_size, sig_batch, secret_key)
+
+    # Only complete batches are signed
+    start = time.perf_counter()
+    num_chunks = source.sign_chunks(lambda x: content[x * chunk_size:(x + 1) * chunk_size], len(content) // chunk_size)
+    sign_time = time.perf_counter() - start
+
+    return (source, swarm_id, num_chunks, sign_time)
+
+def run_one(content, chunk_size, order_name, mode, seed, sig_batch = None):
+    """Receive all chunks once. Returns the results dict"""
+    source_time = None
+    if mode == 'live':
+        (seeder, swarm_id, num_chunks, source_time) = live_source(content, chunk_size, sig_batch, seed)
+        integrity = LiveIntegrity(HASH_FUNC, swarm_id, chunk_size, sig_batch)
+    else:
+        tree = MerkleHashTree(HASH_FUNC, chunk_size).get_stream_tree(io.BytesIO(content), len(content))
+        num_chunks = tree.num_chunks
+        seeder = MerkleIntegrity(HASH_FUNC, num_chunks, tree.root)
+        seeder.set_tree(tree)
+        integrity = MODES[mode](HASH_FUNC, num_chunks, tree.root)
+
+    order = list(range(num_chunks))
+    if order_name == 'random':
+        random.Random(seed).shuffle(order)
+    datagrams = build_datagrams(seeder, integrity, order)
+
+    start = time.perf_counter()
+    receive(integrity, content, chunk_size, order, datagrams)
+    run_time = time.perf_counter() - start
+
+    return {
+        'chunk_size': chunk_size,
+        'order': order_name,
+        'mode': mode,
+        'sig_batch': sig_batch,
+        'chunks': num_chunks,
+        'time': run_time,
+        'us_per_chunk': run_time / num_chunks * 1000000,
+        'throughput': num_chunks * chunk_size / run_time,
+        'source_us_per_chunk': source_time / num_chunks * 1000000 if source_time is not None else None,
+        'hashes_per_chunk': integrity.num_hashes / num_chunks,
+        'integrity_bytes_per_chunk': sum(len(d) for d in datagrams) / num_chunks
+    }
+
+def print_results(results):
+    """Print results table"""
+    print('{:>6} {:<10} {:<6} {:>5} {:>8} {:>9} {:>9} {:>8} {:>10} {:>10}'.format(
+        'Chunk', 'Order', 'Mode', 'Batch', 'Time s', 'us/chunk', 'MB/s', 'Hash/ch', 'INT B/ch', 'Src us/ch'))
+
+    for r in results:
+        print('{:>6} {:<10} {:<6} {:>5} {:>8.3f} {:>9.2f} {:>9.1f} {:>8.2f} {:>10.1f} {:>10}'.format(
+            r['chunk_size'],
+            r['order'],
+            r['mode'],
+            r['sig_batch'] or '-',
+            r['time'],
+            r['us_per_chunk'],
+            r['throughput'] / 1000000,
+            r['hashes_per_chunk'],
+            r['integrity_bytes_per_chunk'],
+            '{:.2f}'.format(r['source_us_per_chunk']) if r['source_us_per_chunk'] is not None else '-'))
+
+def main(args):
+    content = random.Random(args.seed).getrandbits(8 * args.size).to_bytes(args.size, 'little')
+    print('Content: {} B'.format(args.size))
+
+    results = []
+    for chunk_size in args.chunksize:
+        for order in args.order:
+            for mode in args.mode:
+                if mode == 'live':
+                    for sig_batch in args.sigbatch:
+                        results.append(run_one(content, chunk_size, order, mode, args.seed, sig_batch))
+                else:
+                    results.append(run_one(content, chunk_size, order, mode, args.seed))
+
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump({'args': vars(args), 'results': results}, fp, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark chunk verification on the receive path")
+    parser.add_argument('--size', help='Size of the received content (Bytes)', type=int, default=16*1024*1024)
+    parser.add_argument('--chunksize', help='Chunk sizes to run (Bytes)', nargs='+', type=int, default=[GlobalParams.chunk_size])
+    parser.add_argument('--order', help='Order of the received chunks', nargs='+', choices=ORDERS, default=ORDERS)
+    parser.add_argument('--mode', help='Verification modes to run', nargs='+', choices=sorted(MODES) + ['live'], default=sorted(MODES) + ['live'])
+    parser.add_argument('--sigbatch', help='Live chunks covered by one signature', nargs='+', type=int, default=[LiveIntegrity.CHUNKS_PER_SIG])
+    parser.add_argument('--seed', help='Seed of the content and the random order', type=int, default=1)
+    parser.add_argument('--json', help='Save results to the given JSON file', nargs='?')
+
+    main(parser.parse_args())
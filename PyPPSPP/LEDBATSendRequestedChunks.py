@@ -18,97 +18,222 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import time
 import asyncio
+import bisect
 import collections
-import struct
 import logging
 
 from Messages import *
 from AbstractSendRequestedChunks import AbstractSendRequestedChunks
 
 class LEDBATSendRequestedChunks(AbstractSendRequestedChunks):
-    """Sending of requested chunks using LEDBAT"""
-    WINDOWLEN = 5
+    """Sending of requested chunks over UDP. Sends are limited and paced
+       by the congestion controller of the member (LEDBAT by default).
+       Lost chunks are detected per chunk, either by the retransmission
+       timeout or by being overtaken by DUPTHRESH later sent chunks.
+    """
+    DATA_OVERHEAD = 4 + 1 + 4 + 4 + 8   # Channel + DATA header
+    DUPTHRESH = 3                       # Number of later sent chunks ACKed before fast retransmit
 
     def __init__(self, swarm, member):
-        self._ret_control = collections.deque(
-           LEDBATSendRequestedChunks.WINDOWLEN * [None],
-           LEDBATSendRequestedChunks.WINDOWLEN)
+        self._loop = asyncio.get_event_loop()
+        # chunk_id -> [send time, bytes, is retransmit, times overtaken]. In the order of sending
+        self._in_flight = collections.OrderedDict()
+        self._lost = collections.OrderedDict()      # Ordered set of chunks to retransmit
+        self._cwnd_blocked = False                  # Waiting for ACKs to open cwnd
+        self._rto_restart = 0                       # Time the retransmission timer was restarted after it expired
         return super().__init__(swarm, member)
 
-    def _build_and_send(self, chunk_id):
+    def _build_and_send(self, chunk_id, data, now, is_retransmit):
         """Build DATA message with indicated chunk"""
-        data = self._swarm.GetChunkData(chunk_id)
-        
         md = MsgData.MsgData(self._member.chunk_size, self._member.chunk_addressing_method)
         md.start_chunk = chunk_id
         md.end_chunk = chunk_id
         md.data = data
         md.timestamp = int((time.time() * 1000000))
 
-        mdata_bin = bytearray()
-        mdata_bin[0:4] = struct.pack('>I', self._member.remote_channel)
-        mdata_bin[4:] = md.BuildBinaryMessage()
+        mdata_bin = self._build_data(md, is_retransmit or chunk_id in self._in_flight)
 
         self._member.SendAndAccount(mdata_bin)
         self._member.set_sent.add(chunk_id)
 
-    def SendAndSchedule(self):
-        """Send requested data using LEDBAT"""
-
-        # Get lowest chunk in flight
-        min_in_fligh = None
-        if any(self._member.set_sent):
-            min_in_fligh = min(self._member.set_sent)
+        # Chunk re-requested by the peer while in flight - previous copy is lost
+        previous = self._in_flight.pop(chunk_id, None)
+        if previous is not None:
+            self._member._cc.on_loss(now, previous[1])
+            is_retransmit = True
+
+        msg_len = len(mdata_bin)
+        self._in_flight[chunk_id] = [now, msg_len, is_retransmit, 0]
+        self._member._cc.on_send(msg_len, now)
+
+        if is_retransmit:
+            self._member._num_retransmits += 1
+
+    def _mark_lost(self, chunk_id):
+        """Move chunk from in flight to retransmit queue. Returns lost bytes"""
+        sent = self._in_flight.pop(chunk_id)
+        self._lost[chunk_id] = None
+        return sent[1]
+
+    def _detect_timeout_loss(self, now):
+        """Detect chunks lost due to retransmission or congestion timeouts"""
+        if not self._in_flight:
+            return
+
+        cc = self._member._cc
+
+        # Everything in flight is lost if nothing was ACKed within CTO
+        if cc.check_timeout(now):
+            logging.info('Member %s: no ACKs within CTO. Resending %s chunks in flight',
+                         self._member, len(self._in_flight))
+            for chunk_id in list(self._in_flight):
+                self._mark_lost(chunk_id)
+                self._member._num_rto_losses += 1
+            return
+
+        # Oldest chunk in flight not ACKed within RTO
+        (chunk_id, sent) = next(iter(self._in_flight.items()))
+        if now - max([sent[0], self._rto_restart]) >= cc.timeout:
+            # Back off once and restart the timer for the rest in flight [RFC6298] 5.5-5.7
+            cc.backoff()
+            self._rto_restart = now
+            cc.on_loss(now, self._mark_lost(chunk_id))
+            self._member._num_rto_losses += 1
+
+    def _detect_fast_loss(self, acked_times, now):
+        """Detect chunks overtaken by DUPTHRESH later sent and ACKed chunks"""
+        acked_times.sort()
+        newest_acked = acked_times[-1]
+
+        lost = []
+        for (chunk_id, sent) in self._in_flight.items():
+            # Chunks are in order of sending
+            if sent[0] >= newest_acked:
+                break
+            sent[3] += len(acked_times) - bisect.bisect_right(acked_times, sent[0])
+            if sent[3] >= LEDBATSendRequestedChunks.DUPTHRESH:
+                lost.append(chunk_id)
+
+        if not lost:
+            return
+
+        bytes_lost = 0
+        for chunk_id in lost:
+            bytes_lost += self._mark_lost(chunk_id)
+        self._member._num_fast_losses += len(lost)
+        self._member._cc.on_loss(now, bytes_lost)
+
+    def _select_chunk(self):
+        """Select next chunk to send. Returns (chunk_id, is_retransmit)"""
+
+        # Retransmissions go first
+        while self._lost:
+            chunk_id = next(iter(self._lost))
+            if chunk_id in self._member.set_requested:
+                return (chunk_id, True)
+            # Peer is no longer interested
+            del self._lost[chunk_id]
 
         # Chunks I have and member is interested
         set_to_send = (self._swarm.set_have & self._member.set_requested) - self._member.set_sent
-        any_to_send = any(set_to_send)
-
-        if min_in_fligh is None:
-            # All is acknowledged. Try to send next requested
-            if any_to_send:
-                # We have stuff to send
-                next_id = min(set_to_send)
-                self._build_and_send(next_id)
-                self._ret_control.appendleft(next_id)
+        if set_to_send:
+            return (min(set_to_send), False)
+
+        return (None, False)
+
+    def _next_timeout(self):
+        """Time when the oldest chunk in flight times out"""
+        (sent_time, _, _, _) = next(iter(self._in_flight.values()))
+        return max([sent_time, self._rto_restart]) + self._member._cc.timeout
+
+    def _schedule_at(self, when):
+        """Schedule the next run of the sending algorithm"""
+        if when <= self._loop.time():
+            self._member._sending_handle = self._loop.call_soon(
+                self._member.SendRequestedChunks)
         else:
-            # We have chunks in flight. Get earliest in-flight id
-            deq_front = self._ret_control[LEDBATSendRequestedChunks.WINDOWLEN-1]
-
-            if deq_front is None:
-                # Send as normal, not enough in-flight chunks
-                if any_to_send:
-                    # We have stuff to send
-                    next_id = min(set_to_send)
-                    self._build_and_send(next_id)
-                    self._ret_control.appendleft(next_id)
+            self._member._sending_handle = self._loop.call_at(
+                when, self._member.SendRequestedChunks)
+
+    def SendAndSchedule(self):
+        """Send requested data within the congestion window"""
+        cc = self._member._cc
+        now = self._loop.time()
+        self._cwnd_blocked = False
+
+        self._detect_timeout_loss(now)
+
+        (chunk_id, is_retransmit) = self._select_chunk()
+
+        if chunk_id is None:
+            if not self._in_flight:
+                # Nothing in flight and nothing to send - park until woken up
+                self._member._sending_handle = None
             else:
-                # Check if we need to retransmit
-                if min_in_fligh <= deq_front:
-                    # Retransmit
-                    self._build_and_send(min_in_fligh)
-                    self._member._ledbat.data_loss()
-                    #logging.info("Data loss. Min in flight: {}. Delay: {}"
-                    #             .format(min_in_fligh, self._member._ledbat._cto / 1000000))
-                else:
-                    # Send as normal
-                    if any_to_send:
-                        # We have stuff to send
-                        next_id = min(set_to_send)
-                        self._build_and_send(next_id)
-                        self._ret_control.appendleft(next_id)
-
-        # Check if sending still needed?
-        if len(self._member.set_sent) > 0 and len(self._member.set_requested) > 0:
+                # Wait for ACKs of the data in flight
+                self._cwnd_blocked = True
+                self._schedule_at(self._next_timeout())
+            return
+
+        msg_len = self._member.chunk_size + LEDBATSendRequestedChunks.DATA_OVERHEAD
+
+        send_time = cc.next_send_time(msg_len, now)
+        if send_time is None:
+            # Wait for ACKs to open cwnd (see on_ack)
+            self._cwnd_blocked = True
+            self._schedule_at(self._next_timeout())
+            return
+
+        # Paced sending
+        if send_time > now:
+            self._schedule_at(send_time)
+            return
+
+        # Retransmissions are urgent - read them before other chunks
+        data = self._get_chunk_data(chunk_id, urgent = is_retransmit)
+        if data is None:
+            # Park until read from the storage
             self._member._sending_handle = None
+            return
 
-        # Get delay before next send
-        #delay = max([self._member._ledbat.get_delay(self._member.chunk_size), 0.01])
-        delay = self._member._ledbat.get_delay(self._member.chunk_size)
-        #logging.info("Delay: {}".format(delay))
-        if delay <= 0:
-            self._member._sending_handle = asyncio.get_event_loop().call_soon(
-                self._member.SendRequestedChunks)
+        if is_retransmit:
+            del self._lost[chunk_id]
+        self._build_and_send(chunk_id, data, now, is_retransmit)
+
+        send_time = cc.next_send_time(msg_len, now)
+        if send_time is None:
+            self._cwnd_blocked = True
+            self._schedule_at(self._next_timeout())
         else:
-            self._member._sending_handle = asyncio.get_event_loop().call_later(
-                delay, self._member.SendRequestedChunks)
+            self._schedule_at(send_time)
+
+    def on_ack(self, chunk_ids, delay_samples):
+        """Feed ACKed data to the congestion controller and wake up sender if waiting for cwnd"""
+        now = self._loop.time()
+
+        bytes_acked = 0
+        rtt = None
+        acked_times = []
+        for chunk_id in chunk_ids:
+            self._lost.pop(chunk_id, None)
+            sent = self._in_flight.pop(chunk_id, None)
+            if sent is None:
+                continue
+            (sent_time, sent_len, is_retransmit, _) = sent
+            bytes_acked += sent_len
+            acked_times.append(sent_time)
+            # Karn's algorithm - do not sample RTT of retransmitted data
+            if not is_retransmit:
+                rtt = now - sent_time
+
+        self._member._cc.on_ack(bytes_acked, delay_samples, now, rtt)
+
+        if acked_times:
+            self._detect_fast_loss(acked_times, now)
+
+        if self._cwnd_blocked:
+            if self._member._sending_handle is not None:
+                self._member._sending_handle.cancel()
+                self._member._sending_handle = None
+            self._cwnd_blocked = False
+            self._member.wake_sender()
@@ -33,6 +33,9 @@ if __name__ == "__main__" and __package__ is None:
 
 class PeerProtocol(asyncio.DatagramProtocol):
     LOGINT = 1
+    HEADER = struct.Struct('>cIQ')      # Type, seq, timestamp
+    DATA_SIZE = 1024
+    MSG_SIZE = HEADER.size + DATA_SIZE  # Bytes sent in each message
 
     def __init__(self, args):
         self._peer_addr = (args.target_ip, 6778)
@@ -63,8 +66,9 @@ class PeerProtocol(asyncio.DatagramProtocol):
         type = data[0]
         seq, ts = struct.unpack('>IQ', data[1:13])
         assert type == 2
-        self._in_flight.discard(seq)
-        self._ledbat.feed_ack([ts], 1)
+        if seq in self._in_flight:
+            self._in_flight.discard(seq)
+            self._ledbat.on_ack(PeerProtocol.MSG_SIZE, [ts], self._loop.time())
 
     def error_received(self, exc):
         logging.warning("Error received: {0}".format(exc))
@@ -130,11 +134,11 @@ class PeerProtocol(asyncio.DatagramProtocol):
     def __build_msg(self, seq):
         """Build a fake message with the given seq number"""
         msg_bin = bytearray()
-        msg_bin.extend(struct.pack('>cIQ',
+        msg_bin.extend(PeerProtocol.HEADER.pack(
                                     bytes([1]),                    # MSG TYPE
                                     seq,                           # SEQ
                                     int((time.time() * 1000000)))) # TIMESTAMP
-        msg_bin.extend(1024 * bytes([127]))                        # DATA
+        msg_bin.extend(PeerProtocol.DATA_SIZE * bytes([127]))      # DATA
 
         return msg_bin
 
@@ -166,7 +170,7 @@ class PeerProtocol(asyncio.DatagramProtocol):
                     # Retransmit
                     msg_bin = self.__build_msg(min_in_flight)
                     self._num_retrans += 1
-                    self._ledbat.data_loss()
+                    self._ledbat.on_loss(self._loop.time())
                 else:
                     # Send as normal
                     msg_bin = self.__build_msg(self._next_id)
@@ -175,16 +179,21 @@ class PeerProtocol(asyncio.DatagramProtocol):
                     self._next_id += 1
 
         msg_sz = len(msg_bin)
-        delay = self._ledbat.get_delay(msg_sz)
-        self._delays.appendleft(delay)
+        now = self._loop.time()
+        self._ledbat.check_timeout(now)
+        self._ledbat.on_send(msg_sz, now)
 
         self._transport.sendto(msg_bin, self._peer_addr)
         self._sent_data += msg_sz
 
-        if delay == 0:
-            self._send_handle = self._loop.call_soon(self.__send_next)
-        else:
-            self._send_handle = self._loop.call_later(delay, self.__send_next)
+        # Wait for ACKs when cwnd is full, otherwise pace over RTT
+        next_send = self._ledbat.next_send_time(msg_sz, now)
+        if next_send is None:
+            next_send = now + 0.001
+        delay = next_send - now
+        self._delays.appendleft(delay)
+
+        self._send_handle = self._loop.call_at(next_send, self.__send_next)
 
 def main(args):
     logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
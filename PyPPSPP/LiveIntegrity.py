@@ -0,0 +1,254 @@
+"""
+PyPPSPP, a Python3 implementation of Peer-to-Peer Streaming Peer Protocol
+Copyright (C) 2016,2017  J. Poderys, Technical University of Denmark
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Content integrity protection of live streams using the Unified Merkle
+Tree method [RFC7574] 6.1. The stream is one unbounded Merkle tree.
+The source hashes each batch of chunks_per_sig chunks into a subtree
+and signs its root (munro). The swarm id is the public key of the
+source. Receivers verify one signature per munro and then each chunk
+under it by hashes only, the same way as static content.
+"""
+
+import binascii
+import hashlib
+import struct
+import time
+
+import Ed25519
+from MerkleHashTree import MerkleHashTree, bin_of, bin_start
+from MerkleIntegrity import MerkleIntegrity
+
+class LiveIntegrity(object):
+    """Signed munros of a live stream"""
+    PROTECTION_METHOD = 3               # Unified Merkle Tree method in HANDSHAKE
+    SIGNATURE_ALG = 15                  # ED25519 DNSSEC algorithm number [RFC8080]
+    SIGNED_DATA = struct.Struct('>IIQ') # Munro start chunk, end chunk, timestamp. Followed by the munro hash
+    NTP_EPOCH = 2208988800              # Seconds from 1900 (NTP) to 1970 (Unix)
+    CHUNKS_PER_SIG = 32                 # Default number of chunks in a signed batch
+
+    def __init__(self, hash_func, swarm_id, chunk_size, chunks_per_sig = CHUNKS_PER_SIG, secret_key = None):
+        """Verify munros signed by the key in swarm_id. The source gives
+           its secret key and signs the chunks it generates.
+        """
+        if not LiveIntegrity.is_signed_swarm(swarm_id):
+            raise ValueError('Swarm id is not a public key')
+        if chunks_per_sig < 1 or chunks_per_sig & (chunks_per_sig - 1):
+            raise ValueError('Chunks per signature must be a power of two')
+
+        self._hash_func = hash_func
+        self.digest_size = hashlib.new(hash_func).digest_size
+        self.chunks_per_sig = chunks_per_sig
+        self.height = chunks_per_sig.bit_length() - 1    # Layer of the munros
+        self._public_key = bytes(swarm_id[1:])
+
+        self._secret_key = secret_key
+        if secret_key is not None and Ed25519.public_key(secret_key) != self._public_key:
+            raise ValueError('Secret key does not match the swarm id')
+        self._mht = MerkleHashTree(hash_func, chunk_size)
+        self._next_unsigned = 0         # First chunk of the next batch to sign
+
+        self._munros = {}               # Batch number -> (MerkleIntegrity, timestamp, signature)
+
+        # Stats
+        self.num_signed = 0             # Batches signed by the source
+        self.num_signatures = 0         # Signatures that passed verification
+        self.num_bad_signatures = 0     # Signatures not matching the munro
+        self.num_verified = 0
+        self.num_failed = 0
+        self.num_incomplete = 0
+        self.num_hashes = 0
+
+    @staticmethod
+    def is_signed_swarm(swarm_id):
+        """Is the swarm id a public key - algorithm number followed by the key"""
+        return len(swarm_id) == 1 + Ed25519.PUBLIC_LEN and swarm_id[0] == LiveIntegrity.SIGNATURE_ALG
+
+    @staticmethod
+    def swarm_id(secret_key):
+        """Get the swarm id of a stream signed with the secret key"""
+        return bytes([LiveIntegrity.SIGNATURE_ALG]) + Ed25519.public_key(secret_key)
+
+    @staticmethod
+    def load_secret(path):
+        """Read the hex encoded secret key of the source"""
+        with open(path, 'r') as fp:
+            return binascii.unhexlify(fp.read().strip())
+
+    @staticmethod
+    def save_secret(path, secret_key):
+        """Store the secret key hex encoded"""
+        with open(path, 'w') as fp:
+            fp.write(binascii.hexlify(secret_key).decode() + '\n')
+
+    range_to_node = staticmethod(MerkleIntegrity.range_to_node)
+    node_to_range = staticmethod(MerkleIntegrity.node_to_range)
+
+    def _munro(self, chunk_id):
+        return self._munros.get(chunk_id // self.chunks_per_sig)
+
+    def sign_chunks(self, get_chunk, end_chunk):
+        """Sign all complete batches of chunks below end_chunk. Chunk data
+           is read using get_chunk(chunk_id). Returns the first chunk not
+           signed yet - chunks from it on can not be shared.
+        """
+        while self._next_unsigned + self.chunks_per_sig <= end_chunk:
+            first_chunk = self._next_unsigned
+            tree = self._mht.get_chunks_tree(
+                get_chunk(x) for x in range(first_chunk, first_chunk + self.chunks_per_sig))
+
+            integrity = MerkleIntegrity(self._hash_func, self.chunks_per_sig, tree.root, first_chunk)
+            integrity.set_tree(tree)
+
+            timestamp = int((time.time() + LiveIntegrity.NTP_EPOCH) * (1 << 32))
+            signature = Ed25519.sign(self._secret_key, self._signed_data(first_chunk, timestamp, tree.root))
+
+            self._munros[first_chunk // self.chunks_per_sig] = (integrity, timestamp, signature)
+            self._next_unsigned += self.chunks_per_sig
+            self.num_signed += 1
+
+        return self._next_unsigned
+
+    def _signed_data(self, first_chunk, timestamp, munro_hash):
+        return LiveIntegrity.SIGNED_DATA.pack(
+            first_chunk, first_chunk + self.chunks_per_sig - 1, timestamp) + munro_hash
+
+    def add_signature(self, start_chunk, end_chunk, timestamp, signature, hashes):
+        """Verify the signed munro using its hash received in INTEGRITY
+           (dict bin -> hash). Chunks under a verified munro can be verified.
+           Returns True if the signature is valid, False if it is not and
+           None if the munro hash is missing.
+        """
+        if end_chunk - start_chunk + 1 != self.chunks_per_sig or start_chunk % self.chunks_per_sig:
+            self.num_bad_signatures += 1
+            return False
+
+        batch = start_chunk // self.chunks_per_sig
+        node = bin_of(self.height, batch)
+        if batch in self._munros:
+            # Already verified, i.e. signed by another peer
+            hashes.pop(node, None)
+            return True
+
+        munro_hash = hashes.get(node)
+        if munro_hash is None:
+            return None
+
+        if not Ed25519.verify(self._public_key, self._signed_data(start_chunk, timestamp, munro_hash), signature):
+            self.num_bad_signatures += 1
+            return False
+
+        del hashes[node]
+        integrity = MerkleIntegrity(self._hash_func, self.chunks_per_sig, munro_hash, start_chunk)
+        self._munros[batch] = (integrity, timestamp, bytes(signature))
+        self.num_signatures += 1
+        return True
+
+    def get_hash(self, node):
+        """Get verified hash of the bin. None if it is not known"""
+        munro = self._munro(bin_start(node))
+        if munro is None:
+            return None
+        return munro[0].get_hash(node)
+
+    def get_signature(self, node):
+        """Get (timestamp, signature) of the bin. None if it is not signed"""
+        munro = self._munro(bin_start(node))
+        if munro is None or node != bin_of(self.height, bin_start(node) // self.chunks_per_sig):
+            return None
+        return munro[1:]
+
+    def uncles(self, chunk_id):
+        """Get bins required to verify the chunk - its munro and the uncles below it"""
+        munro = self._munro(chunk_id)
+        if munro is None:
+            return []
+        return [bin_of(self.height, chunk_id // self.chunks_per_sig)] + munro[0].uncles(chunk_id)
+
+    def range_uncles(self, start_chunk, end_chunk):
+        """Get bins required to verify the chunks of the range sent in one DATA -
+           the munro of each batch and the uncles below it
+        """
+        nodes = []
+        for batch in range(start_chunk // self.chunks_per_sig, end_chunk // self.chunks_per_sig + 1):
+            munro = self._munros.get(batch)
+            if munro is None:
+                continue
+            first_chunk = batch * self.chunks_per_sig
+            nodes.append(bin_of(self.height, batch))
+            nodes.extend(munro[0].range_uncles(max(start_chunk, first_chunk),
+                                               min(end_chunk, first_chunk + self.chunks_per_sig - 1)))
+        return nodes
+
+    def hash_range(self, start_chunk, chunks, hashes):
+        """Add hashes of the nodes covering only the received chunks to the
+           unverified hashes, per signed batch. Returns the added bins.
+        """
+        added = []
+        end_chunk = start_chunk + len(chunks) - 1
+        for batch in range(start_chunk // self.chunks_per_sig, end_chunk // self.chunks_per_sig + 1):
+            munro = self._munros.get(batch)
+            if munro is None:
+                continue
+            first = max(start_chunk, batch * self.chunks_per_sig)
+            last = min(end_chunk, (batch + 1) * self.chunks_per_sig - 1)
+
+            integrity = munro[0]
+            num_hashes = integrity.num_hashes
+            added.extend(integrity.hash_range(first, chunks[first - start_chunk:last - start_chunk + 1], hashes))
+            self.num_hashes += integrity.num_hashes - num_hashes
+        return added
+
+    def verify(self, chunk_id, data, hashes):
+        """Verify the chunk under its signed munro. Returns True if the
+           chunk is valid, False if it is not and None if the signature or
+           required uncle hashes are missing.
+        """
+        munro = self._munro(chunk_id)
+        if munro is None:
+            self.num_incomplete += 1
+            return None
+
+        integrity = munro[0]
+        num_hashes = integrity.num_hashes
+        valid = integrity.verify(chunk_id, data, hashes)
+        self.num_hashes += integrity.num_hashes - num_hashes
+
+        if valid:
+            self.num_verified += 1
+        elif valid is None:
+            self.num_incomplete += 1
+        else:
+            self.num_failed += 1
+        return valid
+
+    def discard(self, chunk_id):
+        """Forget munros of chunks below chunk_id"""
+        for batch in [b for b in self._munros if (b + 1) * self.chunks_per_sig <= chunk_id]:
+            del self._munros[batch]
+
+    def get_stats(self):
+        return {
+            'signed': self.num_signed,
+            'signatures': self.num_signatures,
+            'bad_signatures': self.num_bad_signatures,
+            'verified': self.num_verified,
+            'failed': self.num_failed,
+            'incomplete': self.num_incomplete,
+            'hashes': self.num_hashes
+        }
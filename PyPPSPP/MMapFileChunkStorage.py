@@ -0,0 +1,147 @@
+"""
+PyPPSPP, a Python3 implementation of Peer-to-Peer Streaming Peer Protocol
+Copyright (C) 2016,2017  J. Poderys, Technical University of Denmark
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import mmap
+import os
+
+from FileChunkStorage import FileChunkStorage
+
+class MMapFileChunkStorage(FileChunkStorage):
+    """File based chunk storage using a memory mapped file. The file
+       is preallocated to its full size, chunks are read as memoryviews
+       into the map and written as slice assignments, without any
+       syscalls per chunk. Copying to / from the map is done on the
+       event loop instead of the I/O threads.
+    """
+    BLOCKING_IO = False
+
+    def __init__(self, swarm):
+        super().__init__(swarm)
+
+        self._mmap = None
+        self._view = None
+        self._num_prefetches = 0
+
+    def CloseStorage(self):
+        """Unmap and close the file"""
+        self._unmap()
+        super().CloseStorage()
+
+    def GetChunkData(self, chunk):
+        """Get view of the required chunk in the map"""
+        offset = chunk * self._chunk_size
+        return self._view[offset:offset + self._chunk_size]
+
+    def SaveChunkData(self, chunk_id, data):
+        """Copy given chunk into the map"""
+        if self._file_completed == True:
+            return
+
+        offset = chunk_id * self._chunk_size
+        self._view[offset:offset + len(data)] = data
+        self._chunks_saved((chunk_id,))
+
+    def read_chunk(self, chunk_id, urgent = False):
+        """Get view of the chunk in the map. There is no I/O to wait for"""
+        return self._done_future(self.GetChunkData(chunk_id))
+
+    def write_chunk(self, chunk_id, data):
+        """Copy the chunk into the map. It is saved once copied"""
+        self.SaveChunkData(chunk_id, data)
+        return self._done_future(None)
+
+    def drain(self):
+        """Nothing is buffered - the OS writes the map out"""
+        return self._done_future(None)
+
+    def prefetch(self, start_chunk, end_chunk):
+        """Ask the OS to page in the requested range of the map"""
+        if self._mmap is None or not hasattr(self._mmap, 'madvise') or not hasattr(mmap, 'MADV_WILLNEED'):
+            return
+
+        # Advised range has to start at a page boundary
+        start = (start_chunk * self._chunk_size) // mmap.PAGESIZE * mmap.PAGESIZE
+        end = min([(end_chunk + 1) * self._chunk_size, self._file_size])
+        if start >= end:
+            return
+
+        self._mmap.madvise(mmap.MADV_WILLNEED, start, end - start)
+        self._num_prefetches += 1
+
+    def get_stats(self):
+        """Get size of the map and number of read ahead hints"""
+        return {
+            'mapped_bytes': len(self._mmap) if self._mmap is not None else 0,
+            'prefetches': self._num_prefetches
+        }
+
+    def ReopenReadOnly(self):
+        """Write the downloaded data out and map the file read-only"""
+        if self._mmap is not None:
+            self._mmap.flush()
+        self._unmap()
+        super().ReopenReadOnly()
+        self._map(mmap.ACCESS_READ)
+
+    def InitValidFile(self):
+        """Map the valid file read-only"""
+        super().InitValidFile()
+        self._map(mmap.ACCESS_READ)
+
+    def InitNewFile(self):
+        """Create the file preallocated to its full size and map it"""
+        super().InitNewFile()
+        self._preallocate_and_map()
+
+    def InitPartialFile(self, have):
+        """Map the partially downloaded file"""
+        super().InitPartialFile(have)
+        self._preallocate_and_map()
+
+    def _preallocate_and_map(self):
+        self._file.close()
+        self._file = open(self._file_name, 'r+b')
+        try:
+            os.posix_fallocate(self._file.fileno(), 0, self._file_size)
+        except (AttributeError, OSError):
+            # Not available on this platform / file system - sparse file
+            self._file.truncate(self._file_size)
+        self._map(mmap.ACCESS_WRITE)
+
+    def _map(self, access):
+        if self._file_size == 0:
+            # Empty file can not be mapped. It has no chunks either
+            self._view = memoryview(bytearray())
+            return
+
+        self._mmap = mmap.mmap(self._file.fileno(), self._file_size, access = access)
+        self._view = memoryview(self._mmap)
+
+    def _unmap(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Views of some chunks are still in use. Unmapped once released.
+                logging.warning('Chunk views still in use. Leaving file mapped')
+            self._mmap = None
@@ -0,0 +1,348 @@
+"""
+PyPPSPP, a Python3 implementation of Peer-to-Peer Streaming Peer Protocol
+Copyright (C) 2016,2017  J. Poderys, Technical University of Denmark
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+Benchmark of the in-memory chunk storage used in live streaming.
+Generated AV content is packed into chunks by a live source and the
+chunks are saved by a relay, both using a discard window. The arena
+backed MemoryChunkStorage is compared against a frozen copy of the
+previous storage keeping chunks as separate bytearrays in a dict. Run
+time, GC pauses and memory footprint are reported.
+"""
+
+import argparse
+import gc
+import json
+import pickle
+import struct
+import time
+import tracemalloc
+
+from AbstractChunkStorage import AbstractChunkStorage
+from ContentGenerator import ContentGenerator
+from GlobalParams import GlobalParams
+from MemoryChunkStorage import MemoryChunkStorage
+
+class FakeSwarm(object):
+    """Minimal swarm used by the storage"""
+
+    def __init__(self, discard_wnd, live_src, chunk_size):
+        self.discard_wnd = discard_wnd
+        self.chunk_size = chunk_size
+        self.set_have = set()
+        self.set_missing = set()
+        self.live = True
+        self.live_src = live_src
+        self._have_ranges = []
+        self._last_discarded_id = -1
+        self.integrity = None
+
+    def SendHaveToMembers(self):
+        pass
+
+    def chunks_available(self, chunk_ids):
+        pass
+
+class DictChunkStorage(AbstractChunkStorage):
+    """Baseline storage keeping each chunk in own bytearray. Frozen copy of
+       MemoryChunkStorage before the arena, reduced to what the benchmark
+       runs. Chunk size is taken from the swarm instead of GlobalParams.
+    """
+
+    def __init__(self, swarm):
+        super().__init__(swarm)
+
+        self._chunks = {}
+        self._is_source = False
+        self._next_inject_id = 0
+
+        self._num_chunks_received = 0   # Number of all chunks received
+        self._num_unique_received = 0   # Number of unique chunks received
+
+        self._have_outstanding = 0
+
+    def Initialize(self, is_source):
+        if is_source == True:
+            self._is_source = True
+
+    def CloseStorage(self):
+        self._chunks.clear()
+        self._chunks = None
+
+    def GetChunkData(self, chunk_id, ignore_missing = False):
+        return self._chunks.get(chunk_id)
+
+    def SaveChunkData(self, chunk_id, data):
+        if self._is_source:
+            raise AssertionError("Saving received data in live source mode!")
+
+        self._num_chunks_received += 1
+
+        if chunk_id in self._chunks.keys():
+            return
+        else:
+            self._num_unique_received += 1
+
+            self._chunks[chunk_id] = data
+            self._swarm.set_missing.discard(chunk_id)
+            self._swarm.set_have.add(chunk_id)
+
+            if self._swarm.discard_wnd is not None:
+                self.discard_old_chunks()
+
+            if self._num_unique_received % 100 == 0:
+                self.BuildHaveRanges()
+                self._swarm.SendHaveToMembers()
+
+    def pack_data_with_de(self, data):
+        binary_data = pickle.dumps(data)
+        data_size = len(binary_data)
+
+        msg_bytes = bytearray()
+        msg_bytes.extend(struct.pack('>I', data_size))
+        msg_bytes.extend(binary_data)
+
+        chunks = []
+
+        first_packed = False
+        data_packed = 0
+        all_data = 4 + data_size
+
+        while data_packed < all_data:
+            chunk = bytearray()
+
+            if all_data - data_packed > self._chunk_size - 1:
+                if first_packed:
+                    chunk.extend(bytes([1]))
+                else:
+                    chunk.extend(bytes([0]))
+                    first_packed = True
+
+                chunk.extend(msg_bytes[data_packed:data_packed+self._chunk_size - 1])
+                chunks.append(chunk)
+
+                data_packed += self._chunk_size - 1
+            else:
+                if first_packed:
+                    chunk.extend(bytes([1]))
+                else:
+                    chunk.extend(bytes([0]))
+                    first_packed = True
+
+                chunk.extend(msg_bytes[data_packed:])
+
+                chunk.extend((self._chunk_size - len(chunk)) * bytes([0]))
+                chunks.append(chunk)
+                data_packed = all_data
+
+        self.inject_chunks(chunks)
+
+        if self._swarm.discard_wnd is not None:
+            self.discard_old_chunks()
+
+        self._have_outstanding += len(chunks)
+        if self._have_outstanding >= 100:
+            self.BuildHaveRangesLiveSrc()
+            self._swarm.SendHaveToMembers()
+            self._have_outstanding = 0
+
+    def inject_chunks(self, chunks):
+        first_id = self._next_inject_id
+        for chunk in chunks:
+            assert len(chunk) == self._chunk_size
+
+            self._chunks[self._next_inject_id] = chunk
+            self._swarm.set_have.add(self._next_inject_id)
+            self._next_inject_id += 1
+
+        self._swarm.chunks_available(range(first_id, self._next_inject_id))
+
+    def BuildHaveRangesLiveSrc(self):
+        self._swarm._have_ranges.clear()
+        self._swarm._have_ranges.append((self._swarm._last_discarded_id + 1, self._next_inject_id - 1))
+
+    def BuildHaveRanges(self):
+        present_chunks = list(self._chunks)
+        present_chunks.sort()
+
+        ranges = []
+
+        in_range = False
+        x_min = 0
+        num_chunks = len(present_chunks)
+
+        for key, chunk_num in enumerate(present_chunks):
+            if not in_range:
+                x_min = chunk_num
+                in_range = True
+
+            if in_range:
+                if num_chunks == key + 1:
+                    ranges.append((x_min, chunk_num))
+                    break
+                elif present_chunks[key+1] == chunk_num + 1:
+                    continue
+                else:
+                    ranges.append((x_min, chunk_num))
+                    in_range = False
+
+        self._swarm._have_ranges = ranges
+
+    def discard_old_chunks(self):
+        min_have = min(self._swarm.set_have)
+        max_have = max(self._swarm.set_have)
+
+        if max_have - min_have + 1 > self._swarm.discard_wnd:
+            for chunk_id in range(min_have, max_have - self._swarm.discard_wnd + 2):
+                if chunk_id in self._swarm.set_have:
+                    self._swarm.set_have.discard(chunk_id)
+                    self._swarm.set_missing.discard(chunk_id)
+                if chunk_id in self._chunks:
+                    del self._chunks[chunk_id]
+
+            self._swarm._last_discarded_id = max_have - self._swarm.discard_wnd + 1
+
+STORAGES = {
+    'arena': MemoryChunkStorage,
+    'dict': DictChunkStorage
+}
+
+class GCTimer(object):
+    """Measure duration of the garbage collector runs"""
+
+    def __init__(self):
+        self.pauses = []
+        self._start = None
+
+    def __enter__(self):
+        gc.callbacks.append(self._callback)
+        return self
+
+    def __exit__(self, *exc):
+        gc.callbacks.remove(self._callback)
+
+    def _callback(self, phase, info):
+        if phase == 'start':
+            self._start = time.perf_counter()
+        elif self._start is not None:
+            self.pauses.append(time.perf_counter() - self._start)
+            self._start = None
+
+def generate_frames(num_frames):
+    """Get AV data of the given number of frames"""
+    generator = ContentGenerator()
+    num_samples = min(len(generator._audio_samples), len(generator._video_samples))
+    return [generator._get_next_avdata(i % num_samples) for i in range(num_frames)]
+
+def run_source(storage_cls, frames, discard_wnd, chunk_size):
+    """Pack the frames into chunks as a live source"""
+    storage = storage_cls(FakeSwarm(discard_wnd, True, chunk_size))
+    storage.Initialize(True)
+    for avdata in frames:
+        storage.pack_data_with_de(avdata)
+    return storage
+
+def run_relay(storage_cls, chunks, discard_wnd, chunk_size):
+    """Save the received chunks as a live relay"""
+    storage = storage_cls(FakeSwarm(discard_wnd, False, chunk_size))
+    storage.Initialize(False)
+    for (chunk_id, data) in enumerate(chunks):
+        storage.SaveChunkData(chunk_id, data)
+    return storage
+
+def measure(func, *args):
+    """Run func measuring time and GC pauses, then again tracing memory"""
+    gc.collect()
+    with GCTimer() as gc_timer:
+        start = time.perf_counter()
+        storage = func(*args)
+        run_time = time.perf_counter() - start
+    stats = storage.get_stats()
+    storage.CloseStorage()
+    del storage
+
+    gc.collect()
+    tracemalloc.start()
+    storage = func(*args)
+    (mem_now, mem_peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    storage.CloseStorage()
+
+    return {
+        'time': run_time,
+        'gc_runs': len(gc_timer.pauses),
+        'gc_total': sum(gc_timer.pauses),
+        'gc_max': max(gc_timer.pauses, default=0),
+        'mem_now': mem_now,
+        'mem_peak': mem_peak,
+        'storage': stats
+    }
+
+def print_results(results):
+    """Print results table"""
+    print('{:<7} {:<6} {:>8} {:>7} {:>9} {:>9} {:>10} {:>10}'.format(
+        'Role', 'Store', 'Time s', 'GC runs', 'GC tot ms', 'GC max ms', 'Mem KiB', 'Peak KiB'))
+
+    for r in results:
+        print('{:<7} {:<6} {:>8.3f} {:>7} {:>9.2f} {:>9.2f} {:>10} {:>10}'.format(
+            r['role'],
+            r['store'],
+            r['time'],
+            r['gc_runs'],
+            r['gc_total'] * 1000,
+            r['gc_max'] * 1000,
+            r['mem_now'] // 1024,
+            r['mem_peak'] // 1024))
+
+def main(args):
+    frames = generate_frames(args.frames)
+
+    # Chunks as received by a relay
+    source = run_source(MemoryChunkStorage, frames, None, args.chunksize)
+    chunks = [bytes(source.GetChunkData(c)) for c in range(len(source._chunks))]
+    source.CloseStorage()
+
+    print('Frames: {}; chunks: {}; chunk size: {} B; discard window: {}'.format(
+        len(frames), len(chunks), args.chunksize, args.discardwnd))
+
+    results = []
+    for store in args.store:
+        for _ in range(args.repeat):
+            r = measure(run_source, STORAGES[store], frames, args.discardwnd, args.chunksize)
+            r.update(role='source', store=store)
+            results.append(r)
+            r = measure(run_relay, STORAGES[store], chunks, args.discardwnd, args.chunksize)
+            r.update(role='relay', store=store)
+            results.append(r)
+
+    results.sort(key=lambda r: r['role'])
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump({'args': vars(args), 'results': results}, fp, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark in-memory chunk storage of live streams")
+    parser.add_argument('--frames', help='Number of generated AV frames', type=int, default=3000)
+    parser.add_argument('--discardwnd', help='Discard window (chunks)', type=int, default=1000)
+    parser.add_argument('--chunksize', help='Chunk size (Bytes)', type=int, default=GlobalParams.chunk_size)
+    parser.add_argument('--store', help='Storages to run', nargs='+', choices=sorted(STORAGES), default=sorted(STORAGES))
+    parser.add_argument('--repeat', help='Number of runs of each storage', type=int, default=1)
+    parser.add_argument('--json', help='Save results to the given JSON file', nargs='?')
+
+    main(parser.parse_args())
@@ -22,22 +22,40 @@ import asyncio
 import math
 import pickle
 import struct
+import threading
 
 from ContentGenerator import ContentGenerator
 from AbstractChunkStorage import AbstractChunkStorage
-from GlobalParams import GlobalParams
 from Framer import Framer
 
 class MemoryChunkStorage(AbstractChunkStorage):
-    """Memory backed chunk storage"""
+    """Memory backed chunk storage. Chunks are kept in slots of
+       one preallocated arena. Slot of a chunk is chunk_id % num_slots,
+       so with the discard window the arena is reused in a ring.
+       Views of the arena are for the event loop only - the content
+       consumer thread gets copies made under the lock.
+    """
+    INITIAL_SLOTS = 1024                # Arena size (chunks) if no discard window is used
 
     def __init__(self, swarm):
         super().__init__(swarm)
         
-        self._chunks = {}
+        self._chunks = {}               # chunk_id -> slot
+        self._arena = None
+        self._view = None
+        self._num_slots = 0
+        self._slot_ids = []             # slot -> chunk_id or None
+        self._slot_len = []             # slot -> length of data in the slot
+        self._num_grows = 0
+        self._init_arena()
+
+        # Slots are reused and the arena grown while the content consumer thread reads chunks
+        self._lock = threading.Lock()
+
         self._cg = None
         self._is_source = False
         self._next_inject_id = 0
+        self._next_publish_id = 0       # Chunks from this one on are not shared yet - waiting for signing
 
         self._num_chunks_received = 0   # Number of all chunks received
         self._num_unique_received = 0   # Number of unique chunks received
@@ -51,17 +69,127 @@ class MemoryChunkStorage(AbstractChunkStorage):
             self._is_source = True
 
     def CloseStorage(self):
-        self._chunks.clear()
-        self._chunks = None
+        with self._lock:
+            self._chunks.clear()
+            self._chunks = None
+            self._view = None
+            self._arena = None
 
     def GetChunkData(self, chunk_id, ignore_missing = False):
-        if chunk_id in self._chunks:
-            return self._chunks[chunk_id]
+        """Get a memoryview of the chunk in the arena"""
+        data = self._chunk_view(chunk_id)
+        if data is None and not ignore_missing:
+            logging.info("Received request for missing chunk: {0}".format(chunk_id))
+        return data
+
+    def copy_chunk(self, chunk_id):
+        """Get a copy of the chunk data or None if missing. Safe to call from other threads"""
+        with self._lock:
+            data = self._chunk_view(chunk_id)
+            return bytes(data) if data is not None else None
+
+    def get_stats(self):
+        """Get arena statistics"""
+        return {
+            'arena_bytes': len(self._arena),
+            'arena_slots': self._num_slots,
+            'arena_chunks': self._num_slots - self._slot_ids.count(None),
+            'arena_grows': self._num_grows
+        }
+
+    def _init_arena(self):
+        """Allocate the arena holding a full discard window"""
+        if self._swarm.discard_wnd is not None:
+            num_slots = self._swarm.discard_wnd
         else:
-            if not ignore_missing:
-                logging.info("Received request for missing chunk: {0}".format(chunk_id))
+            num_slots = MemoryChunkStorage.INITIAL_SLOTS
+        self._alloc_arena(num_slots)
+
+    def _alloc_arena(self, num_slots):
+        self._arena = bytearray(num_slots * self._chunk_size)
+        self._view = memoryview(self._arena)
+        self._num_slots = num_slots
+        self._slot_ids = [None] * num_slots
+        self._slot_len = [0] * num_slots
+
+    def _grow_arena(self, chunk_id):
+        """Double the arena until all chunks and chunk_id get own slots.
+           New arena is allocated, so the views given out stay valid.
+        """
+        num_slots = self._num_slots * 2
+        while len(set(c % num_slots for c in self._chunks) | {chunk_id % num_slots}) <= len(self._chunks):
+            num_slots *= 2
+
+        old_view = self._view
+        old_len = self._slot_len
+        self._alloc_arena(num_slots)
+        self._num_grows += 1
+
+        chunk_size = self._chunk_size
+        for (cid, old_slot) in self._chunks.items():
+            slot = cid % num_slots
+            length = old_len[old_slot]
+            self._view[slot * chunk_size:slot * chunk_size + length] = \
+                old_view[old_slot * chunk_size:old_slot * chunk_size + length]
+            self._chunks[cid] = slot
+            self._slot_ids[slot] = cid
+            self._slot_len[slot] = length
+
+        logging.info('Chunk arena grown to %s slots', num_slots)
+
+    def _chunk_buffer(self, chunk_id, length = None):
+        """Get a writable view of the slot of a new chunk. Returns None if
+           the chunk is older than the whole discard window.
+        """
+        if length is None:
+            length = self._chunk_size
+
+        slot = chunk_id % self._num_slots
+        old_id = self._slot_ids[slot]
+        if old_id is not None and old_id != chunk_id:
+            if self._swarm.discard_wnd is None:
+                self._grow_arena(chunk_id)
+                slot = chunk_id % self._num_slots
+            elif old_id < chunk_id:
+                # Old chunk is out of the discard window. It is
+                # removed from the chunk maps when discarding.
+                del self._chunks[old_id]
+            else:
+                return None
+
+        self._chunks[chunk_id] = slot
+        self._slot_ids[slot] = chunk_id
+        self._slot_len[slot] = length
+
+        offset = slot * self._chunk_size
+        return self._view[offset:offset + length]
+
+    def _store_chunk(self, chunk_id, data):
+        """Copy received data into the slot of the chunk. Returns False if not saved"""
+        with self._lock:
+            buf = self._chunk_buffer(chunk_id, len(data))
+            if buf is None:
+                return False
+
+            buf[:] = data
+            return True
+
+    def _chunk_view(self, chunk_id):
+        """Get a view of the data of the chunk or None if missing"""
+        slot = self._chunks.get(chunk_id)
+        if slot is None:
             return None
 
+        offset = slot * self._chunk_size
+        return self._view[offset:offset + self._slot_len[slot]]
+
+    def _release(self, chunk_id):
+        """Free the slot of a chunk"""
+        with self._lock:
+            slot = self._chunks.pop(chunk_id, None)
+            if slot is not None:
+                self._slot_ids[slot] = None
+
     def SaveChunkData(self, chunk_id, data):
         """Save given data to the memory backed storage"""
         if self._is_source:
@@ -80,7 +208,9 @@ class MemoryChunkStorage(AbstractChunkStorage):
             self._num_unique_received += 1
 
             # Save and account
-            self._chunks[chunk_id] = data
+            if not self._store_chunk(chunk_id, data):
+                logging.info("Chunk {0} is older than the discard window".format(chunk_id))
+                return
             self._swarm.set_missing.discard(chunk_id)
             self._swarm.set_have.add(chunk_id)
 
@@ -123,17 +253,17 @@ class MemoryChunkStorage(AbstractChunkStorage):
         data_packed = 0
         all_data = len(msg_bytes)
         while data_packed < all_data:
-            if all_data - data_packed > GlobalParams.chunk_size:
+            if all_data - data_packed > self._chunk_size:
                 # We have enough data for a full packet
                 pack = bytearray()
-                pack.extend(msg_bytes[data_packed:data_packed+GlobalParams.chunk_size])
+                pack.extend(msg_bytes[data_packed:data_packed+self._chunk_size])
                 packs.append(pack)
-                data_packed += GlobalParams.chunk_size
+                data_packed += self._chunk_size
             else:
                 # Make last pack by extendig it with zeros
                 last_pack = bytearray()
                 last_pack.extend(msg_bytes[data_packed:])
-                last_pack.extend((GlobalParams.chunk_size - len(last_pack)) * bytes([0]))
+                last_pack.extend((self._chunk_size - len(last_pack)) * bytes([0]))
                 packs.append(last_pack)
                 data_packed = all_data
 
@@ -161,63 +291,35 @@ class MemoryChunkStorage(AbstractChunkStorage):
         assert data_size < 4294967295 # 2^32 - 1
 
         # Append length indicator in front
-        msg_bytes = bytearray()
-        msg_bytes.extend(struct.pack('>I', data_size))
-        msg_bytes.extend(binary_data)
+        msg_bytes = memoryview(struct.pack('>I', data_size) + binary_data)
 
-        # Pack data into ChunkSize chunks
-        chunks = []
+        # Copy ChunkSize - 1 bytes of data into each chunk slot
+        payload_size = self._chunk_size - 1
 
-        first_packed = False
-        data_packed = 0
-        all_data = 4 + data_size # bytes for len + data
-        
-        while data_packed < all_data:
-            chunk = bytearray()
-
-            if all_data - data_packed > GlobalParams.chunk_size - 1:
-                # We have enough data to fill one full packet
-                
-                # Check if this chunk is eligible for discard
-                if first_packed:
-                    chunk.extend(bytes([1])) # Eligible for discard
-                else:
-                    chunk.extend(bytes([0])) # Not eligible for discard
-                    first_packed = True
-
-                # Packe the data
-                chunk.extend(msg_bytes[data_packed:data_packed+GlobalParams.chunk_size - 1])
-                chunks.append(chunk)
-
-                # Update number of bytes packed
-                data_packed += GlobalParams.chunk_size - 1
-            else:
-                # Not enough data to fill all packet - will pad with 0
+        with self._lock:
+            for data_packed in range(0, len(msg_bytes), payload_size):
+                payload = msg_bytes[data_packed:data_packed + payload_size]
+                chunk = self._chunk_buffer(self._next_inject_id)
 
-                # Check if this chunk is eligible for discard
-                if first_packed:
-                    chunk.extend(bytes([1])) # Eligible for discard
-                else:
-                    chunk.extend(bytes([0])) # Not eligible for discard
-                    first_packed = True
+                # First chunk is not eligible for discard
+                chunk[0] = 1 if data_packed else 0
+                chunk[1:len(payload) + 1] = payload
 
-                # Add data
-                chunk.extend(msg_bytes[data_packed:])
+                # Pad the last chunk with 0
+                if len(payload) < payload_size:
+                    chunk[len(payload) + 1:] = bytes(payload_size - len(payload))
 
-                # Add padding
-                chunk.extend((GlobalParams.chunk_size - len(chunk)) * bytes([0]))
-                chunks.append(chunk)
-                data_packed = all_data
+                self._next_inject_id += 1
 
-        # Inject into system
-        self.inject_chunks(chunks)
+        first_id = self._next_publish_id
+        self._publish_chunks()
 
         # Discard old chunks if needed
-        if self._swarm.discard_wnd is not None:
+        if self._swarm.discard_wnd is not None and self._swarm.set_have:
             self.discard_old_chunks()
 
         # Reduce the number of have messages
-        self._have_outstanding += len(chunks)
+        self._have_outstanding += self._next_publish_id - first_id
         if self._have_outstanding >= 100:
             self.build_distribute_have_live_src()
             self._have_outstanding = 0
@@ -232,19 +334,36 @@ class MemoryChunkStorage(AbstractChunkStorage):
     def inject_chunks(self, chunks):
         """Inject [chunks] into the system"""
 
-        for chunk in chunks:
-            # Ensure the correct size of data before sending it into the system
-            assert len(chunk) == GlobalParams.chunk_size
+        with self._lock:
+            for chunk in chunks:
+                # Ensure the correct size of data before sending it into the system
+                assert len(chunk) == self._chunk_size
 
-            self._chunks[self._next_inject_id] = chunk
-            self._swarm.set_have.add(self._next_inject_id)
-            self._next_inject_id += 1
+                self._chunk_buffer(self._next_inject_id)[:] = chunk
+                self._next_inject_id += 1
+
+        self._publish_chunks()
+
+    def _publish_chunks(self):
+        """Share the injected chunks. Chunks of a signed stream are
+           shared once the batch they belong to is signed.
+        """
+        first_id = self._next_publish_id
+        if self._swarm.integrity is not None:
+            self._next_publish_id = self._swarm.integrity.sign_chunks(self._chunk_view, self._next_inject_id)
+        else:
+            self._next_publish_id = self._next_inject_id
+
+        self._swarm.set_have.update(range(first_id, self._next_publish_id))
+
+        # Wake up members waiting for the new chunks
+        self._swarm.chunks_available(range(first_id, self._next_publish_id))
 
     def BuildHaveRangesLiveSrc(self):
         # Build have ranges in Live Source
         assert self._swarm.live and self._swarm.live_src
         self._swarm._have_ranges.clear()
-        self._swarm._have_ranges.append((self._swarm._last_discarded_id + 1, self._next_inject_id - 1))
+        self._swarm._have_ranges.append((self._swarm._last_discarded_id + 1, self._next_publish_id - 1))
     
     def BuildHaveRanges(self):
         """Build HAVE ranges"""
@@ -299,8 +418,12 @@ class MemoryChunkStorage(AbstractChunkStorage):
                 if chunk_id in self._swarm.set_have:
                     self._swarm.set_have.discard(chunk_id)
                     self._swarm.set_missing.discard(chunk_id)
-                if chunk_id in self._chunks:
-                    del self._chunks[chunk_id]
+                self._release(chunk_id)
 
             # Set last discarded ID
             self._swarm._last_discarded_id = max_have - self._swarm.discard_wnd + 1
+
+            if self._swarm.integrity is not None:
+                self._swarm.integrity.discard(self._swarm._last_discarded_id + 1)
+                for member in self._swarm._members:
+                    member.discard_hashes(self._swarm._last_discarded_id + 1)
@@ -24,19 +24,41 @@ import hashlib
 import math
 import io
 import logging
+import concurrent.futures
 
 class MerkleHashTree(object):
     """Helper class for dealing with Merkle Hash Tree"""
-    # TODO: Peak Hashes
+    SEGMENT_BYTES = 16 * 1024 * 1024    # Files are hashed in parallel in segments of about this size
 
-    def __init__(self, hash_funct, chunk_len):
-        """Initialize Merkle Hash Tree using given hash function and file"""
+    def __init__(self, hash_funct, chunk_len, workers = 1):
+        """Initialize Merkle Hash Tree using given hash function and file.
+           Files are hashed using given number of worker processes.
+        """
 
         self._hash_func = hash_funct
         self._chunk_len = chunk_len
+        self._workers = workers
+        self._digest_size = hashlib.new(hash_funct).digest_size
 
     def get_file_hash(self, filename):
         """Get Merkle hash of a given file"""
+        tree = self.get_file_tree(filename)
+        if tree is None:
+            return None
+        return tree.root
+
+    def get_data_hash(self, data_bytes):
+        """Calculate Merkle's root hash of the given data bytes"""
+
+        with io.BytesIO(data_bytes) as b_data:
+            return self.get_stream_hash(b_data, len(data_bytes))
+
+    def get_stream_hash(self, stream, data_len):
+        """Calculate Merkle's root hash of data_len bytes read from the stream"""
+        return self.get_stream_tree(stream, data_len).root
+
+    def get_file_tree(self, filename):
+        """Get the full Merkle hash tree of a given file"""
 
         try:
             file_len = os.stat(filename).st_size
@@ -48,92 +70,317 @@ class MerkleHashTree(object):
             logging.warning('Given file %s is empty!', filename)
             return None
 
-        # Calculate tree parameters
-        tree_populated_width = math.ceil(file_len / self._chunk_len)
-        tree_height = math.ceil(math.log2(tree_populated_width))
-        tree_width = int(math.pow(2, tree_height))
+        num_chunks = math.ceil(file_len / self._chunk_len)
+        if self._workers > 1 and num_chunks > self._segment_chunks():
+            return self._get_file_tree_parallel(filename, num_chunks)
 
-        # Fill bottom layer with file's hashes
-        tree_bottom_layer = ['\x00'] * tree_width
         with open(filename, 'rb') as file_hdl:
-            self._initial_hasher(
-                file_hdl,
-                tree_populated_width,
-                tree_bottom_layer
-            )
+            return self.get_stream_tree(file_hdl, file_len)
 
-        # Get Merkle's root hash
-        mrh = self._calculate_root_hash(tree_bottom_layer)
-        return mrh
+    def get_stream_tree(self, stream, data_len):
+        """Calculate all hashes of the Merkle tree of data_len bytes read from the stream"""
 
-    def get_data_hash(self, data_bytes):
-        """Calculate Merkle's root hash of the given data bytes"""
+        num_chunks = math.ceil(data_len / self._chunk_len)
+        return self._build_tree(num_chunks, _hash_chunks(self._hash_func, self._chunk_len, stream, num_chunks))
 
-        # Calculate tree parameters
-        data_len = len(data_bytes)
-        tree_populated_width = math.ceil(data_len / self._chunk_len)
-        tree_height = math.ceil(math.log2(tree_populated_width))
-        tree_width = int(math.pow(2, tree_height))
+    def get_chunks_tree(self, chunks):
+        """Calculate all hashes of the Merkle tree of the given chunks"""
+        leaves = b''.join(hashlib.new(self._hash_func, chunk).digest() for chunk in chunks)
+        return self._build_tree(len(leaves) // self._digest_size, leaves)
 
-        tree_bottom_layer = ['\x00'] * tree_width
-        with io.BytesIO(data_bytes) as b_data:
-            self._initial_hasher(
-                b_data,
-                tree_populated_width,
-                tree_bottom_layer
-            )
-
-        # Get Merkle's root hash
-        mrh = self._calculate_root_hash(tree_bottom_layer)
-        return mrh
-
-    def _initial_hasher(self, stream, num_chunks, buffer):
-        """Fill initial hash values"""
-        for chunkid in range(num_chunks):
-            data = stream.read(self._chunk_len)
-            hasher = hashlib.new(self._hash_func)
-            hasher.update(data)
-            buffer[chunkid] = hasher.digest()
-
-    def _calculate_root_hash(self, data):
-        """Calculate Merkle's root hash of the given data"""
-        working_list = []
-        data_len = len(data) # Length of tree's bottom layer
-
-        for x in range(0, data_len, 2):
-            if data[x] != '\x00' and data[x+1] != '\x00':
-                # Both children are normal hashes
-                hasher = hashlib.new(self._hash_func)
-                hasher.update(data[x] + data[x+1])
-                working_list.append(hasher.digest())
-            elif data[x] != '\x00' and data[x+1] == '\x00':
-                # Second child is null hash
-                hasher = hashlib.new(self._hash_func)
-                hasher.update(data[x] + hasher.digest_size * bytes([0]))
-                working_list.append(hasher.digest())
-            else:
-                # Both children are null hashes
-                working_list.append('\x00')
-
-        while len(working_list) != 1:
-            # Eache iteration reduces list in half, until only one hash is left
-            inner_list = working_list[:]
-            working_list.clear()
-            inner_len = len(inner_list)
-
-            for x in range(0, inner_len, 2):
-                if inner_list[x] != '\x00' and inner_list[x+1] != '\x00':
-                    # Both children are normal hashes
-                    hasher = hashlib.new(self._hash_func)
-                    hasher.update(inner_list[x] + inner_list[x+1])
-                    working_list.append(hasher.digest())
-                elif inner_list[x] != '\x00' and inner_list[x+1] == '\x00':
-                    # Second child is null hash
-                    hasher = hashlib.new(self._hash_func)
-                    hasher.update(inner_list[x] + hasher.digest_size * bytes([0]))
-                    working_list.append(hasher.digest())
-                else:
-                    # Both children are null hashes
-                    working_list.append('\x00')
-
-        return working_list[0]
+    def _build_tree(self, num_chunks, layer):
+        """Build the tree from the concatenated hashes of the chunks"""
+        tree = MerkleTree(self._digest_size, num_chunks, complete = True)
+        tree.set_layer(0, 0, layer)
+
+        # Each upper layer is half of the layer below
+        for level in range(1, tree.height + 1):
+            layer = _hash_layer(self._hash_func, self._digest_size, layer)
+            tree.set_layer(level, 0, layer)
+
+        return tree
+
+    def _segment_chunks(self):
+        """Number of chunks in a segment hashed by one worker. Power of two, so
+           each segment is a subtree of the Merkle tree
+        """
+        return 1 << max((self.SEGMENT_BYTES // self._chunk_len).bit_length() - 1, 0)
+
+    def _get_file_tree_parallel(self, filename, num_chunks):
+        """Hash the file segments in worker processes. Each worker reduces its
+           segment to the segment root, only the layers above are calculated here.
+           hashlib holds the GIL while hashing chunks smaller than 2 KiB, so
+           threads would not help with the default chunk size.
+        """
+        tree = MerkleTree(self._digest_size, num_chunks, complete = True)
+        segment_chunks = self._segment_chunks()
+        segment_height = segment_chunks.bit_length() - 1
+        segments = range(0, num_chunks, segment_chunks)
+
+        with concurrent.futures.ProcessPoolExecutor(self._workers) as pool:
+            futures = [pool.submit(_hash_segment, self._hash_func, self._chunk_len, filename,
+                                   first_chunk, min(segment_chunks, num_chunks - first_chunk), segment_height)
+                       for first_chunk in segments]
+
+            for (first_chunk, future) in zip(segments, futures):
+                for (level, layer) in enumerate(future.result()):
+                    tree.set_layer(level, first_chunk >> level, layer)
+
+        layer = tree.get_layer(segment_height)
+        for level in range(segment_height + 1, tree.height + 1):
+            layer = _hash_layer(self._hash_func, self._digest_size, layer)
+            tree.set_layer(level, 0, layer)
+
+        return tree
+
+class MerkleTreeBuilder(object):
+    """Incremental calculation of Merkle root hash. Chunks are added one by
+       one and only roots of the complete subtrees are kept, so memory use
+       grows with the log of the number of chunks.
+    """
+
+    def __init__(self, hash_funct):
+        self._hash_func = hash_funct
+        self._subtrees = []             # (layer, hash) of complete subtrees. Layers decrease towards the end
+        self.num_chunks = 0
+
+    def add(self, data):
+        """Add the next chunk"""
+        level = 0
+        node_hash = hashlib.new(self._hash_func, data).digest()
+        self.num_chunks += 1
+
+        # Merge subtrees of the same size
+        while self._subtrees and self._subtrees[-1][0] == level:
+            (_, left_hash) = self._subtrees.pop()
+            node_hash = hashlib.new(self._hash_func, left_hash + node_hash).digest()
+            level += 1
+
+        self._subtrees.append((level, node_hash))
+
+    def get_peaks(self):
+        """Get (bin, hash) of the peaks of the chunks added so far. The
+           complete subtrees kept by the builder are exactly the peaks.
+        """
+        peaks = []
+        first_chunk = 0
+        for (level, node_hash) in self._subtrees:
+            peaks.append((bin_of(level, first_chunk >> level), node_hash))
+            first_chunk += 1 << level
+        return peaks
+
+    def get_root(self):
+        """Get Merkle's root hash of the chunks added so far"""
+        return root_from_peaks(self._hash_func, self.get_peaks())
+
+def _hash_chunks(hash_func, chunk_len, stream, num_chunks):
+    """Get concatenated hashes of num_chunks chunks read from the stream"""
+    return b''.join(hashlib.new(hash_func, stream.read(chunk_len)).digest() for _ in range(num_chunks))
+
+def _hash_layer(hash_func, digest_size, children):
+    """Get hashes of the parent layer from the concatenated hashes of the layer below"""
+    pair_size = 2 * digest_size
+    if len(children) % pair_size:
+        # Second child of the last parent is right of the content - null hash
+        children = children + bytes(digest_size)
+
+    view = memoryview(children)
+    return b''.join(hashlib.new(hash_func, view[x:x + pair_size]).digest()
+                    for x in range(0, len(children), pair_size))
+
+def _hash_segment(hash_func, chunk_len, filename, first_chunk, num_chunks, height):
+    """Hash chunks of a file segment and reduce them height layers up. Run in
+       a worker process. Returns concatenated hashes of each layer of the segment.
+    """
+    with open(filename, 'rb') as file_hdl:
+        file_hdl.seek(first_chunk * chunk_len)
+        layers = [_hash_chunks(hash_func, chunk_len, file_hdl, num_chunks)]
+
+    digest_size = hashlib.new(hash_func).digest_size
+    for _ in range(height):
+        layers.append(_hash_layer(hash_func, digest_size, layers[-1]))
+
+    return layers
+
+class MerkleTree(object):
+    """Hashes of a Merkle hash tree in one contiguous buffer indexed by the
+       bin number of the node [RFC7574] 4.2. Chunk c is bin 2c, the parent of
+       two sibling bins lies between them and the root is bin 2^height - 1,
+       so a node is found, its sibling and parent calculated in O(1) without
+       any per node objects. Nodes right of the content are not stored -
+       their hash is all zeros.
+    """
+
+    def __init__(self, digest_size, num_chunks, complete = False):
+        self.digest_size = digest_size
+        self.num_chunks = num_chunks
+        self.height = tree_height(num_chunks)
+
+        # The rightmost node of each layer covering the content has the highest bin
+        last_chunk = max(num_chunks - 1, 0)
+        self.num_bins = max(bin_of(level, last_chunk >> level) for level in range(self.height + 1)) + 1
+        self.hashes = bytearray(self.num_bins * digest_size)
+
+        self._known = None              # Flags of known hashes by bin. None - all are known
+        if not complete:
+            self._known = bytearray(self.num_bins)
+            self._num_known = 0
+            self._num_nodes = sum(((last_chunk >> level) + 1) for level in range(self.height + 1))
+
+    @property
+    def root_bin(self):
+        return (1 << self.height) - 1
+
+    @property
+    def root(self):
+        return self.get_hash(self.root_bin)
+
+    def is_complete(self):
+        """Are all hashes of the tree known"""
+        return self._known is None or self._num_known == self._num_nodes
+
+    def is_content(self, node):
+        """Does the node cover any of the content chunks"""
+        return bin_start(node) < self.num_chunks
+
+    def get_hash(self, node):
+        """Get hash of the node. None if it is not known"""
+        if not self.is_content(node):
+            return bytes(self.digest_size)
+        if self._known is not None and not self._known[node]:
+            return None
+
+        offset = node * self.digest_size
+        return bytes(self.hashes[offset:offset + self.digest_size])
+
+    def set_hash(self, node, node_hash):
+        """Store hash of the node"""
+        if not self.is_content(node):
+            return
+        offset = node * self.digest_size
+        self.hashes[offset:offset + self.digest_size] = node_hash
+        if self._known is not None and not self._known[node]:
+            self._known[node] = 1
+            self._num_known += 1
+
+    def set_layer(self, level, first_index, layer):
+        """Store concatenated hashes of consecutive nodes of a layer"""
+        for (i, x) in enumerate(range(0, len(layer), self.digest_size)):
+            self.set_hash(bin_of(level, first_index + i), layer[x:x + self.digest_size])
+
+    def get_layer(self, level):
+        """Get concatenated hashes of all nodes of a layer covering the content"""
+        ds = self.digest_size
+        step = (2 << level) * ds
+        first = bin_of(level, 0) * ds
+        last = bin_of(level, (max(self.num_chunks, 1) - 1) >> level) * ds
+        return b''.join(self.hashes[x:x + ds] for x in range(first, last + 1, step))
+
+    def get_known(self):
+        """Get flags of the known hashes by bin followed by all hashes"""
+        known = self._known if self._known is not None else b'\x01' * self.num_bins
+        return bytes(known) + bytes(self.hashes)
+
+    def set_known(self, data):
+        """Store known hashes given by get_known. Returns False if data is not of this tree"""
+        if len(data) != self.num_bins * (1 + self.digest_size):
+            return False
+
+        ds = self.digest_size
+        view = memoryview(data)
+        for node in range(self.num_bins):
+            if view[node]:
+                offset = self.num_bins + node * ds
+                self.set_hash(node, view[offset:offset + ds])
+        return True
+
+    def uncles(self, chunk_id):
+        """Get bins of the uncle nodes required to verify the chunk, starting
+           at the top of the tree. Nodes right of the content have null
+           hashes and are not included.
+        """
+        nodes = []
+        node = 2 * chunk_id
+        for level in range(self.height):
+            sibling = node ^ (2 << level)
+            if self.is_content(sibling):
+                nodes.append(sibling)
+            node = bin_parent(node)
+
+        nodes.reverse()
+        return nodes
+
+    def peaks(self):
+        """Get bins of the peaks - roots of the largest complete subtrees
+           covering the content, from left to right. Together they give the
+           root hash and the content size [RFC7574]
+        """
+        nodes = []
+        first_chunk = 0
+        for level in reversed(range(self.height + 1)):
+            if self.num_chunks & (1 << level):
+                nodes.append(bin_of(level, first_chunk >> level))
+                first_chunk += 1 << level
+        return nodes
+
+    def get_peak_hashes(self):
+        """Get (bin, hash) of each peak. None if any of them is not known"""
+        peaks = [(node, self.get_hash(node)) for node in self.peaks()]
+        if any(node_hash is None for (_, node_hash) in peaks):
+            return None
+        return peaks
+
+def tree_height(num_chunks):
+    """Number of layers above the chunk hashes in a tree of num_chunks chunks"""
+    return max(num_chunks - 1, 0).bit_length()
+
+def root_from_peaks(hash_func, peaks):
+    """Calculate the root hash from the (bin, hash) of the peaks ordered from
+       left to right. Nodes right of the last peak are null hashes.
+    """
+    if not peaks:
+        return None
+
+    null_hash = bytes(len(peaks[0][1]))
+    (node, node_hash) = peaks[-1]
+    level = bin_layer(node)
+    for (left_node, left_hash) in reversed(peaks[:-1]):
+        while level < bin_layer(left_node):
+            node_hash = hashlib.new(hash_func, node_hash + null_hash).digest()
+            level += 1
+        node_hash = hashlib.new(hash_func, left_hash + node_hash).digest()
+        level += 1
+
+    num_chunks = bin_end(node) + 1
+    while level < tree_height(num_chunks):
+        node_hash = hashlib.new(hash_func, node_hash + null_hash).digest()
+        level += 1
+
+    return node_hash
+
+def bin_of(level, index):
+    """Bin number of the index-th node of the layer"""
+    return (index << (level + 1)) + (1 << level) - 1
+
+def bin_layer(node):
+    """Layer of the bin - number of its trailing one bits"""
+    return ((node + 1) & ~node).bit_length() - 1
+
+def bin_parent(node):
+    """Bin of the parent node"""
+    level = bin_layer(node)
+    return (node & ~(2 << level)) | (1 << level)
+
+def bin_sibling(node):
+    """Bin of the other child of the parent node"""
+    return node ^ (2 << bin_layer(node))
+
+def bin_start(node):
+    """First chunk covered by the bin"""
+    level = bin_layer(node)
+    return (node >> (level + 1)) << level
+
+def bin_end(node):
+    """Last chunk covered by the bin"""
+    level = bin_layer(node)
+    return bin_start(node) + (1 << level) - 1
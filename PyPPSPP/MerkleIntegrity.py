@@ -0,0 +1,248 @@
+"""
+PyPPSPP, a Python3 implementation of Peer-to-Peer Streaming Peer Protocol
+Copyright (C) 2016,2017  J. Poderys, Technical University of Denmark
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Content integrity protection using Merkle hash tree [RFC7574] 5.
+Chunks are verified against the root hash (swarm id) using the
+uncle hashes received in INTEGRITY messages. All verified hashes
+are kept, so verification of a chunk stops at the first already
+verified node - next to a verified chunk only its own hash and
+one parent hash are calculated.
+"""
+
+import hashlib
+
+from MerkleHashTree import MerkleTree, bin_of, bin_layer, bin_parent, bin_start, bin_end
+
+class MerkleIntegrity(object):
+    """Verified Merkle hash tree of the swarm content. The tree might be a
+       subtree of a larger tree starting at first_chunk - chunks and bins
+       are numbered as in the larger tree.
+    """
+    PROTECTION_METHOD = 1               # Merkle Hash Tree method in HANDSHAKE
+    SIGNATURE_ALG = None                # Static content is not signed
+
+    def __init__(self, hash_func, num_chunks, root_hash, first_chunk = 0):
+        self._hash_func = hash_func
+        self.digest_size = hashlib.new(hash_func).digest_size
+        self.first_chunk = first_chunk
+        self._first_bin = 2 * first_chunk   # Bins of a subtree are shifted by twice its first chunk
+
+        self._tree = MerkleTree(self.digest_size, num_chunks)
+        self._tree.set_hash(self._tree.root_bin, root_hash)
+
+        # Stats
+        self.num_verified = 0           # Chunks that passed verification
+        self.num_failed = 0             # Chunks not matching the verified hashes
+        self.num_incomplete = 0         # Chunks without all required uncle hashes
+        self.num_hashes = 0             # Hash calculations while verifying
+
+    @property
+    def height(self):
+        return self._tree.height
+
+    def set_tree(self, tree):
+        """Use the full hash tree calculated from the content we have"""
+        if tree.root != self._tree.root:
+            raise ValueError('Tree does not match the root hash')
+        self._tree = tree
+
+    def get_tree(self):
+        """Get the full tree. None if not all hashes are verified"""
+        if not self._tree.is_complete():
+            return None
+        return self._tree
+
+    def get_known(self):
+        """Get serialized verified hashes, to be restored with set_known"""
+        return self._tree.get_known()
+
+    def set_known(self, data):
+        """Restore verified hashes given by get_known. Returns False
+           if they are not of this tree and nothing is restored.
+        """
+        tree = MerkleTree(self.digest_size, self._tree.num_chunks)
+        if not tree.set_known(data) or tree.root != self._tree.root:
+            return False
+        self._tree = tree
+        return True
+
+    @staticmethod
+    def range_to_node(start_chunk, end_chunk):
+        """Get bin of the node covering the chunk range. None if there is no such node"""
+        width = end_chunk - start_chunk + 1
+        if width < 1 or width & (width - 1) or start_chunk % width:
+            return None
+        level = width.bit_length() - 1
+        return bin_of(level, start_chunk >> level)
+
+    @staticmethod
+    def node_to_range(node):
+        """Get (start_chunk, end_chunk) covered by the bin"""
+        return (bin_start(node), bin_end(node))
+
+    def get_hash(self, node):
+        """Get verified hash of the bin. None if it is not known"""
+        node -= self._first_bin
+        if node < 0 or bin_layer(node) > self._tree.height:
+            return None
+        return self._tree.get_hash(node)
+
+    def get_signature(self, node):
+        """Get (timestamp, signature) of the bin. None if it is not signed"""
+        return None
+
+    def uncles(self, chunk_id):
+        """Get bins required to verify the chunk, starting at the top of the tree.
+           Nodes right of the content have null hashes and are not included.
+        """
+        return [node + self._first_bin for node in self._tree.uncles(chunk_id - self.first_chunk)]
+
+    def range_uncles(self, start_chunk, end_chunk):
+        """Get bins required to verify the chunks of the range sent in one DATA.
+           Nodes covering only chunks of the range are calculated by the
+           receiver from the data (hash_range) and are not included.
+        """
+        tree = self._tree
+        lo = start_chunk - self.first_chunk
+        hi = min(end_chunk - self.first_chunk, tree.num_chunks - 1)
+
+        # Nodes from lo to hi of each layer are calculated from the range,
+        # the siblings at its ends are needed to climb a layer up
+        nodes = []
+        for level in range(tree.height):
+            if lo & 1:
+                nodes.append(bin_of(level, lo - 1) + self._first_bin)
+            if not hi & 1 and tree.is_content(bin_of(level, hi + 1)):
+                nodes.append(bin_of(level, hi + 1) + self._first_bin)
+            lo >>= 1
+            hi >>= 1
+
+        nodes.reverse()
+        return nodes
+
+    def hash_range(self, start_chunk, chunks, hashes):
+        """Calculate hashes of the nodes covering only the consecutive chunks
+           received in one DATA and add them to the unverified hashes (dict
+           bin -> hash) - the sender leaves them out. Returns the added bins.
+        """
+        tree = self._tree
+        first = start_chunk - self.first_chunk
+        if first < 0 or first + len(chunks) > tree.num_chunks:
+            return []
+
+        offset = self._first_bin
+        lo = first
+        layer = [self._hash(data) for data in chunks]
+        added = []
+        for level in range(tree.height + 1):
+            for (i, node_hash) in enumerate(layer):
+                node = bin_of(level, lo + i) + offset
+                hashes[node] = node_hash
+                added.append(node)
+            if level == tree.height:
+                break
+
+            # Siblings at the ends of the layer are known or received uncles
+            if lo & 1:
+                sibling = bin_of(level, lo - 1)
+                sibling_hash = tree.get_hash(sibling) or hashes.get(sibling + offset)
+                if sibling_hash is None:
+                    del layer[0]
+                    lo += 1
+                else:
+                    layer.insert(0, sibling_hash)
+                    lo -= 1
+            if (lo + len(layer)) & 1:
+                sibling = bin_of(level, lo + len(layer))
+                sibling_hash = tree.get_hash(sibling) or hashes.get(sibling + offset)
+                if sibling_hash is None:
+                    del layer[-1]
+                else:
+                    layer.append(sibling_hash)
+            if not layer:
+                break
+
+            layer = [self._hash(layer[i] + layer[i + 1]) for i in range(0, len(layer), 2)]
+            lo >>= 1
+
+        return added
+
+    def verify(self, chunk_id, data, hashes):
+        """Verify the chunk using the known hashes and unverified hashes
+           received from the peer (dict bin -> hash). Received hashes used
+           in a successful verification are moved from the dict to the
+           verified tree. Returns True if the chunk is valid, False if it
+           is not and None if required uncle hashes are missing.
+        """
+        tree = self._tree
+        offset = self._first_bin
+        if not 0 <= chunk_id - self.first_chunk < tree.num_chunks:
+            self.num_failed += 1
+            return False
+
+        node_hash = self._hash(data)
+        level = 0
+        node = 2 * (chunk_id - self.first_chunk)
+        path = []
+
+        # Climb until a verified node is reached. The root is always verified
+        known = tree.get_hash(node)
+        while known is None:
+            sibling = node ^ (2 << level)
+            sibling_hash = tree.get_hash(sibling)
+            if sibling_hash is None:
+                sibling_hash = hashes.get(sibling + offset)
+                if sibling_hash is None:
+                    self.num_incomplete += 1
+                    return None
+
+            path.append((node, node_hash))
+            path.append((sibling, sibling_hash))
+
+            if node > sibling:
+                node_hash = self._hash(sibling_hash + node_hash)
+            else:
+                node_hash = self._hash(node_hash + sibling_hash)
+
+            node = bin_parent(node)
+            level += 1
+            known = tree.get_hash(node)
+
+        if known != node_hash:
+            self.num_failed += 1
+            return False
+
+        for (node, path_hash) in path:
+            tree.set_hash(node, path_hash)
+            hashes.pop(node + offset, None)
+
+        self.num_verified += 1
+        return True
+
+    def _hash(self, data):
+        self.num_hashes += 1
+        return hashlib.new(self._hash_func, data).digest()
+
+    def get_stats(self):
+        return {
+            'verified': self.num_verified,
+            'failed': self.num_failed,
+            'incomplete': self.num_incomplete,
+            'hashes': self.num_hashes
+        }
@@ -16,33 +16,46 @@ You should have received a copy of the GNU Lesser General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from struct import pack, unpack
+from struct import Struct
+
 from Messages.MessageTypes import MsgTypes
 
 class MsgAck(object):
     """A class representing ACK message"""
+    __slots__ = ('start_chunk', 'end_chunk', 'one_way_delay_sample')
+    BODY = Struct('>IIQ')               # Start chunk, end chunk, one way delay sample
+    MESSAGE = Struct('>BIIQ')           # Type, start chunk, end chunk, one way delay sample
+    SIZE = MESSAGE.size
+
+    def __init__(self, start_chunk = 0, end_chunk = 0, one_way_delay_sample = 0):
+        self.start_chunk = start_chunk
+        self.end_chunk = end_chunk
+        self.one_way_delay_sample = one_way_delay_sample
+
+    @staticmethod
+    def PackInto(buffer, offset, start_chunk, end_chunk, one_way_delay_sample):
+        """Write ACK of the given range into buffer at offset. Returns the offset after it"""
+        MsgAck.MESSAGE.pack_into(buffer, offset, MsgTypes.ACK, start_chunk, end_chunk, one_way_delay_sample)
+        return offset + MsgAck.SIZE
+
+    def GetSize(self):
+        """Length of the binary message"""
+        return MsgAck.SIZE
 
-    def __init__(self):
-        self.start_chunk = 0
-        self.end_chunk = 0
-        self.one_way_delay_sample = 0
+    def BuildInto(self, buffer, offset):
+        """Write the message into buffer at offset. Returns the offset after it"""
+        return MsgAck.PackInto(buffer, offset, self.start_chunk, self.end_chunk, self.one_way_delay_sample)
 
     def BuildBinaryMessage(self):
         """Build bytearray of the message"""
-        wb = bytearray()
-        wb[0:] = pack('>cIIQ', 
-                      bytes([MsgTypes.ACK]), 
-                      self.start_chunk, 
-                      self.end_chunk, 
-                      self.one_way_delay_sample)
+        wb = bytearray(MsgAck.SIZE)
+        self.BuildInto(wb, 0)
         return wb
 
-    def ParseReceivedData(self, data):
-        """Parse given bytearray to usable data"""
-        contents = unpack('>IIQ', data)
-        self.start_chunk = contents[0]
-        self.end_chunk = contents[1]
-        self.one_way_delay_sample = contents[2]
+    def ParseReceivedData(self, data, offset = 0):
+        """Parse the message at offset of the received data. Returns its length"""
+        (self.start_chunk, self.end_chunk, self.one_way_delay_sample) = MsgAck.BODY.unpack_from(data, offset)
+        return MsgAck.BODY.size
 
     def __str__(self):
         return str("[ACK] Start: {0}; End: {1}; Delay sample: {2};"
@@ -16,25 +16,42 @@ You should have received a copy of the GNU Lesser General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+from struct import Struct
+
+from Messages.MessageTypes import MsgTypes
+
 class MsgCancel(object):
     """A class representing CANCEL message"""
+    __slots__ = ('start_chunk', 'end_chunk')
+    BODY = Struct('>II')                # Start chunk, end chunk
+    MESSAGE = Struct('>BII')            # Type, start chunk, end chunk
+    SIZE = MESSAGE.size
+
+    def __init__(self, start_chunk = 0, end_chunk = 0):
+        self.start_chunk = start_chunk
+        self.end_chunk = end_chunk
 
-    def __init__(self):
-        self.start_chunk = 0
-        self.end_chunk = 0
+    @staticmethod
+    def PackInto(buffer, offset, start_chunk, end_chunk):
+        """Write CANCEL of the given range into buffer at offset. Returns the offset after it"""
+        MsgCancel.MESSAGE.pack_into(buffer, offset, MsgTypes.CANCEL, start_chunk, end_chunk)
+        return offset + MsgCancel.SIZE
+
+    def GetSize(self):
+        """Length of the binary message"""
+        return MsgCancel.SIZE
+
+    def BuildInto(self, buffer, offset):
+        """Write the message into buffer at offset. Returns the offset after it"""
+        return MsgCancel.PackInto(buffer, offset, self.start_chunk, self.end_chunk)
 
     def BuildBinaryMessage(self):
         """Build binary version of CANCEL message"""
-        wb = bytearray(8)
-        pack_into('>II', wb, 0, 
-                  self.start_chunk, 
-                  self.end_chunk)
-
+        wb = bytearray(MsgCancel.SIZE)
+        self.BuildInto(wb, 0)
         return wb
 
-    def ParseReceivedData(self, data):
-        """Parse received data back to the message"""
-        contents = unpack('>II', data)
-        self.start_chunk = contents[0]
-        self.end_chunk = contents[1]
-        
\ No newline at end of file
+    def ParseReceivedData(self, data, offset = 0):
+        """Parse the message at offset of the received data. Returns its length"""
+        (self.start_chunk, self.end_chunk) = MsgCancel.BODY.unpack_from(data, offset)
+        return MsgCancel.BODY.size
@@ -16,5 +16,8 @@ You should have received a copy of the GNU Lesser General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+from struct import Struct
+
 class MsgChoke(object):
-    """There is no data with this message. Only presence or abscence of it"""
\ No newline at end of file
+    """There is no data with this message. Only presence or abscence of it"""
+    BODY = Struct('')                   # No fields
@@ -17,15 +17,19 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import datetime
-from struct import pack, pack_into, unpack
+from struct import Struct
 
 from Messages.MessageTypes import MsgTypes
 
 class MsgData(object):
     """A class representing PPSPP handshake message"""
+    __slots__ = ('start_chunk', 'end_chunk', 'timestamp', 'data', '_chunk_size', '_chunk_addr_method', '_content_size')
     # TODO: We need to know how big are start and end fields
+    HEADER = Struct('>IIQ')             # Start chunk, end chunk, timestamp
+    MESSAGE_HEADER = Struct('>BIIQ')    # Type, start chunk, end chunk, timestamp
+    HEADER_SIZE = MESSAGE_HEADER.size
 
-    def __init__(self, chunk_size, chunk_addr_method):
+    def __init__(self, chunk_size, chunk_addr_method, content_size = None):
         self.start_chunk = 0
         self.end_chunk = 0
         self.timestamp = 0
@@ -34,35 +38,65 @@ class MsgData(object):
         # Peer dependant params
         self._chunk_size = chunk_size
         self._chunk_addr_method = chunk_addr_method
+        self._content_size = content_size   # Size of static content - its last chunk may be short. None if not known
+
+    def GetSize(self):
+        """Length of the binary message"""
+        return MsgData.HEADER_SIZE + len(self.data)
+
+    def BuildHeaderInto(self, buffer, offset):
+        """Write the message without the payload into buffer at offset. Returns the offset after it"""
+        MsgData.MESSAGE_HEADER.pack_into(buffer, offset,
+                                         MsgTypes.DATA,
+                                         self.start_chunk,
+                                         self.end_chunk,
+                                         self.timestamp)
+        return offset + MsgData.HEADER_SIZE
+
+    def BuildInto(self, buffer, offset):
+        """Write the message into buffer at offset. Returns the offset after it"""
+        offset = self.BuildHeaderInto(buffer, offset)
+        buffer[offset:offset + len(self.data)] = self.data
+        return offset + len(self.data)
+
+    def BuildBinaryHeader(self):
+        """Build bytearray of the message without the payload"""
+        wb = bytearray(MsgData.HEADER_SIZE)
+        self.BuildHeaderInto(wb, 0)
+        return wb
 
     def BuildBinaryMessage(self):
         """Build bytearray of the message"""
-        wb = bytearray()
-        wb.extend(pack('>cIIQ', 
-                      bytes([MsgTypes.DATA]), 
-                      self.start_chunk, 
-                      self.end_chunk, 
-                      self.timestamp))
-        wb.extend(self.data)
-
+        wb = bytearray(self.GetSize())
+        self.BuildInto(wb, 0)
         return wb
 
-    def ParseReceivedData(self, data):
-        """Parse binary data to an Object"""
+    def ParseReceivedData(self, data, offset = 0):
+        """Parse the message at offset of the received data. Returns its length.
+           Payload is a slice of data - a view if data is a memoryview.
+           Raises ValueError if the payload does not hold all the chunks.
+        """
 
         if self._chunk_addr_method == 2:
-            details = unpack('>IIQ', data[0:16])
-            self.start_chunk = details[0]
-            self.end_chunk = details[1]
-            self.timestamp = details[2]
+            (self.start_chunk, self.end_chunk, self.timestamp) = MsgData.HEADER.unpack_from(data, offset)
 
-            data_len = (self.end_chunk - self.start_chunk + 1) * self._chunk_size
-            self.data = data[16:data_len+16]
+            data_start = offset + MsgData.HEADER.size
+            data_len = self._payload_end() - self.start_chunk * self._chunk_size
+            self.data = data[data_start:data_start + data_len]
+            if len(self.data) != data_len:
+                raise ValueError('Payload of {} bytes instead of {}'.format(len(self.data), data_len))
 
-            return 16 + len(self.data)
+            return MsgData.HEADER.size + len(self.data)
         else:
             raise NotImplementedError()
 
+    def _payload_end(self):
+        """Content offset where the payload ends. Only the last chunk of the content is short"""
+        end = (self.end_chunk + 1) * self._chunk_size
+        if self._content_size is not None and self.end_chunk * self._chunk_size < self._content_size < end:
+            return self._content_size
+        return end
+
     def __str__(self):
         return str("[DATA] Start: {0}; End: {1}; TS: {2}; Data Len: {3}"
                    .format(
@@ -16,7 +16,7 @@ You should have received a copy of the GNU Lesser General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from struct import pack, pack_into, unpack
+from struct import Struct, unpack
 from array import array
 import uuid
 import logging
@@ -26,6 +26,15 @@ from Messages.MessageTypes import MsgTypes
 
 class MsgHandshake(object):
     """A class representing PPSPP handshake message"""
+    __slots__ = ('version', 'min_version', 'content_identity_protection', 'swarm',
+                 'merkle_tree_hash_func', 'live_signature_alg', 'chunk_addressing_method',
+                 'live_discard_window', 'supported_messages_len', 'supported_messages',
+                 'chunk_size', 'uuid', 'our_channel', 'their_channel', '_is_goodbye')
+    OPTION = Struct('>BB')              # Option, one byte value
+    LONG_OPTION = Struct('>BI')         # Option, four byte value
+    SWARM_OPTION = Struct('>BH')        # Option, length of the swarm identifier
+    GOODBYE = Struct('>BIBBBBB')        # Type, channel 0, version, min version, end option
+    END_OPTION = 255
 
     def __init__(self):
         self.version = GB.version
@@ -50,89 +59,112 @@ class MsgHandshake(object):
     def BuildGoodbye(self):
         """Build HANDSHAKE indicating that we are leaving"""
         
-        wb = bytearray()
-        wb[0:] = pack('>cI', bytes([MsgTypes.HANDSHAKE]), 0)
-        wb[len(wb):] = pack('cc', bytes([0]), bytes([self.version]))
-        wb[len(wb):] = pack('cc', bytes([1]), bytes([self.min_version]))
-        wb[len(wb):] = pack('c', bytes([255]))
+        wb = bytearray(MsgHandshake.GOODBYE.size)
+        MsgHandshake.GOODBYE.pack_into(wb, 0,
+                                       MsgTypes.HANDSHAKE, 0,
+                                       0, self.version,
+                                       1, self.min_version,
+                                       MsgHandshake.END_OPTION)
 
         self._is_goodbye = True
         return wb
 
-    def BuildBinaryMessage(self):
-        """Build HANDSHAKE message. Ref [RFC7574] §7"""
-        
-        wb = bytearray(512)
-        offset = 0
+    def GetSize(self):
+        """Length of the binary message built by BuildBinaryMessage"""
+        # Version, min version, swarm, protection method, addressing method, supported messages, chunk size, UUID, end
+        size = 2 + 2 + 3 + len(self.swarm) + 2 + 2 + 4 + 5 + 17 + 1
+        if self.content_identity_protection == 1 or self.content_identity_protection == 3:
+            size += 2
+        if self.content_identity_protection == 2 or self.content_identity_protection == 3:
+            size += 2
+        if self.live_discard_window != 0:
+            size += 5
+        return size
+
+    def BuildInto(self, buffer, offset):
+        """Write HANDSHAKE options into buffer at offset. Ref [RFC7574] §7.
+           Returns the offset after them.
+        """
+        option = MsgHandshake.OPTION.pack_into
+        long_option = MsgHandshake.LONG_OPTION.pack_into
 
         # Packing is done in sorted way
 
         # [0] Version
-        pack_into('cc', wb, offset, bytes([0]), bytes([self.version]))
+        option(buffer, offset, 0, self.version)
         offset = offset + 2
 
-		# [1] Minimum version
-        pack_into('cc', wb, offset, bytes([1]), bytes([self.min_version]))
+        # [1] Minimum version
+        option(buffer, offset, 1, self.min_version)
         offset = offset + 2
 
         # [2] Swarm identifier
         swid_len = len(self.swarm)
-        pack_into('>cH', wb, offset, bytes([2]), swid_len)
+        MsgHandshake.SWARM_OPTION.pack_into(buffer, offset, 2, swid_len)
         offset = offset + 1 + 2
         
-        wb[offset:offset+swid_len] = self.swarm
+        buffer[offset:offset+swid_len] = self.swarm
         offset = offset + swid_len
 
         # [3] Content Integrity Protection Method
-        pack_into('cc', wb, offset, bytes([3]), bytes([self.content_identity_protection]))
+        option(buffer, offset, 3, self.content_identity_protection)
         offset = offset + 2
 
         # [4] Merkle Tree Hash Function
-        if self.content_identity_protection == 1:
-            pack_into('cc', wb, offset, bytes([4]), bytes([self.merkle_tree_hash_func]))
+        if self.content_identity_protection == 1 or self.content_identity_protection == 3:
+            option(buffer, offset, 4, self.merkle_tree_hash_func)
             offset = offset + 2
 
         # [5] Live signature Algorith
         if (self.content_identity_protection == 2 or self.content_identity_protection == 3):
-            pack_into('cc', wb, offset, bytes([5]), bytes([self.live_signature_alg]))
+            option(buffer, offset, 5, self.live_signature_alg)
             offset = offset + 2
 
         # [6] Chunk addressing method
-        pack_into('cc', wb, offset, bytes([6]), bytes([self.chunk_addressing_method]))
+        option(buffer, offset, 6, self.chunk_addressing_method)
         offset = offset + 2
 
         # [7] Live discard window
         # Not according to specs!!!
         if self.live_discard_window != 0:
-            pack_into('>ci', wb, offset, bytes([7]), self.live_discard_window)
+            long_option(buffer, offset, 7, self.live_discard_window)
             offset = offset + 5
 
         # [8] Supported messages
         # Not according to specs!!!
-        pack_into('ccs', wb, offset, bytes([8]), bytes([self.supported_messages_len]), bytes([255, 255]))
+        option(buffer, offset, 8, self.supported_messages_len)
+        buffer[offset+2:offset+4] = bytes([255, 255])
         offset = offset + 4
 
         # [9] Chunk size
-        pack_into('>ci', wb, offset, bytes([9]), self.chunk_size)
+        long_option(buffer, offset, 9, self.chunk_size)
         offset = offset + 5
 
         # [10] Peer UUID
-        pack_into('>c', wb, offset, bytes([10]))
+        buffer[offset] = 10
         offset = offset + 1
 
-        wb[offset:offset+16] = self.uuid.bytes
+        buffer[offset:offset+16] = self.uuid.bytes
         offset = offset + 16
 
         # [255] End option
-        pack_into('c', wb, offset, bytes([255]))
+        buffer[offset] = MsgHandshake.END_OPTION
         offset = offset + 1
 
-        return wb[0:offset]
+        return offset
+
+    def BuildBinaryMessage(self):
+        """Build HANDSHAKE message. Ref [RFC7574] §7"""
+        wb = bytearray(self.GetSize())
+        self.BuildInto(wb, 0)
+        return wb
 
-    def ParseReceivedData(self, data):
-        """Parse received data until all HANDSHAKE message is parsed"""
+    def ParseReceivedData(self, data, offset = 0):
+        """Parse received data from offset until all HANDSHAKE message is parsed.
+           Returns the length of the parsed options.
+        """
         
-        idx = 0
+        idx = offset
         finish_parsing = False
 
         while finish_parsing == False:
@@ -152,7 +184,7 @@ class MsgHandshake(object):
                 idx = idx + 1
                 swarm_len = unpack('>H', data[idx:idx+2])[0]
                 idx = idx + 2
-                self.swarm = data[idx:idx+swarm_len]
+                self.swarm = bytes(data[idx:idx+swarm_len])
                 logging.debug("Parsed swid_len: {0} Swarm id: {1}".format(swarm_len, self.swarm))
                 idx = idx + swarm_len
             elif next_tag == 3:
@@ -185,7 +217,7 @@ class MsgHandshake(object):
                 idx = idx + 1
                 self.supported_messages_len = data[idx]
                 idx = idx + 1
-                self.supported_messages = data[idx:idx+self.supported_messages_len]
+                self.supported_messages = bytes(data[idx:idx+self.supported_messages_len])
                 logging.debug("Parsed sm: {0} {1}".format(self.supported_messages_len, self.supported_messages))
                 idx = idx + self.supported_messages_len
             elif next_tag == 9:
@@ -200,7 +232,10 @@ class MsgHandshake(object):
                 idx = idx + 16
             elif next_tag == 255:
                 logging.debug("Parsed: EOM")
-                return idx + 1
+                return idx + 1 - offset
+            else:
+                # Length of an unknown option is not known
+                raise ValueError('Unknown HANDSHAKE option {}'.format(next_tag))
             
     def __str__(self):
         if self._is_goodbye == True:
@@ -16,35 +16,48 @@ You should have received a copy of the GNU Lesser General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+from struct import Struct
+
 from Messages.MessageTypes import MsgTypes
-from struct import pack_into, unpack
 
 class MsgHave(object):
     """A class representing HAVE message"""
+    __slots__ = ('start_chunk', 'end_chunk')
+    BODY = Struct('>II')                # Start chunk, end chunk
+    MESSAGE = Struct('>BII')            # Type, start chunk, end chunk
+    SIZE = MESSAGE.size
+
+    def __init__(self, start_chunk = 0, end_chunk = 0):
+        self.start_chunk = start_chunk
+        self.end_chunk = end_chunk
+
+    @staticmethod
+    def PackInto(buffer, offset, start_chunk, end_chunk):
+        """Write HAVE of the given range into buffer at offset. Returns the offset after it"""
+        MsgHave.MESSAGE.pack_into(buffer, offset, MsgTypes.HAVE, start_chunk, end_chunk)
+        return offset + MsgHave.SIZE
 
-    def __init__(self):
-        self.start_chunk = 0
-        self.end_chunk = 0
+    def GetSize(self):
+        """Length of the binary message"""
+        return MsgHave.SIZE
+
+    def BuildInto(self, buffer, offset):
+        """Write the message into buffer at offset. Returns the offset after it"""
+        return MsgHave.PackInto(buffer, offset, self.start_chunk, self.end_chunk)
 
     def BuildBinaryMessage(self):
         """Build binary version of HAVE message"""
-        wb = bytearray(9)
-        pack_into('>cII', wb, 0,
-                  bytes([MsgTypes.HAVE]),
-                  self.start_chunk, 
-                  self.end_chunk)
-
+        wb = bytearray(MsgHave.SIZE)
+        self.BuildInto(wb, 0)
         return wb
 
-    def ParseReceivedData(self, data):
-        """Parse received data back to the message"""
-        contents = unpack('>II', data)
-        self.start_chunk = contents[0]
-        self.end_chunk = contents[1]
+    def ParseReceivedData(self, data, offset = 0):
+        """Parse the message at offset of the received data. Returns its length"""
+        (self.start_chunk, self.end_chunk) = MsgHave.BODY.unpack_from(data, offset)
+        return MsgHave.BODY.size
 
     def __str__(self):
         return str("[HAVE] Start: {0}; End: {1}".format(self.start_chunk, self.end_chunk))
 
     def __repr__(self):
         return self.__str__()
-        
\ No newline at end of file
@@ -17,11 +17,15 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import binascii
-from struct import pack, pack_into, unpack
+from struct import Struct
+
+from Messages.MessageTypes import MsgTypes
 
 
 class MsgIntegrity(object):
     """A class for INTEGRITY message"""
+    HEADER = Struct('>II')              # Start chunk, end chunk
+    MESSAGE_HEADER = Struct('>BII')     # Type, start chunk, end chunk
 
     def __init__(self, hash_type=0):
         self.start_chunk = 0
@@ -41,16 +45,35 @@ class MsgIntegrity(object):
             self.hash_len = 64 # SHA-512 64B
 
 
-    def ParseReceivedData(self, data):
-        """Parse binary data into object"""
+    def GetSize(self):
+        """Length of the binary message"""
+        return MsgIntegrity.MESSAGE_HEADER.size + len(self.hash_data)
+
+    def BuildInto(self, buffer, offset):
+        """Write the message into buffer at offset. Returns the offset after it"""
+        MsgIntegrity.MESSAGE_HEADER.pack_into(buffer, offset,
+                                              MsgTypes.INTEGRITY,
+                                              self.start_chunk,
+                                              self.end_chunk)
+        offset += MsgIntegrity.MESSAGE_HEADER.size
+        buffer[offset:offset + len(self.hash_data)] = self.hash_data
+        return offset + len(self.hash_data)
+
+    def BuildBinaryMessage(self):
+        """Build binary version of INTEGRITY message"""
+        wb = bytearray(self.GetSize())
+        self.BuildInto(wb, 0)
+        return wb
+
+    def ParseReceivedData(self, data, offset = 0):
+        """Parse the message at offset of the received data. Returns its length"""
 
-        details = unpack('>II', data[0:8])
-        self.start_chunk = details[0]
-        self.end_chunk = details[1]
+        (self.start_chunk, self.end_chunk) = MsgIntegrity.HEADER.unpack_from(data, offset)
 
-        self.hash_data = data[8:self.hash_len+8]
+        hash_start = offset + MsgIntegrity.HEADER.size
+        self.hash_data = data[hash_start:hash_start + self.hash_len]
 
-        return 8 + self.hash_len
+        return MsgIntegrity.HEADER.size + self.hash_len
 
     def __str__(self):
         return str("[INTEGRITY] Start: {0}; End: {1}; Hash Type: {2}; Hash Len: {3}; Hash: {4}"
@@ -16,35 +16,51 @@ You should have received a copy of the GNU Lesser General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from struct import pack_into, unpack
+from struct import Struct
+
+from Messages.MessageTypes import MsgTypes
 
 class MsgRequest(object):
     """A class representing REQUEST message"""
+    __slots__ = ('start_chunk', 'end_chunk')
+    BODY = Struct('>II')                # Start chunk, end chunk
+    MESSAGE = Struct('>BII')            # Type, start chunk, end chunk
+    SIZE = MESSAGE.size
     # TODO: support from 64 bit messages
 
-    def __init__(self):
-        self.start_chunk = 0
-        self.end_chunk = 0
+    def __init__(self, start_chunk = 0, end_chunk = 0):
+        self.start_chunk = start_chunk
+        self.end_chunk = end_chunk
+
+    @staticmethod
+    def PackInto(buffer, offset, start_chunk, end_chunk):
+        """Write REQUEST of the given range into buffer at offset. Returns the offset after it"""
+        MsgRequest.MESSAGE.pack_into(buffer, offset, MsgTypes.REQUEST, start_chunk, end_chunk)
+        return offset + MsgRequest.SIZE
+
+    def GetSize(self):
+        """Length of the binary message"""
+        return MsgRequest.SIZE
+
+    def BuildInto(self, buffer, offset):
+        """Write the message into buffer at offset. Returns the offset after it"""
+        return MsgRequest.PackInto(buffer, offset, self.start_chunk, self.end_chunk)
 
     def BuildBinaryMessage(self):
         """Build binary version of REQUEST message"""
-        wb = bytearray(8)
-        pack_into('>II', wb, 0, 
-                  self.start_chunk, 
-                  self.end_chunk)
-
+        wb = bytearray(MsgRequest.SIZE)
+        self.BuildInto(wb, 0)
         return wb
 
-    def ParseReceivedData(self, data):
-        """Parse received data back to the message"""
+    def ParseReceivedData(self, data, offset = 0):
+        """Parse the message at offset of the received data. Returns its length"""
         # TODO: This method should be adapted to chunk addressing method
-        contents = unpack('>II', data[0:8])
-        self.start_chunk = contents[0]
-        self.end_chunk = contents[1]
-        
+        (self.start_chunk, self.end_chunk) = MsgRequest.BODY.unpack_from(data, offset)
+        return MsgRequest.BODY.size
+
     def __str__(self):
         return str("[REQUEST] Start: {}; End: {}; Num chunks: {}"
                    .format(self.start_chunk, self.end_chunk, self.end_chunk - self.start_chunk + 1))
 
     def __repr__(self):
-        return self.__str__()
\ No newline at end of file
+        return self.__str__()
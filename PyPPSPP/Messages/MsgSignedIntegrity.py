@@ -0,0 +1,87 @@
+"""
+PyPPSPP, a Python3 implementation of Peer-to-Peer Streaming Peer Protocol
+Copyright (C) 2016,2017  J. Poderys, Technical University of Denmark
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import binascii
+from struct import Struct
+
+from Messages.MessageTypes import MsgTypes
+
+
+class MsgSignedIntegrity(object):
+    """A class for SIGNED_INTEGRITY message"""
+    HEADER = Struct('>IIQ')             # Start chunk, end chunk, timestamp
+    MESSAGE_HEADER = Struct('>BIIQ')    # Type, start chunk, end chunk, timestamp
+
+    def __init__(self, signature_alg=15):
+        self.start_chunk = 0
+        self.end_chunk = 0
+        self.timestamp = 0              # NTP timestamp of the signing
+        self.signature_alg = signature_alg
+        self.signature = None
+
+        if signature_alg == 13:
+            self.signature_len = 64     # ECDSAP256SHA256 64B
+        elif signature_alg == 15:
+            self.signature_len = 64     # ED25519 64B
+        elif signature_alg == 16:
+            self.signature_len = 114    # ED448 114B
+        else:
+            raise ValueError('Unsupported signature algorithm {}'.format(signature_alg))
+
+    def GetSize(self):
+        """Length of the binary message"""
+        return MsgSignedIntegrity.MESSAGE_HEADER.size + len(self.signature)
+
+    def BuildInto(self, buffer, offset):
+        """Write the message into buffer at offset. Returns the offset after it"""
+        MsgSignedIntegrity.MESSAGE_HEADER.pack_into(buffer, offset,
+                                                    MsgTypes.SIGNED_INTEGRITY,
+                                                    self.start_chunk,
+                                                    self.end_chunk,
+                                                    self.timestamp)
+        offset += MsgSignedIntegrity.MESSAGE_HEADER.size
+        buffer[offset:offset + len(self.signature)] = self.signature
+        return offset + len(self.signature)
+
+    def BuildBinaryMessage(self):
+        """Build binary version of SIGNED_INTEGRITY message"""
+        wb = bytearray(self.GetSize())
+        self.BuildInto(wb, 0)
+        return wb
+
+    def ParseReceivedData(self, data, offset = 0):
+        """Parse the message at offset of the received data. Returns its length"""
+
+        (self.start_chunk, self.end_chunk, self.timestamp) = MsgSignedIntegrity.HEADER.unpack_from(data, offset)
+
+        signature_start = offset + MsgSignedIntegrity.HEADER.size
+        self.signature = data[signature_start:signature_start + self.signature_len]
+
+        return MsgSignedIntegrity.HEADER.size + self.signature_len
+
+    def __str__(self):
+        return str("[SIGNED_INTEGRITY] Start: {0}; End: {1}; Timestamp: {2}; Signature Alg: {3}; Signature: {4}"
+                   .format(
+                       self.start_chunk,
+                       self.end_chunk,
+                       self.timestamp,
+                       self.signature_alg,
+                       binascii.hexlify(self.signature)))
+
+    def __repr__(self):
+        return self.__str__()
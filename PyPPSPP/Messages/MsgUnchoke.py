@@ -16,7 +16,8 @@ You should have received a copy of the GNU Lesser General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+from struct import Struct
+
 class MsgUnchoke(object):
     """There is no data in this message, only presence or abscence of it"""
-
-
+    BODY = Struct('')                   # No fields
@@ -16,4 +16,4 @@ You should have received a copy of the GNU Lesser General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-__all__ = ['MessageTypes', 'MsgAck', 'MsgCancel', 'MsgChoke', 'MsgData', 'MsgHandshake', 'MsgHave', 'MsgIntegrity', 'MsgRequest', 'MsgUnchoke']
\ No newline at end of file
+__all__ = ['MessageTypes', 'MsgAck', 'MsgCancel', 'MsgChoke', 'MsgData', 'MsgHandshake', 'MsgHave', 'MsgIntegrity', 'MsgRequest', 'MsgSignedIntegrity', 'MsgUnchoke']
\ No newline at end of file
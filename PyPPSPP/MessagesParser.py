@@ -16,75 +16,107 @@ You should have received a copy of the GNU Lesser General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import logging
-
-from struct import unpack
-from collections import deque
+from struct import Struct, error as StructError
 
 from Messages import *
 from Messages.MessageTypes import MsgTypes as MT
 
+class MalformedMessage(ValueError):
+    """Received data can not be parsed any further"""
+
 class MessagesParser(object):
-    """A parser for PPSPP messages. Binary data -> Msg Objects"""
+    """A streaming decoder of PPSPP messages. Binary data -> Msg handlers"""
+    CHANNEL = Struct('>I')
+
+    # Fixed size messages are handled by their fields - no message object is created
+    FIXED = {
+        MT.ACK: MsgAck.MsgAck.BODY,
+        MT.HAVE: MsgHave.MsgHave.BODY,
+        MT.REQUEST: MsgRequest.MsgRequest.BODY,
+        MT.CANCEL: MsgCancel.MsgCancel.BODY,
+        MT.CHOKE: MsgChoke.MsgChoke.BODY,
+        MT.UNCHOKE: MsgUnchoke.MsgUnchoke.BODY
+    }
 
-    def ParseData(peer_scope, received_data):
-        """Parse received messages to corresponding message objects"""
-        data_rx = len(received_data)
-        data_parsed = 0
+    # Fixed size messages starting with a chunk range. Their handlers loop over it
+    RANGED = frozenset([MT.HAVE, MT.REQUEST, MT.CANCEL])
+    CHUNK_LIMIT = 1 << 32               # Chunk ids are 32 bit
 
-        my_channel = unpack('>I', received_data[0:4])[0]
-        data_parsed = data_parsed + 4
+    def Decode(peer_scope, received_data, handlers):
+        """Pass each received message to the handler of its type (dict type -> callable)
+           as soon as it is parsed. Fixed size messages are passed as their unpacked
+           fields, others as message objects. Payloads of DATA, INTEGRITY and
+           SIGNED_INTEGRITY are views of the received data.
+           Raises MalformedMessage at the first message of unknown type, without
+           a handler, not fitting the data or with a chunk range the peer can not
+           have - the rest of the data is not parsed.
+           Returns the number of handled messages.
+        """
+        view = memoryview(received_data)
+        data_rx = len(view)
+        if data_rx < 4:
+            raise MalformedMessage('No channel in {} bytes'.format(data_rx))
 
-        messages = deque()
+        my_channel = MessagesParser.CHANNEL.unpack_from(view, 0)[0]
+        data_parsed = 4
+        num_messages = 0
+        fixed = MessagesParser.FIXED
+        ranged = MessagesParser.RANGED
+        max_range = peer_scope.max_range
+        end_limit = peer_scope.num_chunks
+        if end_limit is None:
+            end_limit = MessagesParser.CHUNK_LIMIT
 
-        # Parse messages based on
         while data_parsed < data_rx:
-             
-            type = received_data[data_parsed]
+            type = view[data_parsed]
             data_parsed = data_parsed + 1
 
-            message = None
-            
-            if type == MT.HANDSHAKE:
-                their_channel = unpack('>I', received_data[data_parsed:data_parsed+4])[0]
-                data_parsed = data_parsed + 4
-                message = MsgHandshake.MsgHandshake()
-                data_read = message.ParseReceivedData(received_data[data_parsed:])
-                message.our_channel = my_channel
-                message.their_channel = their_channel
-                if their_channel == 0:
-                    message._is_goodbye = True
-                data_parsed = data_parsed + data_read
-                messages.append(message)
-            elif type == MT.DATA:
-                message = MsgData.MsgData(peer_scope.chunk_size, peer_scope.chunk_addressing_method)
-                data_read = message.ParseReceivedData(received_data[data_parsed:])
-                data_parsed = data_parsed + data_read
-                messages.append(message)
-            elif type == MT.ACK:
-                message = MsgAck.MsgAck()
-                message.ParseReceivedData(received_data[data_parsed:])
-                data_parsed = data_parsed + 16
-                messages.append(message)
-            elif type == MT.INTEGRITY:
-                message = MsgIntegrity.MsgIntegrity(peer_scope.hash_type)
-                data_read = message.ParseReceivedData(received_data[data_parsed:])
-                data_parsed = data_parsed + data_read
-                messages.append(message)
-            elif type == MT.HAVE:
-                message = MsgHave.MsgHave()
-                message.ParseReceivedData(received_data[data_parsed:data_parsed+8])
-                data_parsed = data_parsed + 8
-                messages.append(message)
-            elif type == MT.REQUEST:
-                message = MsgRequest.MsgRequest()
-                message.ParseReceivedData(received_data[data_parsed:])
-                data_parsed = data_parsed + 8
-                messages.append(message)
-            
-            if message is None:
-                logging.info("Unknown type {0} !!!".format(type))
-
-            #logging.info("Received: {0}".format(message))
-
-        return messages
+            handler = handlers.get(type)
+            if handler is None:
+                raise MalformedMessage('Unexpected message type {} at {}'.format(type, data_parsed - 1))
+
+            body = fixed.get(type)
+            if body is not None:
+                if data_parsed + body.size > data_rx:
+                    raise MalformedMessage('Truncated {}'.format(MT.PPSPPMsgTypes[type]))
+                fields = body.unpack_from(view, data_parsed)
+                if type in ranged and (fields[1] < fields[0] or fields[1] - fields[0] >= max_range or
+                                       fields[1] >= end_limit):
+                    raise MalformedMessage('Bad range {}-{} in {}'.format(fields[0], fields[1], MT.PPSPPMsgTypes[type]))
+                handler(*fields)
+                data_parsed = data_parsed + body.size
+                num_messages = num_messages + 1
+                continue
+
+            try:
+                if type == MT.HANDSHAKE:
+                    their_channel = MessagesParser.CHANNEL.unpack_from(view, data_parsed)[0]
+                    data_parsed = data_parsed + 4
+                    message = MsgHandshake.MsgHandshake()
+                    message.our_channel = my_channel
+                    message.their_channel = their_channel
+                    if their_channel == 0:
+                        message._is_goodbye = True
+                elif type == MT.DATA:
+                    message = MsgData.MsgData(peer_scope.chunk_size, peer_scope.chunk_addressing_method,
+                                              peer_scope.content_size)
+                elif type == MT.INTEGRITY:
+                    message = MsgIntegrity.MsgIntegrity(peer_scope.hash_type)
+                elif type == MT.SIGNED_INTEGRITY:
+                    message = MsgSignedIntegrity.MsgSignedIntegrity(peer_scope.live_signature_alg)
+                else:
+                    raise MalformedMessage('Message type {} can not be parsed'.format(type))
+
+                data_read = message.ParseReceivedData(view, data_parsed)
+            except (StructError, IndexError, TypeError, ValueError, NotImplementedError) as exp:
+                # Data too short, unknown options or DATA before the HANDSHAKE
+                raise MalformedMessage('Bad {}: {}'.format(MT.PPSPPMsgTypes[type], exp)) from exp
+
+            data_parsed = data_parsed + data_read
+            if data_parsed > data_rx:
+                raise MalformedMessage('Truncated {}'.format(MT.PPSPPMsgTypes[type]))
+
+            handler(message)
+            num_messages = num_messages + 1
+
+        return num_messages
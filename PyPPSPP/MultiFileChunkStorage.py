@@ -0,0 +1,196 @@
+"""
+PyPPSPP, a Python3 implementation of Peer-to-Peer Streaming Peer Protocol
+Copyright (C) 2016,2017  J. Poderys, Technical University of Denmark
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+import logging
+import os
+import threading
+
+from FileChunkStorage import FileChunkStorage
+from FileManifest import FileManifest
+
+class FileHandleCache(object):
+    """Bounded number of open files of a manifest. Files are opened
+       on demand and the least recently used idle files are closed.
+       Safe to use in I/O threads.
+    """
+
+    def __init__(self, manifest, mode, max_open):
+        self._manifest = manifest
+        self._mode = mode
+        self._max_open = max_open
+        self._open = collections.OrderedDict()  # file index -> file
+        self._in_use = collections.Counter()    # file index -> number of users
+        self._lock = threading.Lock()
+
+    def acquire(self, index):
+        """Get open file. Must be released after use"""
+        with self._lock:
+            fp = self._open.get(index)
+            if fp is None:
+                fp = open(self._manifest.path(index), self._mode)
+                self._open[index] = fp
+            else:
+                self._open.move_to_end(index)
+            self._in_use[index] += 1
+            self._close_idle()
+            return fp
+
+    def release(self, index):
+        with self._lock:
+            self._in_use[index] -= 1
+            if self._in_use[index] == 0:
+                del self._in_use[index]
+            self._close_idle()
+
+    def _close_idle(self):
+        while len(self._open) > self._max_open:
+            idle = next((i for i in self._open if i not in self._in_use), None)
+            if idle is None:
+                return
+            self._open.pop(idle).close()
+
+    def sync(self):
+        """Flush all files to the disk"""
+        for index in range(len(self._manifest.files)):
+            fp = self.acquire(index)
+            try:
+                os.fsync(fp.fileno())
+            finally:
+                self.release(index)
+
+    def close(self):
+        with self._lock:
+            for fp in self._open.values():
+                fp.close()
+            self._open.clear()
+
+class MultiFileChunkStorage(FileChunkStorage):
+    """File storage of a swarm sharing many files. The chunk space is
+       mapped onto the concatenated files listed in a manifest, so one
+       chunk might span several files.
+    """
+    MAX_OPEN_FILES = 64                 # Max files kept open at once
+
+    def __init__(self, swarm):
+        super().__init__(swarm)
+        self._manifest = None
+
+    def Initialize(self, manifest_path = None, fsync = FileChunkStorage.FSYNC_NONE):
+        self._manifest = FileManifest.load(manifest_path)
+        logging.info('Manifest %s lists %s files. Content size: %s B',
+                     manifest_path, len(self._manifest.files), self._manifest.total_size)
+
+        super().Initialize(manifest_path, self._manifest.total_size, fsync)
+
+    def _content_exists(self):
+        return any(os.path.isfile(self._manifest.path(i)) for i in range(len(self._manifest.files)))
+
+    def _content_tree(self):
+        """Get Merkle hash tree of the concatenated files"""
+        for (index, (path, size)) in enumerate(self._manifest.files):
+            full_path = self._manifest.path(index)
+            if not os.path.isfile(full_path) or os.path.getsize(full_path) != size:
+                logging.info('File %s is missing or has a wrong size', path)
+                return None
+
+        with self._manifest.open_reader() as reader:
+            return self._mht.get_stream_tree(reader, self._manifest.total_size)
+
+    def _tree_sidecar(self):
+        """Content spans many files - there is no single file to key the tree by"""
+        return None
+
+    def _open_file(self, mode):
+        """Create missing files and get the cache of file handles. Files
+           on the disk are not truncated - one missing or damaged file must
+           not wipe the others. Chunks not verified are downloaded again
+           and written over the old data.
+        """
+        if mode != 'br':
+            for (index, (path, size)) in enumerate(self._manifest.files):
+                full_path = self._manifest.path(index)
+                if not os.path.isfile(full_path):
+                    os.makedirs(os.path.dirname(full_path), exist_ok = True)
+                    open(full_path, 'wb').close()
+                elif mode == 'w+b' and os.path.getsize(full_path) > size:
+                    # Data past the size in the manifest is not part of the content
+                    logging.info('File %s is longer than listed in the manifest. Cutting it to %s B', path, size)
+                    os.truncate(full_path, size)
+
+        return FileHandleCache(self._manifest, 'rb' if mode == 'br' else 'r+b',
+                               MultiFileChunkStorage.MAX_OPEN_FILES)
+
+    def _lost_chunks(self, have):
+        """Get chunks recorded in the sidecar that are beyond the end of their files"""
+        sizes = [os.path.getsize(self._manifest.path(i)) for i in range(len(self._manifest.files))]
+
+        lost = set()
+        for chunk_id in have:
+            spans = self._manifest.spans(chunk_id * self._chunk_size, self._chunk_size)
+            if any(sizes[index] < offset + length for (index, offset, length) in spans):
+                lost.add(chunk_id)
+        return lost
+
+    def _pread(self, offset, size):
+        """Read size bytes at offset of the content. Safe to use in I/O threads"""
+        parts = []
+        for (index, file_offset, length) in self._manifest.spans(offset, size):
+            fp = self._file.acquire(index)
+            try:
+                if hasattr(os, 'pread'):
+                    data = os.pread(fp.fileno(), length, file_offset)
+                else:
+                    with self._file_lock:
+                        fp.seek(file_offset)
+                        data = fp.read(length)
+            finally:
+                self._file.release(index)
+
+            # File not written up to here yet. Keep the next files' data in place
+            if len(data) < length:
+                data += bytes(length - len(data))
+            parts.append(data)
+
+        return b''.join(parts)
+
+    def _pwrite(self, offset, buffers):
+        """Write buffers at offset of the content. Safe to use in I/O threads"""
+        data = memoryview(buffers[0] if len(buffers) == 1 else b''.join(buffers))
+
+        pos = 0
+        for (index, file_offset, length) in self._manifest.spans(offset, len(data)):
+            fp = self._file.acquire(index)
+            try:
+                if hasattr(os, 'pwrite'):
+                    os.pwrite(fp.fileno(), data[pos:pos + length], file_offset)
+                else:
+                    with self._file_lock:
+                        fp.seek(file_offset)
+                        fp.write(data[pos:pos + length])
+                        fp.flush()
+            finally:
+                self._file.release(index)
+            pos += length
+
+    def _sync(self):
+        self._file.sync()
+
+    def get_file_range(self, start_chunk, end_chunk):
+        """Chunks might span files - sendfile is not used"""
+        return None
@@ -0,0 +1,233 @@
+"""
+PyPPSPP, a Python3 implementation of Peer-to-Peer Streaming Peer Protocol
+Copyright (C) 2016,2017  J. Poderys, Technical University of Denmark
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Benchmark of the UDP transport over an emulated network path.
+A seeder and a leecher swarm exchange a file over loopback through
+the in-process NetworkEmulator. Every combination of the chunk sending
+algorithm and the congestion controller is run on the same path.
+"""
+
+import argparse
+import asyncio
+import binascii
+import json
+import logging
+import os
+import random
+import tempfile
+
+from PeerProtocolUDP import PeerProtocolUDP
+from SwarmMember import SwarmMember
+from MerkleHashTree import MerkleHashTree
+from GlobalParams import GlobalParams
+from NetworkEmulator import NetworkEmulator
+from LEDBATSendRequestedChunks import LEDBATSendRequestedChunks
+from OfflineSendRequestedChunks import OfflineSendRequestedChunks
+
+SEND_ALGS = {
+    'ledbat': LEDBATSendRequestedChunks,
+    'offline': OfflineSendRequestedChunks
+}
+CONTROLLERS = ['ledbat', 'cubic', 'fixed']
+LOCALHOST = '127.0.0.1'
+
+def create_file(path, size, seed):
+    """Create a file with reproducible random contents"""
+    rnd = random.Random(seed)
+    with open(path, 'wb') as fp:
+        fp.write(bytes(rnd.getrandbits(8) for _ in range(size)))
+
+def swarm_args(args, work_dir, filename, swarm_id, cc, chunk_size):
+    """Build the arguments of a swarm as given by PyPPSPP command line"""
+    return argparse.Namespace(
+        swarmid = swarm_id,
+        filename = filename,
+        filesize = args.size,
+        live = False,
+        livesrc = False,
+        vod = False,
+        discardwnd = None,
+        dlfwd = 0,
+        alto = False,
+        numpeers = None,
+        identifier = 'benchmark',
+        skip = False,
+        buffsz = 0,
+        cc = cc,
+        ccrate = args.ccrate if args.ccrate is not None else args.rate,
+        mmap = args.mmap,
+        manifest = None,
+        chunksize = chunk_size,
+        fsync = 'none',
+        output_dir = work_dir + os.sep,
+        result_id = os.path.basename(filename))
+
+def use_send_alg(swarm, send_alg):
+    """Make all new members of the swarm use the given sending algorithm"""
+    add_member = swarm.AddMember
+
+    def AddMember(*args, **kwargs):
+        member = add_member(*args, **kwargs)
+        if isinstance(member, SwarmMember):
+            member._chunk_sending_alg = send_alg(swarm, member)
+        return member
+
+    swarm.AddMember = AddMember
+
+async def run_one(args, work_dir, seed_file, swarm_id, alg, cc, chunk_size):
+    """Transfer the file once. Returns the results dict"""
+    loop = asyncio.get_event_loop()
+    name = '{}-{}-{}'.format(alg, cc, chunk_size)
+
+    (seeder_transport, seeder) = await loop.create_datagram_endpoint(
+        PeerProtocolUDP, local_addr = (LOCALHOST, 0))
+    seeder.init_swarm(swarm_args(args, work_dir, seed_file, swarm_id, cc, chunk_size))
+    use_send_alg(seeder.swarm, SEND_ALGS[alg])
+
+    (emu_transport, emulator) = await loop.create_datagram_endpoint(
+        lambda: NetworkEmulator(
+            seeder_transport.get_extra_info('sockname'),
+            seed = args.seed,
+            delay = args.delay / 1000,
+            jitter = args.jitter / 1000,
+            loss = args.loss / 100,
+            rate = args.rate or None,
+            queue_limit = args.queue / 1000),
+        local_addr = (LOCALHOST, 0))
+
+    leecher_file = os.path.join(work_dir, name + '.dat')
+    (leecher_transport, leecher) = await loop.create_datagram_endpoint(
+        PeerProtocolUDP, local_addr = (LOCALHOST, 0))
+    leecher.init_swarm(swarm_args(args, work_dir, leecher_file, swarm_id, cc, chunk_size))
+
+    t_start = loop.time()
+    emu_addr = emu_transport.get_extra_info('sockname')
+    member = leecher.swarm.AddMember(emu_addr[0], emu_addr[1])
+    member.SendHandshake()
+
+    while leecher.swarm.set_missing and loop.time() - t_start < args.timeout:
+        await asyncio.sleep(0.01)
+    elapsed = loop.time() - t_start
+    completed = not leecher.swarm.set_missing
+
+    result = {
+        'alg': alg,
+        'cc': cc,
+        'chunk_size': chunk_size,
+        'completed': completed,
+        'time': elapsed,
+        'goodput': (args.size if completed else 0) / elapsed,
+        'data_tx': seeder.swarm._all_data_tx,
+        'retransmits': sum(m._num_retransmits for m in seeder.swarm._members),
+        'fast_losses': sum(m._num_fast_losses for m in seeder.swarm._members),
+        'rto_losses': sum(m._num_rto_losses for m in seeder.swarm._members),
+        'data_path': emulator.downlink.get_stats(),
+        'ack_path': emulator.uplink.get_stats(),
+        'integrity': leecher.swarm.integrity.get_stats()
+    }
+
+    # Tear down
+    if leecher.swarm._chunk_selction_handle is not None:
+        leecher.swarm.StopChunkRequesting()
+    leecher.CloseProtocol()
+    seeder.CloseProtocol()
+    for transport in [leecher_transport, emu_transport, seeder_transport]:
+        transport.close()
+
+    return result
+
+def print_results(results):
+    """Print results table"""
+    print('{:<8} {:<7} {:>6} {:>8} {:>12} {:>9} {:>9} {:>8} {:>6} {:>6} {:>6}'.format(
+        'Alg', 'CC', 'Chunk', 'Time s', 'Goodput B/s', 'QD avg ms', 'QD p95 ms',
+        'Retrans', 'Fast', 'RTO', 'Drops'))
+
+    for r in results:
+        path = r['data_path']
+        print('{:<8} {:<7} {:>6} {:>8} {:>12} {:>9.1f} {:>9.1f} {:>8} {:>6} {:>6} {:>6}'.format(
+            r['alg'],
+            r['cc'],
+            r['chunk_size'],
+            '{:.2f}'.format(r['time']) if r['completed'] else 'timeout',
+            int(r['goodput']),
+            path['queue_delay_avg'] * 1000,
+            path['queue_delay_p95'] * 1000,
+            r['retransmits'],
+            r['fast_losses'],
+            r['rto_losses'],
+            path['lost'] + path['overflows']))
+
+async def run_all(args):
+    """Run all requested combinations"""
+    results = []
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        seed_file = os.path.join(work_dir, 'seed.dat')
+        create_file(seed_file, args.size, args.seed)
+
+        for chunk_size in args.chunksize:
+            swarm_id = binascii.hexlify(
+                MerkleHashTree('sha1', chunk_size).get_file_hash(seed_file)).decode()
+
+            for alg in args.alg:
+                for cc in args.cc:
+                    results.append(await run_one(args, work_dir, seed_file, swarm_id, alg, cc, chunk_size))
+
+    return results
+
+def main(args):
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR,
+                        format='[%(levelname)s] %(asctime)s %(message)s')
+
+    print('Path: delay {} ms; jitter {} ms; loss {} %; rate {} B/s; queue {} ms; file {} B'.format(
+        args.delay, args.jitter, args.loss, args.rate, args.queue, args.size))
+
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(run_all(args))
+
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump({'args': vars(args), 'results': results}, fp, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark UDP transport over an emulated network")
+    parser.add_argument('--size', help='Size of the transferred file (Bytes). By default the last chunk is short',
+                        type=int, default=2*1024*1024 - 1000)
+    parser.add_argument('--delay', help='One-way delay (ms)', type=float, default=20)
+    parser.add_argument('--jitter', help='Max deviation of the one-way delay (ms)', type=float, default=2)
+    parser.add_argument('--loss', help='Random loss in each direction (%%)', type=float, default=0)
+    parser.add_argument('--rate', help='Bottleneck rate in each direction (Bytes/s). 0 - unlimited', type=int, default=1000000)
+    parser.add_argument('--queue', help='Bottleneck queue size (ms)', type=float, default=250)
+    parser.add_argument('--ccrate', help='Rate of fixed rate congestion control (Bytes/s). Default: --rate', type=int)
+    parser.add_argument('--alg', help='Chunk sending algorithms', nargs='+', choices=sorted(SEND_ALGS), default=sorted(SEND_ALGS))
+    parser.add_argument('--cc', help='Congestion controllers', nargs='+', choices=CONTROLLERS, default=CONTROLLERS)
+    parser.add_argument('--chunksize', help='Chunk sizes to run (Bytes)', nargs='+', type=int, default=[GlobalParams.chunk_size])
+    parser.add_argument('--mmap', help='Use memory mapped file storage', action='store_true')
+    parser.add_argument('--timeout', help='Max duration of one transfer (s)', type=float, default=60)
+    parser.add_argument('--seed', help='Seed of the random file contents and losses', type=int, default=1)
+    parser.add_argument('--json', help='Save results to the given JSON file', nargs='?')
+    parser.add_argument('--verbose', help='Log swarm activity', action='store_true')
+
+    args = parser.parse_args()
+    if max(args.chunksize) > PeerProtocolUDP.MAX_CHUNK_SIZE:
+        parser.error('Chunk size over UDP is limited to {} bytes'.format(PeerProtocolUDP.MAX_CHUNK_SIZE))
+
+    main(args)
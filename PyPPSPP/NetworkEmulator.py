@@ -0,0 +1,137 @@
+"""
+PyPPSPP, a Python3 implementation of Peer-to-Peer Streaming Peer Protocol
+Copyright (C) 2016,2017  J. Poderys, Technical University of Denmark
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import random
+import logging
+
+class EmulatedLink(object):
+    """One direction of an emulated network path. Packets are dropped
+       with the given probability, queued in a drop-tail bottleneck
+       served at rate Bytes/s and delivered after delay +/- jitter.
+       Packets are never reordered.
+    """
+
+    def __init__(self, loop, deliver, delay = 0.0, jitter = 0.0, loss = 0.0,
+                 rate = None, queue_limit = 0.25, rnd = None):
+        self._loop = loop
+        self._deliver = deliver             # Callback(data) delivering the packet
+        self._delay = delay                 # One-way propagation delay (s)
+        self._jitter = jitter               # Max random deviation of the delay (s)
+        self._loss = loss                   # Random loss probability
+        self._rate = rate                   # Bottleneck rate (Bytes/s). None - unlimited
+        self._queue_limit = queue_limit     # Max time a packet can wait in bottleneck (s)
+        self._rnd = rnd if rnd is not None else random.Random()
+
+        self._busy_until = 0                # Time bottleneck finishes serving queued data
+        self._last_delivery = 0             # Keep packets in order despite jitter
+
+        self.num_packets = 0
+        self.num_bytes = 0
+        self.num_lost = 0                   # Dropped due to random loss
+        self.num_overflows = 0              # Dropped due to full queue
+        self.queue_delays = []              # Time each packet spent in bottleneck queue (s)
+
+    def send(self, data):
+        """Put data on the link"""
+        now = self._loop.time()
+        self.num_packets += 1
+
+        if self._loss and self._rnd.random() < self._loss:
+            self.num_lost += 1
+            return
+
+        departure = now
+        if self._rate is not None:
+            queue_delay = max([0, self._busy_until - now])
+            if queue_delay > self._queue_limit:
+                self.num_overflows += 1
+                return
+            self.queue_delays.append(queue_delay)
+            departure = now + queue_delay + len(data) / self._rate
+            self._busy_until = departure
+
+        delay = self._delay
+        if self._jitter:
+            delay = max([0, delay + self._rnd.uniform(-self._jitter, self._jitter)])
+
+        delivery = max([departure + delay, self._last_delivery])
+        self._last_delivery = delivery
+        self.num_bytes += len(data)
+
+        if delivery <= now:
+            self._deliver(data)
+        else:
+            self._loop.call_at(delivery, self._deliver, data)
+
+    def get_stats(self):
+        """Get link statistics"""
+        delays = sorted(self.queue_delays)
+        stats = {
+            'packets': self.num_packets,
+            'bytes': self.num_bytes,
+            'lost': self.num_lost,
+            'overflows': self.num_overflows,
+            'queue_delay_avg': sum(delays) / len(delays) if delays else 0,
+            'queue_delay_p95': delays[int(len(delays) * 0.95)] if delays else 0,
+            'queue_delay_max': delays[-1] if delays else 0
+        }
+        return stats
+
+class NetworkEmulator(asyncio.DatagramProtocol):
+    """In-process UDP relay emulating a network path between a client
+       and a server. The client sends to the emulator address, the
+       emulator forwards the traffic to the server over the uplink and
+       all the replies back to the (first seen) client over the downlink.
+    """
+
+    def __init__(self, server_addr, seed = None, **link_params):
+        self._server_addr = server_addr
+        self._client_addr = None
+        self._transport = None
+
+        loop = asyncio.get_event_loop()
+        rnd = random.Random(seed)
+        self.uplink = EmulatedLink(loop, self._to_server, rnd = rnd, **link_params)
+        self.downlink = EmulatedLink(loop, self._to_client, rnd = rnd, **link_params)
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def datagram_received(self, data, addr):
+        if addr == self._server_addr:
+            if self._client_addr is not None:
+                self.downlink.send(data)
+        else:
+            if self._client_addr is None:
+                self._client_addr = addr
+            elif addr != self._client_addr:
+                logging.warning('Emulator: Ignoring datagram from unknown address %s', addr)
+                return
+            self.uplink.send(data)
+
+    def error_received(self, exc):
+        logging.warning('Emulator: Error received: %s', exc)
+
+    def _to_server(self, data):
+        if self._transport is not None and not self._transport.is_closing():
+            self._transport.sendto(data, self._server_addr)
+
+    def _to_client(self, data):
+        if self._transport is not None and not self._transport.is_closing():
+            self._transport.sendto(data, self._client_addr)
@@ -18,7 +18,6 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
 import time
-import struct
 import asyncio
 
 from Messages import *
@@ -28,17 +27,21 @@ class OfflineSendRequestedChunks(AbstractSendRequestedChunks):
     """Chunks sending algorithm for offline data sharing"""
 
     def __init__(self, swarm, member):
-        self._outstanding_backoff = False
+        self._sent_times = {}           # chunk_id -> (send time, is retransmit, bytes sent)
         return super().__init__(swarm, member)
 
     def SendAndSchedule(self):
         set_to_send = (self._swarm.set_have & self._member.set_requested) - self._member.set_sent
 
-        if any(set_to_send):
+        if set_to_send:
             # We have stuff to send - all is fine
             chunk_to_send = min(set_to_send)
        
-            data = self._swarm.GetChunkData(chunk_to_send)
+            data = self._get_chunk_data(chunk_to_send)
+            if data is None:
+                # Park until read from the storage
+                self._member._sending_handle = None
+                return
         
             md = MsgData.MsgData(self._member.chunk_size, self._member.chunk_addressing_method)
             md.start_chunk = chunk_to_send
@@ -46,40 +49,69 @@ class OfflineSendRequestedChunks(AbstractSendRequestedChunks):
             md.data = data
             md.timestamp = int((time.time() * 1000000))
 
-            mdata_bin = bytearray()
-            mdata_bin[0:4] = struct.pack('>I', self._member.remote_channel)
-            mdata_bin[4:] = md.BuildBinaryMessage()
+            mdata_bin = self._build_data(md, chunk_to_send in self._sent_times)
 
             self._member.SendAndAccount(mdata_bin)
             self._member.set_sent.add(chunk_to_send)
 
+            loop = asyncio.get_event_loop()
+            is_retransmit = chunk_to_send in self._sent_times
+            if is_retransmit:
+                self._member._num_retransmits += 1
+            self._sent_times[chunk_to_send] = (loop.time(), is_retransmit, len(mdata_bin))
+
             #logging.info("Can serve: {0}/{1} chunks. Sent {2} chunk"
             #             .format(len(set_to_send), len(self._swarm.set_have), chunk_to_send))
 
-            delay = self._member._ledbat.get_delay(len(mdata_bin))
-            if delay == 0:
-                self._member._sending_handle = asyncio.get_event_loop().call_soon(self._member.SendRequestedChunks)
-            else:
+            self._member._cc.on_send(len(mdata_bin), loop.time())
+            send_time = self._member._cc.next_send_time(len(mdata_bin), loop.time())
+            if send_time is None:
                 delay = 0.1
-                self._member._sending_handle = asyncio.get_event_loop().call_later(delay, self._member.SendRequestedChunks)
+                self._member._sending_handle = loop.call_later(delay, self._member.SendRequestedChunks)
+            elif send_time <= loop.time():
+                self._member._sending_handle = loop.call_soon(self._member.SendRequestedChunks)
+            else:
+                self._member._sending_handle = loop.call_at(send_time, self._member.SendRequestedChunks)
         else:
             # We have sent everything, now check if we need to resend
-            if any(self._swarm.set_have - self._member.set_requested):
-                # There are pieces in need of resending
-                if self._outstanding_backoff == False:
-                    # Give 1 sec to receive ACKs in flight
-                    logging.info("In the end-of-sending backoff")
-                    self._outstanding_backoff = True
-                    self._member._sending_handle = asyncio.get_event_loop().call_later(
-                        1, self._member.SendRequestedChunks)
-                else:
-                    # Remove un-ACKed pieces from sent set and keep sending
-                    self._member.set_sent = self._member.set_sent - self._member.set_requested
+            for chunk_id in [c for c in self._sent_times if c not in self._member.set_requested]:
+                del self._sent_times[chunk_id]
+
+            if self._sent_times:
+                # Resend chunks not ACKed within RTO
+                now = asyncio.get_event_loop().time()
+                rto = self._member._cc.timeout
+                expired = [c for (c, (t, _, _)) in self._sent_times.items() if now - t >= rto]
+
+                if expired:
+                    self._member._num_rto_losses += len(expired)
+                    self._member.set_sent.difference_update(expired)
+                    self._member._cc.backoff()
                     self._member._sending_handle = asyncio.get_event_loop().call_soon(
                         self._member.SendRequestedChunks)
+                else:
+                    oldest = min(t for (t, _, _) in self._sent_times.values())
+                    self._member._sending_handle = asyncio.get_event_loop().call_later(
+                        oldest + rto - now, self._member.SendRequestedChunks)
             else:
                 # All I have == all peer has
                 # Not even gonna reschedule the sender :)
                 self._member._sending_handle = None
 
+    def on_ack(self, chunk_ids, delay_samples):
+        """Feed ACKed data to the congestion controller"""
+        now = asyncio.get_event_loop().time()
+
+        rtt = None
+        bytes_acked = 0
+        for chunk_id in chunk_ids:
+            sent = self._sent_times.pop(chunk_id, None)
+            if sent is None:
+                continue
+            # Channel, INTEGRITY and DATA as sent
+            bytes_acked += sent[2]
+            # Karn's algorithm - do not sample RTT of retransmitted data
+            if not sent[1]:
+                rtt = now - sent[0]
 
+        self._member._cc.on_ack(bytes_acked, delay_samples, now, rtt)
@@ -0,0 +1,283 @@
+"""
+PyPPSPP, a Python3 implementation of Peer-to-Peer Streaming Peer Protocol
+Copyright (C) 2016,2017  J. Poderys, Technical University of Denmark
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Benchmark of the decoding of the received datagrams. Datagrams carrying
+a chunk with its INTEGRITY messages, a range of chunks as sent over TCP
+and a burst of HAVE, REQUEST and ACK messages are decoded and each
+message is passed to its handler. The streaming decoder dispatching by
+the message type is compared against parsing all messages of the datagram
+into objects first and dispatching them by their class, with the messages
+parsed in place from a memoryview or from a slice of the remaining data.
+The last chunk of the content is short, as at the end of a file. Time and
+bytes copied per handled message are reported.
+"""
+
+import argparse
+import json
+import os
+import time
+from collections import deque
+from types import SimpleNamespace
+
+from GlobalParams import GlobalParams
+from MessagesParser import MessagesParser
+from Messages import MsgAck, MsgData, MsgHandshake, MsgHave, MsgIntegrity, MsgRequest, MsgSignedIntegrity
+from Messages.MessageTypes import MsgTypes as MT
+
+WORKLOADS = ['data', 'range', 'burst']
+PAYLOADS = ['data', 'hash_data', 'signature']
+VARIABLE = [MT.HANDSHAKE, MT.DATA, MT.INTEGRITY, MT.SIGNED_INTEGRITY]
+
+class Handlers(object):
+    """Message handlers counting the handled messages"""
+
+    def __init__(self):
+        self.messages = 0
+        self.copied = 0
+        self.data_bytes = 0             # Payload of the handled DATA
+
+    def message(self, message):
+        self.messages += 1
+        if isinstance(message, MsgData.MsgData):
+            self.data_bytes += len(message.data)
+
+    def fields(self, *fields):
+        self.messages += 1
+
+    def table(self):
+        """Handlers by message type as used by the decoder"""
+        table = dict.fromkeys(VARIABLE, self.message)
+        table.update(dict.fromkeys(MessagesParser.FIXED, self.fields))
+        return table
+
+class CopyCounter(Handlers):
+    """Message handlers counting the payload bytes copied out of the datagram"""
+
+    def message(self, message):
+        super().message(message)
+        for attr in PAYLOADS:
+            payload = getattr(message, attr, None)
+            if payload is not None and not isinstance(payload, memoryview):
+                self.copied += len(payload)
+
+class ObjectParser(object):
+    """Baseline parsing all messages of the datagram in place into objects,
+       then dispatching them by their class
+    """
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.copied = 0
+
+    def _parse(self, message, received_data, offset):
+        return message.ParseReceivedData(received_data, offset)
+
+    def ParseData(self, peer_scope, received_data):
+        view = memoryview(received_data)
+        data_rx = len(view)
+        data_parsed = 4
+
+        messages = deque()
+        while data_parsed < data_rx:
+            type = view[data_parsed]
+            data_parsed = data_parsed + 1
+
+            if type == MT.DATA:
+                message = MsgData.MsgData(peer_scope.chunk_size, peer_scope.chunk_addressing_method,
+                                          peer_scope.content_size)
+            elif type == MT.ACK:
+                message = MsgAck.MsgAck()
+            elif type == MT.INTEGRITY:
+                message = MsgIntegrity.MsgIntegrity(peer_scope.hash_type)
+            elif type == MT.SIGNED_INTEGRITY:
+                message = MsgSignedIntegrity.MsgSignedIntegrity(peer_scope.live_signature_alg)
+            elif type == MT.HAVE:
+                message = MsgHave.MsgHave()
+            elif type == MT.REQUEST:
+                message = MsgRequest.MsgRequest()
+            else:
+                raise ValueError('Unexpected message type {}'.format(type))
+
+            data_parsed = data_parsed + self._parse(message, view, data_parsed)
+            messages.append(message)
+
+        for msg in messages:
+            if isinstance(msg, MsgHandshake.MsgHandshake):
+                self.handlers.message(msg)
+                continue
+            if isinstance(msg, MsgHave.MsgHave):
+                self.handlers.message(msg)
+                continue
+            if isinstance(msg, MsgData.MsgData):
+                self.handlers.message(msg)
+                continue
+            if isinstance(msg, MsgIntegrity.MsgIntegrity):
+                self.handlers.message(msg)
+                continue
+            if isinstance(msg, MsgSignedIntegrity.MsgSignedIntegrity):
+                self.handlers.message(msg)
+                continue
+            if isinstance(msg, MsgAck.MsgAck):
+                self.handlers.message(msg)
+                continue
+            if isinstance(msg, MsgRequest.MsgRequest):
+                self.handlers.message(msg)
+                continue
+
+class SlicingParser(ObjectParser):
+    """Baseline parsing each message from a copy of the remaining data"""
+
+    def _parse(self, message, received_data, offset):
+        rest = bytes(received_data[offset:])
+        self.copied += len(rest)
+        return message.ParseReceivedData(rest)
+
+class DispatchParser(object):
+    """Streaming decoder of the client"""
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.copied = 0
+        self._table = handlers.table()
+
+    def ParseData(self, peer_scope, received_data):
+        MessagesParser.Decode(peer_scope, received_data, self._table)
+
+PARSERS = {
+    'slice': SlicingParser,
+    'objects': ObjectParser,
+    'dispatch': DispatchParser
+}
+
+def content_size(workload, args):
+    """Size of the content sent in DATA of the workload. None if there is no DATA"""
+    if workload == 'burst':
+        return None
+    num_chunks = args.count * (args.range if workload == 'range' else 1)
+    return num_chunks * args.chunksize - args.tail
+
+def build_datagram(workload, args, seq):
+    """Build a datagram of the given workload"""
+    wb = bytearray(MessagesParser.CHANNEL.pack(1))
+
+    if workload == 'burst':
+        for i in range(args.burst):
+            chunk_id = seq * args.burst + i
+            msg = [MsgHave.MsgHave, MsgRequest.MsgRequest, MsgAck.MsgAck][i % 3]()
+            (msg.start_chunk, msg.end_chunk) = (chunk_id, chunk_id)
+            wb.extend(msg.BuildBinaryMessage())
+        return bytes(wb)
+
+    num_chunks = args.range if workload == 'range' else 1
+    start_chunk = seq * num_chunks
+    for i in range(args.hashes):
+        msg = MsgIntegrity.MsgIntegrity()
+        (msg.start_chunk, msg.end_chunk) = (start_chunk + i, start_chunk + i)
+        msg.hash_data = os.urandom(msg.hash_len)
+        wb.extend(msg.BuildBinaryMessage())
+
+    msg = MsgData.MsgData(args.chunksize, GlobalParams.chunk_addressing_method)
+    (msg.start_chunk, msg.end_chunk) = (start_chunk, start_chunk + num_chunks - 1)
+    msg.data = os.urandom(min(num_chunks * args.chunksize, content_size(workload, args) - start_chunk * args.chunksize))
+    wb.extend(msg.BuildBinaryMessage())
+    return bytes(wb)
+
+def run(parser_cls, peer_scope, datagrams):
+    """Decode all datagrams. Returns the results dict"""
+    parser = parser_cls(Handlers())
+
+    start = time.perf_counter()
+    for datagram in datagrams:
+        parser.ParseData(peer_scope, datagram)
+    run_time = time.perf_counter() - start
+
+    if parser.handlers.data_bytes != (peer_scope.content_size or 0):
+        raise RuntimeError('Decoded {} bytes of DATA instead of {}'.format(
+            parser.handlers.data_bytes, peer_scope.content_size))
+
+    # Count the copies outside of the timed loop
+    counter = parser_cls(CopyCounter())
+    for datagram in datagrams:
+        counter.ParseData(peer_scope, datagram)
+
+    return {
+        'time': run_time,
+        'messages': parser.handlers.messages,
+        'bytes': sum(len(d) for d in datagrams),
+        'copied': counter.copied + counter.handlers.copied
+    }
+
+def print_results(results):
+    """Print results table"""
+    print('{:<7} {:<8} {:>8} {:>9} {:>8} {:>11} {:>12}'.format(
+        'Load', 'Parser', 'Msgs/dg', 'Time s', 'us/msg', 'MB/s', 'Copied B/msg'))
+
+    for r in results:
+        print('{:<7} {:<8} {:>8} {:>9.3f} {:>8.2f} {:>11.1f} {:>12.1f}'.format(
+            r['workload'],
+            r['parser'],
+            r['messages'] // r['datagrams'],
+            r['time'],
+            r['time'] / r['messages'] * 1000000,
+            r['bytes'] / r['time'] / 1000000,
+            r['copied'] / r['messages']))
+
+def main(args):
+    if not 0 <= args.tail < args.chunksize:
+        raise ValueError('Tail must be shorter than a chunk')
+
+    print('Datagrams: {}; chunk size: {} B; hashes: {}; range: {} chunks; burst: {} messages; tail: {} B'.format(
+        args.count, args.chunksize, args.hashes, args.range, args.burst, args.tail))
+
+    results = []
+    for workload in args.load:
+        peer_scope = SimpleNamespace(
+            chunk_size = args.chunksize,
+            chunk_addressing_method = GlobalParams.chunk_addressing_method,
+            content_size = content_size(workload, args),
+            num_chunks = None,
+            max_range = 1,              # Burst messages are of single chunks
+            hash_type = 0,
+            live_signature_alg = 0)
+
+        datagrams = [build_datagram(workload, args, seq) for seq in range(args.count)]
+        for parser in args.parser:
+            r = run(PARSERS[parser], peer_scope, datagrams)
+            r.update(workload = workload, parser = parser, datagrams = len(datagrams))
+            results.append(r)
+
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump({'args': vars(args), 'results': results}, fp, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark decoding of the received datagrams")
+    parser.add_argument('--count', help='Number of parsed datagrams of each workload', type=int, default=5000)
+    parser.add_argument('--chunksize', help='Chunk size (Bytes)', type=int, default=GlobalParams.chunk_size)
+    parser.add_argument('--hashes', help='INTEGRITY messages sent with the data', type=int, default=2)
+    parser.add_argument('--range', help='Chunks in DATA of the range workload', type=int, default=16)
+    parser.add_argument('--burst', help='HAVE, REQUEST and ACK messages in the burst workload', type=int, default=90)
+    parser.add_argument('--tail', help='Bytes missing from the last chunk of the content', type=int, default=GlobalParams.chunk_size // 3)
+    parser.add_argument('--load', help='Workloads to run', nargs='+', choices=WORKLOADS, default=WORKLOADS)
+    parser.add_argument('--parser', help='Parsers to run', nargs='+', choices=sorted(PARSERS), default=sorted(PARSERS))
+    parser.add_argument('--json', help='Save results to the given JSON file', nargs='?')
+
+    main(parser.parse_args())
@@ -40,6 +40,8 @@ class PeerProtocolTCP(asyncio.Protocol):
         self._connection_id = hive._next_conn_id
         hive._next_conn_id += 1
         self._is_closed = False                     # Prevent closing socket after indication that it is already closed
+        self._sendfile_active = False               # Transport is owned by loop.sendfile
+        self._pending_writes = []                   # Data sent while sendfile is active
         
         self._is_out = is_out
 
@@ -107,6 +109,11 @@ class PeerProtocolTCP(asyncio.Protocol):
         packet.extend(struct.pack('>I', len(data)))
         packet.extend(data)
 
+        # Transport can't be written while sendfile is in progress
+        if self._sendfile_active:
+            self._pending_writes.append(packet)
+            return
+
         try:
             self._transport.write(packet)
         except Exception as exc:
@@ -115,6 +122,58 @@ class PeerProtocolTCP(asyncio.Protocol):
             logging.exception('Conn: %s Exception while sending', self._connection_id, exc_info=exc)
             self.remove_all_members()
 
+    def send_file_range(self, header, file_hdl, offset, count):
+        """Send header followed by count bytes of the file at offset
+           as one framed message. File data is sent using zero-copy
+           sendfile. Returns False if other sendfile is in progress.
+           The file is closed once it is sent or not used.
+        """
+        if self._sendfile_active or self._is_closed:
+            file_hdl.close()
+            return False
+
+        self._sendfile_active = True
+        asyncio.get_event_loop().create_task(
+            self._do_sendfile(header, file_hdl, offset, count))
+
+        return True
+
+    async def _do_sendfile(self, header, file_hdl, offset, count):
+        """Coro writing the framed header and streaming the file range"""
+        packet = bytearray()
+        packet.extend(struct.pack('>I', len(header) + count))
+        packet.extend(header)
+
+        try:
+            self._transport.write(packet)
+            await asyncio.get_event_loop().sendfile(
+                self._transport, file_hdl, offset, count)
+        except Exception as exc:
+            logging.exception('Conn: %s Exception while sending file', self._connection_id, exc_info=exc)
+            self._sendfile_active = False
+            self._pending_writes.clear()
+            self.remove_all_members()
+            return
+        finally:
+            file_hdl.close()
+
+        self._sendfile_active = False
+
+        # Flush everything that was sent in the meantime
+        pending = self._pending_writes
+        self._pending_writes = []
+        try:
+            for packet in pending:
+                self._transport.write(packet)
+        except Exception as exc:
+            logging.exception('Conn: %s Exception while sending', self._connection_id, exc_info=exc)
+            self.remove_all_members()
+            return
+
+        # Senders of all members might be waiting for the transport
+        for member in list(self._members.values()):
+            member.wake_sender()
+
     def data_received(self, data):
         """Called when data is received from the socket"""
         self._framer.DataReceived(data)
@@ -142,6 +201,10 @@ class PeerProtocolTCP(asyncio.Protocol):
         logging.warn("PEER PROTOCL IS DRAINED BELOW THE HIGH-WATER MARK")
         self._throttle = False
 
+        # Senders park while the transport is throttled
+        for member in self._members.values():
+            member.wake_sender()
+
     def data_deserialized(self, data):
         """Called when Framer has enough data"""
 
@@ -27,6 +27,7 @@ import SwarmMember
 
 class PeerProtocolUDP(asyncio.DatagramProtocol):
     """A class for use with Python asyncio library"""
+    MAX_CHUNK_SIZE = 65507 - 1024       # Max UDP payload less the headers and INTEGRITY sent with DATA
 
     def __init__(self):
         self.loop = asyncio.get_event_loop()
@@ -79,8 +80,13 @@ class PeerProtocolUDP(asyncio.DatagramProtocol):
         logging.warning("Error received: {0}".format(exc))
 
     def connection_lost(self, exc):
+        if exc is None:
+            # Closed by us
+            logging.info("Socket closed")
+            return
+
         logging.critical("Socket closed: {0}".format(exc))
-        loop.stop()
+        self.loop.stop()
 
     def pause_writing(self):
         logging.warn("PEER PROTOCOL IS OVER THE HIGH-WATER MARK")
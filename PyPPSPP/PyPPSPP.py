@@ -23,12 +23,15 @@ import socket
 import argparse
 import time
 import sys
+import binascii
 
 from PeerProtocolUDP import PeerProtocolUDP
 from PeerProtocolTCP import PeerProtocolTCP
 from TrackerClientProtocol import TrackerClientProtocol
 from SimpleTracker import SimpleTracker
 from Hive import Hive
+from GlobalParams import GlobalParams
+from LiveIntegrity import LiveIntegrity
 
 # Configure logger
 
@@ -49,6 +52,12 @@ def main(args):
         Buffer Sz: {};
         Dl Fwd: {};
         VOD: {};
+        CC: {};
+        MMap: {};
+        Manifest: {};
+        Chunk size: {}B;
+        Live key: {};
+        Chunks per signature: {};
     """.format(
             args.tracker, 
             args.filename, 
@@ -63,9 +72,35 @@ def main(args):
             args.discardwnd,
             args.buffsz,
             args.dlfwd,
-            args.vod
+            args.vod,
+            args.cc,
+            args.mmap,
+            args.manifest,
+            args.chunksize,
+            args.livekey,
+            args.livesig
     ))
 
+    if args.cc == 'fixed' and args.ccrate is None:
+        logging.error('Fixed rate congestion control requires --ccrate!')
+        return
+
+    if args.chunksize < 1:
+        logging.error('Chunk size must be positive!')
+        return
+
+    if not args.tcp and args.chunksize > PeerProtocolUDP.MAX_CHUNK_SIZE:
+        logging.error('Chunk size over UDP is limited to %s bytes!', PeerProtocolUDP.MAX_CHUNK_SIZE)
+        return
+
+    if args.live and LiveIntegrity.is_signed_swarm(binascii.unhexlify(args.swarmid)):
+        if args.livesrc and args.livekey is None:
+            logging.error('Source of a signed live stream requires --livekey!')
+            return
+        if args.livesig < 1 or args.livesig & (args.livesig - 1):
+            logging.error('Chunks per signature must be a power of two!')
+            return
+
     if args.vod and args.live:
         logging.error('Client cannot be VOD and LIVE at the same time!')
         return
@@ -203,6 +238,12 @@ if __name__ == "__main__":
     defaults['buffsz'] = 500
     defaults['dlfwd'] = 0
     defaults['vod'] = False
+    defaults['vodframes'] = 3330
+    defaults['cc'] = 'ledbat'
+    defaults['mmap'] = False
+    defaults['fsync'] = 'none'
+    defaults['chunksize'] = GlobalParams.chunk_size
+    defaults['livesig'] = LiveIntegrity.CHUNKS_PER_SIG
 
     # Parse command line parameters
     parser = argparse.ArgumentParser(description="Python implementation of PPSPP protocol")
@@ -210,9 +251,16 @@ if __name__ == "__main__":
     parser.add_argument("--filename", help="Filename of the shared file", nargs='?', default=defaults['filename'])
     parser.add_argument("--swarmid", help="Hash value of the swarm", nargs='?', default=defaults['swarmid'])
     parser.add_argument("--filesize", help="Size of the file", nargs='?', type=int, default=defaults['filesize'])
+    # Size of the chunks the content is split into. All peers of the swarm must use the same size
+    parser.add_argument("--chunksize", help="Chunk size of the swarm (Bytes)", nargs='?', type=int, default=defaults['chunksize'])
+    # Share all files listed in the manifest as one swarm. Replaces --filename and --filesize
+    parser.add_argument("--manifest", help="Manifest of the shared files", nargs='?')
     
     parser.add_argument("--live", help="Is this a live stream", action='store_true', default=defaults['live'])
     parser.add_argument("--livesrc", help="Is this a live stream source", action='store_true', default=defaults['live_src'])
+    # Live stream having the public key of the source as swarm id is signed. Source signs with the secret key
+    parser.add_argument("--livekey", help="File holding the secret key of the live source", nargs='?')
+    parser.add_argument("--livesig", help="Number of live chunks covered by one signature", nargs='?', type=int, default=defaults['livesig'])
     
     parser.add_argument("--numpeers", help="Limit the number of peers", nargs=1, type=int)
     parser.add_argument("--identifier", help="Free text that will be added to the results file", nargs='?')
@@ -230,6 +278,17 @@ if __name__ == "__main__":
     parser.add_argument('--dlfwd', help='Number of chunks to request after last played', nargs='?', type=int, default=defaults['dlfwd'])
     # Indicate that this is VOD
     parser.add_argument('--vod', help='This is Video-On-Demand CLIENT', action='store_true', default=defaults['vod'])
+    parser.add_argument('--vodframes', help='Number of A/V frames in the VOD content', nargs='?', type=int, default=defaults['vodframes'])
+    # VOD client keeps this many chunks from the playback position in memory. Others are spilled to a temporary file
+    parser.add_argument('--vodmem', help='Number of VOD chunks kept in memory', nargs='?', type=int)
+    # Congestion control of the data sent over UDP. LEDBAT yields to other traffic,
+    # CUBIC competes for the bandwidth, fixed sends at --ccrate bytes per second
+    parser.add_argument('--cc', help='Congestion control used in UDP swarm', choices=['ledbat', 'cubic', 'fixed'], default=defaults['cc'])
+    parser.add_argument('--ccrate', help='Sending rate (Bytes/s) of fixed rate congestion control', nargs='?', type=int)
+    # Memory map the shared file instead of reading and writing each chunk
+    parser.add_argument('--mmap', help='Use memory mapped file storage', action='store_true', default=defaults['mmap'])
+    # When downloaded data is forced to the disk: never, after each flush of the write buffer or once complete
+    parser.add_argument('--fsync', help='fsync policy of the downloaded file', choices=['none', 'flush', 'complete'], default=defaults['fsync'])
 
     # Start the program
     args = parser.parse_args()
@@ -0,0 +1,62 @@
+"""
+PyPPSPP, a Python3 implementation of Peer-to-Peer Streaming Peer Protocol
+Copyright (C) 2016,2017  J. Poderys, Technical University of Denmark
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import math
+
+class RTOEstimator(object):
+    """Retransmission timeout calculation as in [RFC6298].
+       All values are in seconds.
+    """
+    ALPHA = 1/8
+    BETA = 1/4
+    K = 4
+    G = 0.01            # Clock granularity
+    INIT_RTO = 1        # RTO before the first RTT sample
+    MIN_RTO = 0.2       # Lower bound (RFC uses 1s, which is too long for LAN)
+    MAX_RTO = 60        # Upper bound
+
+    def __init__(self):
+        self._srtt = None
+        self._rttvar = None
+        self._rto = RTOEstimator.INIT_RTO
+
+    @property
+    def rto(self):
+        """Current retransmission timeout"""
+        return self._rto
+
+    @property
+    def srtt(self):
+        """Smoothed RTT or None if there are no samples yet"""
+        return self._srtt
+
+    def update(self, rtt):
+        """Update the estimate using the RTT sample"""
+        if self._srtt is None:
+            self._srtt = rtt
+            self._rttvar = rtt / 2
+        else:
+            self._rttvar = (1 - RTOEstimator.BETA) * self._rttvar + RTOEstimator.BETA * math.fabs(self._srtt - rtt)
+            self._srtt = (1 - RTOEstimator.ALPHA) * self._srtt + RTOEstimator.ALPHA * rtt
+
+        self._rto = self._srtt + max([RTOEstimator.G, RTOEstimator.K * self._rttvar])
+        self._rto = min([max([self._rto, RTOEstimator.MIN_RTO]), RTOEstimator.MAX_RTO])
+
+    def backoff(self):
+        """Double the timeout after it has expired"""
+        self._rto = min([self._rto * 2, RTOEstimator.MAX_RTO])
@@ -40,9 +40,17 @@ from ALTOInterface import ALTOInterface
 
 from AbstractChunkStorage import AbstractChunkStorage
 from MemoryChunkStorage import MemoryChunkStorage
+from VODChunkStorage import VODChunkStorage
 from FileChunkStorage import FileChunkStorage
+from MMapFileChunkStorage import MMapFileChunkStorage
+from MultiFileChunkStorage import MultiFileChunkStorage
 from ContentConsumer import ContentConsumer
 from ContentGenerator import ContentGenerator
+from LiveIntegrity import LiveIntegrity
+
+from LEDBAT import LEDBAT
+from CUBIC import CUBIC
+from FixedRate import FixedRate
 
 class Swarm(object):
     """A class used to represent a swarm in PPSPP"""
@@ -55,6 +63,7 @@ class Swarm(object):
         self.live = args.live
         self.live_src = args.livesrc
         self.vod = args.vod
+        self.chunk_size = args.chunksize
         if args.discardwnd is not None:
             self.discard_wnd = int(args.discardwnd)
         else:
@@ -67,6 +76,10 @@ class Swarm(object):
 
         self._uuid = uuid.uuid4()
 
+        # Congestion control of UDP members
+        self.cc = args.cc
+        self.cc_rate = args.ccrate
+
         # setup for ALTO
         self._use_alto = False
         self._alto_cost_type = None
@@ -93,6 +106,8 @@ class Swarm(object):
         # TODO: Live discard window!
         self._selection_rps = 1         # Frequency of selection alg run (runs per second)
         self._chunk_storage = None
+        self.integrity = None           # Merkle tree verifying received chunks. Set by the storage if content size is known
+        self.content_size = None        # Size of static content. Set by the storage, None for streams
         self._chunk_selction_handle = None
         self._chunk_offer_handle = None
 
@@ -127,15 +142,22 @@ class Swarm(object):
 
         if self.vod:
             # Setup client for VOD role
-            self._chunk_storage = MemoryChunkStorage(self)
+            self._chunk_storage = VODChunkStorage(self, args.vodmem)
             self._chunk_storage.Initialize(False)
 
             self._cont_consumer = ContentConsumer(self, args)
-            self._cont_consumer._content_len = 3330 # TODO: Get from tracker!
+            self._cont_consumer._content_len = args.vodframes
             self.StartChunkRequesting()
             self._cont_consumer.start_consuming()
 
         elif self.live:
+            # Live stream having the public key of the source as swarm id is signed
+            if LiveIntegrity.is_signed_swarm(self.swarm_id):
+                secret_key = None
+                if self.live_src:
+                    secret_key = LiveIntegrity.load_secret(args.livekey)
+                self.integrity = LiveIntegrity('sha1', self.swarm_id, self.chunk_size, args.livesig, secret_key)
+
             # Initialize in memory chunk storage
             self._chunk_storage = MemoryChunkStorage(self)
             self._chunk_storage.Initialize(self.live_src)
@@ -155,11 +177,21 @@ class Swarm(object):
                 self._cont_consumer.allow_tune_in()
                 self.StartChunkRequesting()
                 self._cont_consumer.start_consuming()
+        elif args.manifest is not None:
+            # Many files shared as one swarm
+            self._chunk_storage = MultiFileChunkStorage(self)
+            self._chunk_storage.Initialize(
+                manifest_path = args.manifest,
+                fsync = args.fsync)
         else:
-            self._chunk_storage = FileChunkStorage(self)
+            if args.mmap:
+                self._chunk_storage = MMapFileChunkStorage(self)
+            else:
+                self._chunk_storage = FileChunkStorage(self)
             self._chunk_storage.Initialize(
                 filename = args.filename, 
-                filesize = args.filesize)
+                filesize = args.filesize,
+                fsync = args.fsync)
 
         logging.info('Created Swarm with ID: %s; Our UUID: %s', args.swarmid, self._uuid)
 
@@ -503,6 +535,23 @@ class Swarm(object):
             1 / self._selection_rps,
             self.ChunkRequest)
 
+    def chunks_available(self, chunk_ids):
+        """Wake up parked senders of members that requested any of the given chunks"""
+        for member in self._members:
+            if member._sending_handle is not None:
+                continue
+            if not member.set_requested.isdisjoint(chunk_ids):
+                member.wake_sender()
+
+    def create_congestion_control(self):
+        """Create congestion controller selected for this swarm"""
+        if self.cc == 'cubic':
+            return CUBIC()
+        elif self.cc == 'fixed':
+            return FixedRate(self.cc_rate)
+        else:
+            return LEDBAT()
+
     def _get_all_requested(self):
         """Return a set of all chunks that I have
            requested from all known members
@@ -527,12 +576,15 @@ class Swarm(object):
         # Update stats
         self._data_chunks_rx += 1
 
-        # Save chunk in our storage
-        self._chunk_storage.SaveChunkData(chunk_id, data)
+        # Save chunk in our storage. Written without blocking the event loop
+        self._chunk_storage.write_chunk(chunk_id, data)
         
         # Update chunk maps
         self.set_have.add(chunk_id)
         self.set_missing.discard(chunk_id)
+
+        # Members might be waiting for this chunk
+        self.chunks_available((chunk_id,))
         
         # Feed data to live video consumer if required
         if self.vod:
@@ -544,24 +596,30 @@ class Swarm(object):
 
         # Run post complete actions (not any() is faster than len() == 0)
         if not any(self.set_missing):
-            self._chunk_storage.PostComplete()
+            self._chunk_storage.drain().add_done_callback(self._storage_drained)
+
+    def _storage_drained(self, future):
+        """All downloaded chunks are written to the storage"""
+        if future.exception() is not None:
+            logging.error('Saving downloaded data failed: %s', future.exception())
+            return
+
+        self._chunk_storage.PostComplete()
 
     def SendHaveToMembers(self):
         """Send to members all information about chunks we have"""
         
-        # Build representation of our data using HAVE messages
-        msg = bytearray()
-        for range_data in self._have_ranges:
-            have = MsgHave.MsgHave()
-            have.start_chunk = range_data[0]
-            have.end_chunk = range_data[1]
-            msg.extend(have.BuildBinaryMessage())
+        # Build representation of our data using HAVE messages. Channel is left for each member
+        msg = bytearray(4 + len(self._have_ranges) * MsgHave.MsgHave.SIZE)
+        offset = 4
+        for (start_chunk, end_chunk) in self._have_ranges:
+            offset = MsgHave.MsgHave.PackInto(msg, offset, start_chunk, end_chunk)
         
         num_sent = 0
         for member in [m for m in self._members if m.is_init]:
-            hs = bytearray()
-            hs.extend(struct.pack('>I', member.remote_channel))
-            hs.extend(msg)
+            # Transport might keep the datagram - each member gets own copy
+            hs = bytearray(msg)
+            struct.pack_into('>I', hs, 0, member.remote_channel)
             member.SendAndAccount(hs)
             logging.info("Sent HAVE(%s) to peer: %s", self._have_ranges, member)
 
@@ -588,8 +646,22 @@ class Swarm(object):
         """Report amount of data sent and received from each peer"""
         logging.info("Data transfer stats:")
         for member in self._members:
-            logging.info("   Member: {0};\tRX: {1} Bytes; TX: {2} Bytes"
-                         .format(member, member._total_data_rx, member._total_data_tx))
+            logging.info("   Member: {0};\tRX: {1} Bytes; TX: {2} Bytes; Retransmits: {3}"
+                         .format(member, member._total_data_rx, member._total_data_tx,
+                                 member._num_retransmits))
+
+        stats = self._chunk_storage.get_stats()
+        if 'cache_hit_rate' in stats:
+            logging.info("   Chunk cache: Hit rate: {0:.2f}; Size: {1} Bytes; Block reads: {2}"
+                         .format(stats['cache_hit_rate'], stats['cache_bytes'], stats['block_reads']))
+
+        if self.integrity is not None:
+            stats = self.integrity.get_stats()
+            logging.info("   Integrity: Verified: {0}; Failed: {1}; Missing hashes: {2}; Hashes calculated: {3}"
+                         .format(stats['verified'], stats['failed'], stats['incomplete'], stats['hashes']))
+            if 'signatures' in stats:
+                logging.info("   Signatures: Signed: {0}; Verified: {1}; Failed: {2}"
+                             .format(stats['signed'], stats['signatures'], stats['bad_signatures']))
 
     def _print_periodic_stats(self):
         # Get stats
@@ -718,6 +790,7 @@ class Swarm(object):
         report['run_args'] = vars(self._args)
         report['member_stats'] = self._member_stats
         report['rx_discarded'] = self._discarded_rx
+        report['storage'] = self._chunk_storage.get_stats()
 
         if self.vod:
             self._cont_consumer.stop_consuming()
@@ -23,22 +23,29 @@ import struct
 import hashlib
 import binascii
 import time
+import math
 import asyncio
 
-from collections import deque
+from collections import deque, OrderedDict
 
 from Messages import *
 from Messages.MessageTypes import MsgTypes as MT
-from MessagesParser import MessagesParser
+from MessagesParser import MessagesParser, MalformedMessage
 from GlobalParams import GlobalParams
+from MerkleHashTree import bin_layer, bin_end
 from OfflineSendRequestedChunks import OfflineSendRequestedChunks
 from VODSendRequestedChunks import VODSendRequestedChunks
 from LEDBATSendRequestedChunks import LEDBATSendRequestedChunks
 from TCPFullSendRequestedChunks import TCPFullSendRequestedChunks
-from LEDBAT import LEDBAT
+from TCPSendfileSendRequestedChunks import TCPSendfileSendRequestedChunks
 
 class SwarmMember(object):
     """A class used to represent member in the swarm"""
+    ACK_DELAY = 0.01        # Max time a received chunk waits to be ACKed (s)
+    ACK_MAX_CHUNKS = 32     # ACK without delay once this many chunks are unACKed
+    MAX_UNVERIFIED = 64     # Max chunks waiting for uncle hashes sent with reordered DATA
+    MAX_RANGE = 1 << 20     # Max chunks in a HAVE, REQUEST or CANCEL range if the content is not bounded
+    HANDSHAKE_HEADER = struct.Struct('>IBI')    # Remote channel, HANDSHAKE, local channel
 
     def __init__(self, swarm, ip_address, udp_port = 6778, proto = None, peer_num = None):
         """Init object representing the remote peer"""
@@ -66,7 +73,19 @@ class SwarmMember(object):
         self.chunk_addressing_method = None
         self.chunk_size = None
         self.hash_type = None
+        self.live_signature_alg = None
         self.live_discard_wnd = None
+        self.content_size = swarm.content_size  # Only the last chunk of static content is short
+
+        # Limits of the ranges in HAVE, REQUEST and CANCEL, checked by the decoder
+        self.num_chunks = None                  # Chunks of static content. None if not known
+        if swarm.content_size is not None:
+            self.num_chunks = math.ceil(swarm.content_size / swarm.chunk_size)
+            self.max_range = max(self.num_chunks, 1)
+        elif swarm.discard_wnd is not None:
+            self.max_range = swarm.discard_wnd
+        else:
+            self.max_range = SwarmMember.MAX_RANGE
 
         self._max_have_value = 0
 
@@ -88,10 +107,14 @@ class SwarmMember(object):
         # Number of data messages received
         self._data_msg_rx = 0
 
-        # Pending ACK functionality
-        self._unacked_chunks = set()
-        self._unacked_first = None
-        self._unacked_last = None
+        # Retransmission counters (UDP)
+        self._num_retransmits = 0       # Number of chunks sent again
+        self._num_fast_losses = 0       # Chunks detected lost by later ACKs
+        self._num_rto_losses = 0        # Chunks detected lost by timeout
+
+        # Delayed ACK functionality
+        self._unacked_chunks = {}       # chunk_id -> one-way delay sample
+        self._ack_handle = None
 
         # Chunk-maps
         self.set_have = set()           # What peer has
@@ -99,12 +122,30 @@ class SwarmMember(object):
         self.set_sent = set()           # What chunks are sent but not ACK. After ACK they are removed
         self.set_i_requested = set()    # Set of chunks that I have requeseted from the member
 
-        self.unverified_data = []   # Keep all unverified messages
+        self.unverified_data = OrderedDict()    # chunk_id -> (data, delay) of chunks waiting for uncle hashes
+        self._hashes_rx = {}            # Bin -> unverified hash received in INTEGRITY
+        self.set_hashes_sent = set()    # Bins of hashes sent to the peer in INTEGRITY
+        self._num_integrity_failures = 0
         self._has_complete_data = False     # Peer has full content (i.e. VOD) [RFC7574] § 3.2
 
         # Outbox to stuff all reply messages into one datagram
         self._outbox = deque()
 
+        # Handlers of the received messages by type. Fixed size messages are handled by their fields
+        self._handlers = {
+            MT.HANDSHAKE: self.HandleHandshake,
+            MT.DATA: self.HandleData,
+            MT.ACK: self.HandleAck,
+            MT.HAVE: self.HandleHave,
+            MT.INTEGRITY: self.HandleIntegrity,
+            MT.SIGNED_INTEGRITY: self.HandleSignedIntegrity,
+            MT.REQUEST: self.HandleRequest,
+            MT.CANCEL: self.HandleCancel,
+            MT.CHOKE: self.HandleChoke,
+            MT.UNCHOKE: self.HandleUnchoke
+        }
+        self._num_malformed = 0         # Received datagrams with messages that could not be parsed
+
         # Member cleanup
         self._cleanup_hdl = asyncio.get_event_loop().call_later(
             15.0, self._clean_uninit_member)
@@ -118,9 +159,14 @@ class SwarmMember(object):
             if self._is_udp:
                 self._chunk_sending_alg = LEDBATSendRequestedChunks(self._swarm, self)
             else:
-                self._chunk_sending_alg = TCPFullSendRequestedChunks(self._swarm, self)
+                self._chunk_sending_alg = TCPSendfileSendRequestedChunks(self._swarm, self)
         self._sending_handle = None
-        self._ledbat = LEDBAT()
+        self._is_destroyed = False
+
+        # Congestion control of the data sent to the member (UDP only)
+        self._cc = None
+        if self._is_udp:
+            self._cc = self._swarm.create_congestion_control()
 
     def _clean_uninit_member(self):
         """Remove member if not init after timeout"""
@@ -132,35 +178,42 @@ class SwarmMember(object):
         self.destroy()
         self._swarm.RemoveMember(self)
 
-    def SendHandshake(self):
-        """Send initial packet to the potential remote peer"""
-
-        # Create a handshake message
+    def _build_handshake(self):
+        """Build datagram with our HANDSHAKE followed by HAVE of all chunks we have"""
         hs = MsgHandshake.MsgHandshake()
         hs.swarm = self._swarm.swarm_id
         hs.uuid = self._swarm._uuid
+        hs.chunk_size = self._swarm.chunk_size
+        if self._swarm.integrity is not None:
+            hs.content_identity_protection = self._swarm.integrity.PROTECTION_METHOD
+            hs.merkle_tree_hash_func = 0
+            if self._swarm.integrity.SIGNATURE_ALG is not None:
+                hs.live_signature_alg = self._swarm.integrity.SIGNATURE_ALG
 
         if self._swarm.discard_wnd is not None:
             hs.live_discard_window = self._swarm.discard_wnd
-        bm = hs.BuildBinaryMessage()
+
+        # Channel, HANDSHAKE with our channel, options and HAVEs in one buffer
+        have_ranges = self._swarm._have_ranges
+        data = bytearray(4 + 1 + 4 + hs.GetSize() + len(have_ranges) * MsgHave.MsgHave.SIZE)
+        SwarmMember.HANDSHAKE_HEADER.pack_into(data, 0, self.remote_channel, MT.HANDSHAKE, self.local_channel)
+        offset = hs.BuildInto(data, SwarmMember.HANDSHAKE_HEADER.size)
+
+        # Add information about pieces we have
+        for (start_chunk, end_chunk) in have_ranges:
+            offset = MsgHave.MsgHave.PackInto(data, offset, start_chunk, end_chunk)
+
+        return data
+
+    def SendHandshake(self):
+        """Send initial packet to the potential remote peer"""
 
         # Assign a local channel ID
         self.remote_channel = 0
         self.local_channel = random.randint(1, 65535)
 
         # Create a full HANDSHAKE message
-        hs = bytearray()
-        hs[0:4] = struct.pack('>I', self.remote_channel)
-        hs[4:] = bytes([MT.HANDSHAKE])
-        hs[5:7] = struct.pack('>I', self.local_channel)
-        hs[9:] = bm
-
-        # Add information about pieces we have
-        for range_data in self._swarm._have_ranges:
-            have = MsgHave.MsgHave()
-            have.start_chunk = range_data[0]
-            have.end_chunk = range_data[1]
-            hs[len(hs):] = have.BuildBinaryMessage()
+        hs = self._build_handshake()
 
         logging.info("Sending handshake to {0}:{1}. RC={2};LC={3}"
                      .format(self.ip_address, self.udp_port, self.remote_channel, self.local_channel))
@@ -174,30 +227,12 @@ class SwarmMember(object):
     def SendReplyHandshake(self):
         """Reply with a handshake when remote peer is connecting to us"""
 
-        hs = MsgHandshake.MsgHandshake()
-        hs.swarm = self._swarm.swarm_id
-        hs.uuid = self._swarm._uuid
-
-        if self._swarm.discard_wnd is not None:
-            hs.live_discard_window = self._swarm.discard_wnd
-        bm = hs.BuildBinaryMessage()
-
         self.local_channel = random.randint(1, 65535)
         
         # Create a full HANDSHAKE message
-        hs = bytearray()
-        hs[0:4] = struct.pack('>I', self.remote_channel)
-        hs[4:] = bytes([MT.HANDSHAKE])
-        hs[5:7] = struct.pack('>I', self.local_channel)
-        hs[9:] = bm
-
-        # Add information about pieces we have
-        for range_data in self._swarm._have_ranges:
-            have = MsgHave.MsgHave()
-            have.start_chunk = range_data[0]
-            have.end_chunk = range_data[1]
-            hs.extend(have.BuildBinaryMessage())
-            logging.info("Pigybacking on HANDSHAKE: {0}".format(have))
+        hs = self._build_handshake()
+        if self._swarm._have_ranges:
+            logging.info("Pigybacking on HANDSHAKE: HAVE {0}".format(self._swarm._have_ranges))
 
         logging.info("Replying with HANDSHAKE to {0}:{1}. RC={2};LC={3}"
                      .format(self.ip_address, self.udp_port, self.remote_channel, self.local_channel))
@@ -235,29 +270,13 @@ class SwarmMember(object):
     def ParseData(self, data):
         """Handle data received from the peer"""
 
-        # Parse all messages into queue
-        messages = MessagesParser.ParseData(self, data)
-        
         # Handle all messages in the same way as they arrived
-        for msg in messages:
-            if isinstance(msg, MsgHandshake.MsgHandshake):
-                self.HandleHandshake(msg)
-                continue
-            if isinstance(msg, MsgHave.MsgHave):
-                self.HandleHave(msg)
-                continue
-            if isinstance(msg, MsgData.MsgData):
-                self.HandleData(msg)
-                continue
-            if isinstance(msg, MsgIntegrity.MsgIntegrity):
-                self.HandleIntegrity(msg)
-                continue
-            if isinstance(msg, MsgAck.MsgAck):
-                self.HandleAck(msg)
-                continue
-            if isinstance(msg, MsgRequest.MsgRequest):
-                self.HandleRequest(msg)
-                continue
+        try:
+            MessagesParser.Decode(self, data, self._handlers)
+        except MalformedMessage as exp:
+            # Messages before the malformed one are already handled
+            self._num_malformed += 1
+            logging.warning("Dropping rest of the data from {0}: {1}".format(self._peer_num, exp))
 
         # Account all received data
         self._total_data_rx = self._total_data_rx + len(data)
@@ -297,7 +316,10 @@ class SwarmMember(object):
                                  self._proto.connection_id)
                 
                 # This is done before the duplicate check so the remote channel is set
-                self.SetPeerParameters(msg_handshake)
+                if not self.SetPeerParameters(msg_handshake):
+                    self.destroy()
+                    self._swarm.RemoveMember(self)
+                    return
 
                 # Check if we already have a peer with the same UUID
                 other_member = self._swarm.get_member_by_uuid(self, msg_handshake.uuid)
@@ -327,7 +349,10 @@ class SwarmMember(object):
                                  self._proto.connection_id, msg_handshake.uuid)
 
                 # This is done before the duplicate check so the remote channel is set
-                self.SetPeerParameters(msg_handshake)
+                if not self.SetPeerParameters(msg_handshake):
+                    self.destroy()
+                    self._swarm.RemoveMember(self)
+                    return
 
                 # Check if we already have a peer with the same UUID
                 other_member = self._swarm.get_member_by_uuid(self, msg_handshake.uuid)
@@ -348,17 +373,17 @@ class SwarmMember(object):
                     self._cleanup_hdl.cancel()
                     self._cleanup_hdl = None
 
-    def HandleHave(self, msg_have):
+    def HandleHave(self, start_chunk, end_chunk):
         """Update the local have map"""
         
         if self._logger.isEnabledFor(logging.DEBUG):
-            logging.DEBUG("FROM > {0} > HAVE: {1}".format(self._peer_num, msg_have))
+            logging.debug("FROM > {0} > HAVE: {1} to {2}".format(self._peer_num, start_chunk, end_chunk))
 
         # TODO: THIS NEEDS TO BE ADJUSTED FOR VOD
         if self._swarm.live and self.live_discard_wnd is not None:
             # Check for new max
-            if msg_have.end_chunk > self._max_have_value:
-                self._max_have_value = msg_have.end_chunk
+            if end_chunk > self._max_have_value:
+                self._max_have_value = end_chunk
 
                 lower_bound = self._max_have_value - self.live_discard_wnd
 
@@ -368,7 +393,7 @@ class SwarmMember(object):
                 if any(self.set_i_requested):
                     self.set_i_requested = set(filter(lambda x: x > lower_bound, self.set_i_requested))
         
-        for i in range(msg_have.start_chunk, msg_have.end_chunk+1):
+        for i in range(start_chunk, end_chunk+1):
             self.set_have.add(i)
 
             # Special handling for live swarms
@@ -382,72 +407,179 @@ class SwarmMember(object):
 
     def HandleData(self, msg_data):
         """Handle the received data"""
-        # Place integrity checking here once ready
-        
         # Save for stats
         self._data_msg_rx += 1
 
-        # Save data to file
-        # TODO: Hack. now taking one chunk only
-        self.set_i_requested.discard(msg_data.start_chunk)
-        self._swarm.SaveVerifiedData(msg_data.start_chunk, msg_data.data)
+        delay = int((time.time() * 1000000) - msg_data.timestamp)
 
+        # Save data to file. DATA might carry a range of chunks
+        verified = {}
+        if msg_data.start_chunk == msg_data.end_chunk:
+            self.set_i_requested.discard(msg_data.start_chunk)
+            if self._verify_chunk(msg_data.start_chunk, msg_data.data, delay):
+                self._swarm.SaveVerifiedData(msg_data.start_chunk, msg_data.data)
+                verified[msg_data.start_chunk] = delay
+        else:
+            data_view = memoryview(msg_data.data)
+            chunks = [data_view[x:x + self.chunk_size] for x in range(0, len(data_view), self.chunk_size)]
+
+            # Hashes of the nodes inside the range are not sent - calculate them from the data
+            calculated = []
+            if self._swarm.integrity is not None:
+                calculated = self._swarm.integrity.hash_range(msg_data.start_chunk, chunks, self._hashes_rx)
+
+            waiting = False
+            for (chunk_id, data) in enumerate(chunks, msg_data.start_chunk):
+                self.set_i_requested.discard(chunk_id)
+                if self._verify_chunk(chunk_id, data, delay):
+                    self._swarm.SaveVerifiedData(chunk_id, data)
+                    verified[chunk_id] = delay
+                elif chunk_id in self.unverified_data:
+                    waiting = True
+
+            # Chunks waiting for uncle hashes still need the calculated ones
+            if not waiting:
+                for node in calculated:
+                    self._hashes_rx.pop(node, None)
+
+        # Hashes verified now might complete the chunks that arrived before them
+        if verified and self.unverified_data:
+            verified.update(self._verify_waiting())
+
+        self._ack_verified(verified)
+
+    def _ack_verified(self, verified):
+        """Acknowledge verified chunks (chunk_id -> delay)"""
         # No need to send ACKs in TCP
-        if not self._is_udp:
+        if not self._is_udp or not verified:
             return
 
-        # Pending ACK funcionality
-        if self._unacked_first is None:
-            # This is a first data piece
-            self._unacked_first = msg_data.start_chunk
-            self._unacked_last = msg_data.start_chunk
-        else:
-            # This is not a first data piece
-            if self._unacked_last+1 == msg_data.start_chunk:
-                # Keep increasing untill there's a break
-                self._unacked_last = msg_data.start_chunk
-                if self._unacked_last - self._unacked_first == 10:
-                    # Send ACK after 10 unacked
-                    if self._logger.isEnabledFor(logging.DEBUG):
-                        logging.debug("ua 10: from {} to {}".format(self._unacked_first, self._unacked_last))
-                    self.BuildAck(self._unacked_first, self._unacked_last, msg_data.timestamp)
-                    # Reset counters
-                    self._unacked_first = None
-                    self._unacked_last = None
+        # Delayed ACK. As described in [RFC7574] 8.7 && [RFC6817]
+        # Chunks failing verification are not ACKed - the peer sends them again with all uncle hashes
+        self._unacked_chunks.update(verified)
+
+        if len(self._unacked_chunks) >= SwarmMember.ACK_MAX_CHUNKS:
+            # Do not hold back the sender - ACK now (sent by ProcessOutbox)
+            self.BuildAcks()
+        elif self._ack_handle is None:
+            self._ack_handle = asyncio.get_event_loop().call_later(
+                SwarmMember.ACK_DELAY, self._send_delayed_acks)
+
+    def _verify_chunk(self, chunk_id, data, delay):
+        """Check received chunk against the Merkle hash tree [RFC7574] 5.
+           Chunks we already have are not verified again. Chunks missing
+           uncle hashes wait for them - DATA carrying them might be reordered.
+        """
+        integrity = self._swarm.integrity
+        if integrity is None:
+            return True
+
+        if chunk_id in self._swarm.set_have:
+            # Uncles of a chunk we have are verified - drop copies sent with the duplicate
+            for node in integrity.uncles(chunk_id):
+                self._hashes_rx.pop(node, None)
+            return True
+
+        valid = integrity.verify(chunk_id, data, self._hashes_rx)
+        if valid:
+            return True
+
+        if valid is None:
+            # Data is a view of the received datagram - do not keep all of it alive
+            self.unverified_data[chunk_id] = (bytes(data), delay)
+            if len(self.unverified_data) > SwarmMember.MAX_UNVERIFIED:
+                self.unverified_data.popitem(last = False)
+            return False
+
+        self._num_integrity_failures += 1
+        if self._logger.isEnabledFor(logging.DEBUG):
+            logging.debug("FROM > {} > DATA: chunk {} failed integrity check".format(self._peer_num, chunk_id))
+        return False
+
+    def _verify_waiting(self):
+        """Verify chunks waiting for uncle hashes. Returns chunk_id -> delay of verified chunks"""
+        verified = {}
+        progress = True
+        while progress and self.unverified_data:
+            progress = False
+            for (chunk_id, (data, delay)) in list(self.unverified_data.items()):
+                if chunk_id in self._swarm.set_have:
+                    del self.unverified_data[chunk_id]
+                    continue
+
+                valid = self._swarm.integrity.verify(chunk_id, data, self._hashes_rx)
+                if valid is None:
+                    continue
+
+                del self.unverified_data[chunk_id]
+                if valid:
+                    self._swarm.SaveVerifiedData(chunk_id, data)
+                    verified[chunk_id] = delay
+                    progress = True
+                else:
+                    self._num_integrity_failures += 1
+
+        return verified
+
+    def BuildAcks(self):
+        """Build ACK messages covering all unacknowledged chunks.
+           One ACK is built for each continuous range of chunks, carrying
+           the lowest delay sample observed in that range.
+        """
+        if self._ack_handle is not None:
+            self._ack_handle.cancel()
+            self._ack_handle = None
+
+        if not self._unacked_chunks:
+            return
+
+        chunk_ids = sorted(self._unacked_chunks)
+        range_start = chunk_ids[0]
+        range_end = range_start
+        for chunk_id in chunk_ids[1:]:
+            if chunk_id == range_end + 1:
+                range_end = chunk_id
             else:
-                # We have a break
-                if self._logger.isEnabledFor(logging.DEBUG):
-                    logging.debug("ua br: from {} to {}".format(self._unacked_first, self._unacked_last))
-                self.BuildAck(self._unacked_first, self._unacked_last, msg_data.timestamp)
-                self._unacked_first = msg_data.start_chunk
-                self._unacked_last = msg_data.start_chunk
-
-    def BuildAck(self, min, max, ts):
-        # Send ack to peer
+                self._build_ack(range_start, range_end)
+                range_start = chunk_id
+                range_end = chunk_id
+        self._build_ack(range_start, range_end)
+
+        self._unacked_chunks.clear()
+
+    def _build_ack(self, start_chunk, end_chunk):
+        """Build ACK for the given range of unacknowledged chunks"""
         msg_ack = MsgAck.MsgAck()
-        (min_ch, max_ch) = self._swarm.GetAckRange(min, max)
-        msg_ack.start_chunk = min_ch
-        msg_ack.end_chunk = max_ch
-        
-        # As described in [RFC7574] 8.7 && [RFC6817]
-        delay = int((time.time() * 1000000) - ts)
-        msg_ack.one_way_delay_sample = delay
+        msg_ack.start_chunk = start_chunk
+        msg_ack.end_chunk = end_chunk
+        msg_ack.one_way_delay_sample = min(
+            self._unacked_chunks[x] for x in range(start_chunk, end_chunk + 1))
 
         if self._logger.isEnabledFor(logging.DEBUG):
             logging.debug("Sent ACK for {} to {}".format(msg_ack.start_chunk, msg_ack.end_chunk))
 
         self._outbox.append(msg_ack)
 
+    def _send_delayed_acks(self):
+        """Delayed ACK timer expired - send all pending ACKs"""
+        self._ack_handle = None
+        self.BuildAcks()
+        self.ProcessOutbox()
+
     def RequestChunks(self, chunks_set):
         """Request chunks from this member"""
         # This function takes set-like object and transforms it into 
         # number of REQUEST messages. 
 
+        # Choked peer ignores requests
+        if self.remote_choked:
+            return
+
         # This var sets the max number of chunks that will be requested
         req_list = list(chunks_set)
         req_list.sort()
 
-        req_msgs = []
+        req_ranges = []
 
         i_min = None
         i_max = None
@@ -462,60 +594,91 @@ class SwarmMember(object):
                 i_max = i
                 continue
             else:
-                # Range break - create message
-                req = MsgRequest.MsgRequest()
-                req.start_chunk = i_min
-                req.end_chunk = i_max
-                req_msgs.append(req)
+                # Range break
+                req_ranges.append((i_min, i_max))
 
                 # Start new range
                 i_min = i
                 i_max = i
         
-        # One last build
+        # One last range
         if i_min is not None and i_max is not None:
-            req = MsgRequest.MsgRequest()
-            req.start_chunk = i_min
-            req.end_chunk = i_max
-            req_msgs.append(req)
+            req_ranges.append((i_min, i_max))
         
-        # Build the actual message
-        data = bytearray()
-        data[0:4] = struct.pack('>I', self.remote_channel)
-        i = 0
-        j = len(req_msgs)
-        for msg_req in req_msgs:
-            data.extend(bytes([MT.REQUEST]))
-            data.extend(msg_req.BuildBinaryMessage())
-            i += 1
+        # Build the actual message. All REQUESTs are written into one buffer
+        data = bytearray(4 + len(req_ranges) * MsgRequest.MsgRequest.SIZE)
+        MessagesParser.CHANNEL.pack_into(data, 0, self.remote_channel)
+        offset = 4
+        j = len(req_ranges)
+        for (i, (start_chunk, end_chunk)) in enumerate(req_ranges, 1):
+            offset = MsgRequest.MsgRequest.PackInto(data, offset, start_chunk, end_chunk)
             if self._logger.isEnabledFor(logging.INFO):
-                logging.info("TO > {} > ({}/{}) {}".format(self._peer_num, i, j, msg_req))
+                logging.info("TO > {} > ({}/{}) [REQUEST] Start: {}; End: {}; Num chunks: {}".format(
+                    self._peer_num, i, j, start_chunk, end_chunk, end_chunk - start_chunk + 1))
 
         self.SendAndAccount(data)
         self.set_i_requested = self.set_i_requested | chunks_set
 
     def HandleIntegrity(self, msg_integrity):
-        """Handle the incomming integorty message"""
-        self._swarm.integrity[(msg_integrity.start_chunk, msg_integrity.end_chunk)] = msg_integrity.hash_data
+        """Handle the incomming integorty message. Hash is kept until it is used to verify DATA"""
+        integrity = self._swarm.integrity
+        if integrity is None:
+            return
+
+        node = integrity.range_to_node(msg_integrity.start_chunk, msg_integrity.end_chunk)
+        if node is None or bin_layer(node) > integrity.height or len(msg_integrity.hash_data) != integrity.digest_size:
+            logging.warning("Ignoring INTEGRITY from {0}: {1}".format(self._peer_num, msg_integrity))
+            return
+
+        self._hashes_rx[node] = bytes(msg_integrity.hash_data)
+
+    def discard_hashes(self, chunk_id):
+        """Forget hashes received from and sent to the peer of bins below chunk_id"""
+        for node in [n for n in self._hashes_rx if bin_end(n) < chunk_id]:
+            del self._hashes_rx[node]
+        self.set_hashes_sent = set(n for n in self.set_hashes_sent if bin_end(n) >= chunk_id)
+
+    def HandleSignedIntegrity(self, msg_signed):
+        """Handle the incomming signed munro of a live stream [RFC7574] 6.1.
+           Its hash arrives in INTEGRITY just before. Chunks under a verified
+           munro are verified by hashes only.
+        """
+        integrity = self._swarm.integrity
+        if integrity is None or integrity.SIGNATURE_ALG is None:
+            return
 
-    def HandleAck(self, msg_ack):
+        valid = integrity.add_signature(msg_signed.start_chunk, msg_signed.end_chunk,
+                                        msg_signed.timestamp, msg_signed.signature, self._hashes_rx)
+        if valid is None:
+            logging.warning("Ignoring SIGNED_INTEGRITY from {0} without the munro hash: {1}".format(self._peer_num, msg_signed))
+        elif not valid:
+            self._num_integrity_failures += 1
+            logging.warning("Bad SIGNED_INTEGRITY from {0}: {1}".format(self._peer_num, msg_signed))
+        elif self.unverified_data:
+            # Chunks might have arrived before their signature
+            self._ack_verified(self._verify_waiting())
+
+    def HandleAck(self, start_chunk, end_chunk, one_way_delay_sample):
         """Handle incomming ACK message"""
 
         if not self._is_udp:
             logging.warn("Got ACK from TCP based peer!")
             return
 
-        for x in range(msg_ack.start_chunk, msg_ack.end_chunk + 1):
+        newly_acked = []
+        for x in range(start_chunk, end_chunk + 1):
             self.set_requested.discard(x)
-            self.set_sent.discard(x)
+            if x in self.set_sent:
+                self.set_sent.discard(x)
+                newly_acked.append(x)
 
-        self._ledbat.feed_ack([msg_ack.one_way_delay_sample], 1)
+        self._chunk_sending_alg.on_ack(newly_acked, [one_way_delay_sample])
         if self._logger.isEnabledFor(logging.DEBUG):
-                logging.debug("FROM > {} > ACK: {} to {}".format(self._peer_num, msg_ack.start_chunk, msg_ack.end_chunk))
+                logging.debug("FROM > {} > ACK: {} to {}".format(self._peer_num, start_chunk, end_chunk))
 
-    def HandleRequest(self, msg_request):
+    def HandleRequest(self, start_chunk, end_chunk):
         """Handle incomming REQUEST message"""
-        for x in range(msg_request.start_chunk, msg_request.end_chunk + 1):
+        for x in range(start_chunk, end_chunk + 1):
             # Ignore requests for discarded chunks
             if x <= self._swarm._last_discarded_id:
                 continue
@@ -525,11 +688,34 @@ class SwarmMember(object):
             self.set_sent.discard(x)
 
         if self._logger.isEnabledFor(logging.DEBUG):
-            logging.debug("FROM > {0} > REQUEST: {1}".format(self._peer_num, msg_request))
+            logging.debug("FROM > {0} > REQUEST: {1} to {2}".format(self._peer_num, start_chunk, end_chunk))
+
+        # Start reading the requested range from the storage
+        self._swarm._chunk_storage.prefetch(start_chunk, end_chunk)
 
         # Try to send some data
-        if self._sending_handle == None:
-           self._sending_handle = asyncio.get_event_loop().call_soon(self.SendRequestedChunks) 
+        self.wake_sender()
+
+    def HandleCancel(self, start_chunk, end_chunk):
+        """Handle incomming CANCEL message. Cancelled chunks are not sent [RFC7574] 8.11"""
+        for x in range(start_chunk, end_chunk + 1):
+            self.set_requested.discard(x)
+
+        if self._logger.isEnabledFor(logging.DEBUG):
+            logging.debug("FROM > {0} > CANCEL: {1} to {2}".format(self._peer_num, start_chunk, end_chunk))
+
+    def HandleChoke(self):
+        """Handle incomming CHOKE message. Peer drops all our outstanding requests [RFC7574] 8.12"""
+        logging.info("FROM > {0} > CHOKE".format(self._peer_num))
+        self.remote_choked = True
+
+        # Chunks requested from the peer can be requested from others
+        self.set_i_requested.clear()
+
+    def HandleUnchoke(self):
+        """Handle incomming UNCHOKE message. Peer accepts our requests again"""
+        logging.info("FROM > {0} > UNCHOKE".format(self._peer_num))
+        self.remote_choked = False
 
     def SetPeerParameters(self, msg_handshake):
         """Set Peer parameters as received in the HS message"""
@@ -538,6 +724,7 @@ class SwarmMember(object):
 
         self.remote_channel = msg_handshake.their_channel
         self.hash_type = msg_handshake.merkle_tree_hash_func
+        self.live_signature_alg = msg_handshake.live_signature_alg
                 
         # Verify that we can understand each other
         if msg_handshake.chunk_addressing_method != 2:
@@ -545,17 +732,34 @@ class SwarmMember(object):
         else:
             self.chunk_addressing_method = msg_handshake.chunk_addressing_method
                 
-        if msg_handshake.chunk_size != 1024:
-            raise NotImplementedError("Not standard chunk size!")
+        # Chunk size is fixed for the swarm. Merkle hashes depend on it
+        if msg_handshake.chunk_size != self._swarm.chunk_size:
+            logging.warning('Peer uses chunk size %s, swarm uses %s',
+                            msg_handshake.chunk_size, self._swarm.chunk_size)
+            return False
         else:
             self.chunk_size = msg_handshake.chunk_size
 
         if msg_handshake.live_discard_window != 0:
             self.live_discard_wnd = msg_handshake.live_discard_window
+            if self.num_chunks is None:
+                # Peer might have more chunks in its window than we do
+                self.max_range = max(self.max_range, self.live_discard_wnd)
+
+        return True
 
     def SendRequestedChunks(self):
         """Send the requested chunks to the peer"""
         self._chunk_sending_alg.SendAndSchedule()
+
+    def wake_sender(self):
+        """Schedule the sending algorithm if it is parked.
+           Sending algorithms park themselves (set the sending handle
+           to None) when there is nothing to send, and are woken up
+           by new requests or by new data arriving into the storage.
+        """
+        if self._sending_handle is None and not self._is_destroyed:
+            self._sending_handle = asyncio.get_event_loop().call_soon(self.SendRequestedChunks)
                 
     def ProcessOutbox(self):
         """Binarify and send all messages in the outbox"""
@@ -565,13 +769,14 @@ class SwarmMember(object):
         if len(self._outbox) == 0:
             return
 
-        data = bytearray()
-        data[0:] = struct.pack('>I', self.remote_channel)
+        # All messages are written into one buffer
+        data = bytearray(4 + sum(msg.GetSize() for msg in self._outbox))
+        MessagesParser.CHANNEL.pack_into(data, 0, self.remote_channel)
+        offset = 4
 
         for msg in self._outbox:
-            msg_bin = msg.BuildBinaryMessage()
+            offset = msg.BuildInto(data, offset)
             #logging.info("Outbox: {0}".format(msg))
-            data[len(data):] = msg_bin
             
         self._outbox.clear()
 
@@ -582,12 +787,18 @@ class SwarmMember(object):
 
         logging.info("Destroying member ({}). Send disconnect: {}".
                      format(self, send_disconnect))
+        self._is_destroyed = True
 
         # Close the sending handle if present
         if self._sending_handle is not None:
             self._sending_handle.cancel()
             self._sending_handle = None
 
+        # Close delayed ACK handle if present
+        if self._ack_handle is not None:
+            self._ack_handle.cancel()
+            self._ack_handle = None
+
         # Close cleanup handle if present
         if self._cleanup_hdl is not None:
             self._cleanup_hdl.cancel()
@@ -662,7 +873,10 @@ class SwarmMember(object):
             'peer_ip': self.ip_address,
             'peer_port': self.udp_port,
             'peer_id': self._peer_num,
-            'msg_data_rx': self._data_msg_rx
+            'msg_data_rx': self._data_msg_rx,
+            'retransmits': self._num_retransmits,
+            'fast_losses': self._num_fast_losses,
+            'rto_losses': self._num_rto_losses
         }
 
         # Create peer id
@@ -18,7 +18,6 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import time
 import asyncio
-import struct
 import logging
 
 from AbstractSendRequestedChunks import AbstractSendRequestedChunks
@@ -33,13 +32,15 @@ class TCPFullSendRequestedChunks(AbstractSendRequestedChunks):
     def SendAndSchedule(self):
         set_to_send = (self._swarm.set_have & self._member.set_requested) - self._member.set_sent
 
-        if any(set_to_send):
+        if set_to_send:
             # We have stuff to send - all is fine
             chunk_to_send = min(set_to_send)
        
-            data = self._swarm.GetChunkData(chunk_to_send)
+            data = self._get_chunk_data(chunk_to_send)
             if data is None:
-                logging.warning('TCPFullSendRequestedChunks::SendAndSchedule(): data is None! Consider other alg!')
+                # Park until read from the storage
+                self._member._sending_handle = None
+                return
         
             md = MsgData.MsgData(self._member.chunk_size, self._member.chunk_addressing_method)
             md.start_chunk = chunk_to_send
@@ -47,17 +48,17 @@ class TCPFullSendRequestedChunks(AbstractSendRequestedChunks):
             md.data = data
             md.timestamp = int((time.time() * 1000000))
 
-            mdata_bin = bytearray()
-            mdata_bin[0:4] = struct.pack('>I', self._member.remote_channel)
-            mdata_bin[4:] = md.BuildBinaryMessage()
+            mdata_bin = self._build_data(md)
 
             self._member.SendAndAccount(mdata_bin)
             self._member.set_sent.add(chunk_to_send)
 
-            if self._member._proto._throttle:
-                self._member._sending_handle = asyncio.get_event_loop().call_later(0.5, self._member.SendRequestedChunks)
+            # Member might be removed from the connection while sending
+            if self._member._proto is None or self._member._proto._throttle:
+                # Park until the transport is drained (see PeerProtocolTCP.resume_writing)
+                self._member._sending_handle = None
             else:
                 self._member._sending_handle = asyncio.get_event_loop().call_soon(self._member.SendRequestedChunks)
         else:
-            # If nothing to send check in one second. Eventually this peer will be removed if nothing is being sent
-            self._member._sendind_handle = asyncio.get_event_loop().call_later(1, self._member.SendRequestedChunks)
+            # Nothing to send - park until woken up by REQUEST or new data
+            self._member._sending_handle = None
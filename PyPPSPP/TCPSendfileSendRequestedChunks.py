@@ -0,0 +1,77 @@
+"""
+PyPPSPP, a Python3 implementation of Peer-to-Peer Streaming Peer Protocol
+Copyright (C) 2016,2017  J. Poderys, Technical University of Denmark
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+
+from Messages import *
+from TCPFullSendRequestedChunks import TCPFullSendRequestedChunks
+
+class TCPSendfileSendRequestedChunks(TCPFullSendRequestedChunks):
+    """Zero-copy sending of completed files over TCP. DATA header is
+       built in Python and the payload of a contiguous range of chunks
+       is streamed from the page cache using sendfile. Falls back to
+       TCPFullSendRequestedChunks while the file is not complete.
+    """
+    MAX_RANGE_CHUNKS = 64   # Max number of chunks in one DATA message
+
+    def __init__(self, swarm, member):
+        self._resend_hashes = False     # Previous header with INTEGRITY was not sent
+        return super().__init__(swarm, member)
+
+    def SendAndSchedule(self):
+        set_to_send = (self._swarm.set_have & self._member.set_requested) - self._member.set_sent
+        if not set_to_send:
+            self._member._sending_handle = None
+            return
+
+        start_chunk = min(set_to_send)
+        end_chunk = start_chunk
+        while (end_chunk + 1 in set_to_send and
+               end_chunk - start_chunk + 1 < TCPSendfileSendRequestedChunks.MAX_RANGE_CHUNKS):
+            end_chunk += 1
+
+        # Storage might not support sendfile (yet)
+        if self._member._proto is None:
+            return super().SendAndSchedule()
+        file_range = self._swarm._chunk_storage.get_file_range(start_chunk, end_chunk)
+        if file_range is None:
+            return super().SendAndSchedule()
+        (file_hdl, offset, count) = file_range
+
+        md = MsgData.MsgData(self._member.chunk_size, self._member.chunk_addressing_method)
+        md.start_chunk = start_chunk
+        md.end_chunk = end_chunk
+        md.timestamp = int((time.time() * 1000000))
+
+        header = self._build_data(md, self._resend_hashes)
+
+        # Park until sendfile is done. Connection wakes up all its members then.
+        self._member._sending_handle = None
+
+        if not self._member._proto.send_file_range(header, file_hdl, offset, count):
+            # Other member of the connection is using sendfile
+            self._resend_hashes = True
+            return
+        self._resend_hashes = False
+
+        for chunk_id in range(start_chunk, end_chunk + 1):
+            self._member.set_sent.add(chunk_id)
+
+        datalen = len(header) + count
+        self._member._total_data_tx += datalen
+        self._swarm._all_data_tx += datalen
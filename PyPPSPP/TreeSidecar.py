@@ -0,0 +1,105 @@
+"""
+PyPPSPP, a Python3 implementation of Peer-to-Peer Streaming Peer Protocol
+Copyright (C) 2016,2017  J. Poderys, Technical University of Denmark
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import os
+import struct
+
+from MerkleHashTree import MerkleTree
+
+class TreeSidecar(object):
+    """Full Merkle hash tree of a file stored in a file next to it, so
+       a seeder does not have to hash the file again on each start. The
+       tree is valid while the size, mtime and inode of the file match.
+    """
+    MAGIC = b'PPSPPBIN'                # Hashes indexed by bin number
+    HEADER = struct.Struct('>8sBIQQQ')  # Magic, digest size, chunk size, file size, mtime (ns), inode
+    SUFFIX = '.merkle'
+
+    def __init__(self, filename, chunk_size, digest_size):
+        self._filename = filename
+        self.path = filename + TreeSidecar.SUFFIX
+        self._chunk_size = chunk_size
+        self._digest_size = digest_size
+
+    def _key(self, file_stat):
+        """Header identifying the file version the tree belongs to"""
+        return TreeSidecar.HEADER.pack(TreeSidecar.MAGIC, self._digest_size, self._chunk_size,
+                                       file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino)
+
+    def load(self):
+        """Load the tree. Returns None if the sidecar is missing or the file has changed"""
+        try:
+            file_stat = os.stat(self._filename)
+            with open(self.path, 'rb') as fp:
+                data = fp.read()
+        except OSError:
+            return None
+
+        key = self._key(file_stat)
+        if data[:len(key)] != key:
+            logging.info('Sidecar %s does not match the file. Ignoring', self.path)
+            return None
+
+        num_chunks = (file_stat.st_size + self._chunk_size - 1) // self._chunk_size
+        tree = MerkleTree(self._digest_size, num_chunks, complete = True)
+        if len(data) != len(key) + len(tree.hashes):
+            logging.info('Sidecar %s is truncated. Ignoring', self.path)
+            return None
+
+        tree.hashes[:] = memoryview(data)[len(key):]
+        return tree
+
+    def save(self, tree, file_stat):
+        """Atomically replace the sidecar with the tree of the file version given by file_stat"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as fp:
+            fp.write(self._key(file_stat))
+            fp.write(tree.hashes)
+        os.replace(tmp_path, self.path)
+
+    def get_tree(self, mht):
+        """Get the stored tree. If the file has changed, calculate the tree
+           using the given MerkleHashTree and store it. Returns (tree, is stored)
+        """
+        tree = self.load()
+        if tree is not None:
+            return (tree, True)
+
+        try:
+            file_stat = os.stat(self._filename)
+        except OSError:
+            return (None, False)
+
+        tree = mht.get_file_tree(self._filename)
+        if tree is None:
+            return (None, False)
+
+        try:
+            self.save(tree, file_stat)
+        except OSError as exc:
+            logging.warning('Saving sidecar %s failed: %s', self.path, exc)
+
+        return (tree, False)
+
+    def remove(self):
+        """Remove the sidecar"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
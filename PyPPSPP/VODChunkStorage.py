@@ -0,0 +1,147 @@
+"""
+PyPPSPP, a Python3 implementation of Peer-to-Peer Streaming Peer Protocol
+Copyright (C) 2016,2017  J. Poderys, Technical University of Denmark
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import tempfile
+
+from MemoryChunkStorage import MemoryChunkStorage
+
+class VODChunkStorage(MemoryChunkStorage):
+    """Video-on-Demand storage keeping a bounded window of chunks from the
+       playback position in memory. Chunks behind the playback position or
+       far ahead of it are spilled to a temporary file and read back in
+       when requested.
+    """
+    MEMORY_CHUNKS = 2048                # Chunks kept in memory
+
+    def __init__(self, swarm, memory_chunks = None):
+        self._memory_chunks = memory_chunks or VODChunkStorage.MEMORY_CHUNKS
+        self._spill_file = tempfile.TemporaryFile()
+        self._spilled = {}              # chunk_id -> length of data in the spill file
+        self._num_spill_writes = 0
+        self._num_spill_reads = 0
+
+        super().__init__(swarm)
+
+    def CloseStorage(self):
+        super().CloseStorage()
+        with self._lock:
+            self._spill_file.close()
+            self._spilled.clear()
+
+    def copy_chunk(self, chunk_id):
+        """Chunks are always copied under the lock"""
+        return self._chunk_view(chunk_id)
+
+    def get_stats(self):
+        """Get arena and spill file statistics"""
+        stats = super().get_stats()
+        stats['spilled_chunks'] = len(self._spilled)
+        stats['spill_writes'] = self._num_spill_writes
+        stats['spill_reads'] = self._num_spill_reads
+        return stats
+
+    def _init_arena(self):
+        self._alloc_arena(self._memory_chunks)
+
+    def _distance(self, chunk_id):
+        """Sort key of the chunk's need to be in memory. Chunks
+           ahead of the playback position come first
+        """
+        consumer = self._swarm._cont_consumer
+        position = consumer.last_showed_chunk() if consumer is not None else None
+        if position is None:
+            position = 0
+        return (chunk_id < position, abs(chunk_id - position))
+
+    def _take_slot(self, chunk_id):
+        """Get the slot of the chunk if the chunk is more needed
+           than the current occupant. Returns None otherwise.
+        """
+        slot = chunk_id % self._num_slots
+        old_id = self._slot_ids[slot]
+        if old_id is not None:
+            if self._distance(old_id) < self._distance(chunk_id):
+                return None
+            self._spill(old_id, slot)
+        return slot
+
+    def _spill(self, chunk_id, slot):
+        """Move the chunk from the memory slot to the spill file"""
+        if chunk_id not in self._spilled:
+            offset = slot * self._chunk_size
+            self._write_spill(chunk_id, self._view[offset:offset + self._slot_len[slot]])
+
+        self._chunks[chunk_id] = None
+        self._slot_ids[slot] = None
+
+    def _write_spill(self, chunk_id, data):
+        self._spill_file.seek(chunk_id * self._chunk_size)
+        self._spill_file.write(data)
+        self._spilled[chunk_id] = len(data)
+        self._num_spill_writes += 1
+
+    def _place(self, chunk_id, slot, data):
+        """Copy the data into the slot"""
+        offset = slot * self._chunk_size
+        self._view[offset:offset + len(data)] = data
+        self._chunks[chunk_id] = slot
+        self._slot_ids[slot] = chunk_id
+        self._slot_len[slot] = len(data)
+
+    def _store_chunk(self, chunk_id, data):
+        """Save the chunk in memory or straight to the spill file"""
+        with self._lock:
+            slot = self._take_slot(chunk_id)
+            if slot is None:
+                self._write_spill(chunk_id, data)
+                self._chunks[chunk_id] = None
+            else:
+                self._place(chunk_id, slot, data)
+        return True
+
+    def _chunk_view(self, chunk_id):
+        """Get a copy of the data of the chunk. Spilled chunk is
+           read back into memory if it is needed more than the
+           chunk currently in its slot.
+        """
+        with self._lock:
+            if chunk_id not in self._chunks:
+                return None
+
+            slot = self._chunks[chunk_id]
+            if slot is not None:
+                offset = slot * self._chunk_size
+                return bytes(self._view[offset:offset + self._slot_len[slot]])
+
+            self._spill_file.seek(chunk_id * self._chunk_size)
+            data = self._spill_file.read(self._spilled[chunk_id])
+            self._num_spill_reads += 1
+
+            slot = self._take_slot(chunk_id)
+            if slot is not None:
+                self._place(chunk_id, slot, data)
+
+            return data
+
+    def _release(self, chunk_id):
+        with self._lock:
+            slot = self._chunks.pop(chunk_id, None)
+            if slot is not None:
+                self._slot_ids[slot] = None
+            self._spilled.pop(chunk_id, None)
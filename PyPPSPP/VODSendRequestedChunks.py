@@ -19,7 +19,6 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import logging
 import time
 import asyncio
-import struct
 
 from Messages import *
 from AbstractSendRequestedChunks import AbstractSendRequestedChunks
@@ -35,7 +34,7 @@ class VODSendRequestedChunks(AbstractSendRequestedChunks):
         # Choose what to send
         set_to_send = (self._swarm.set_have & self._member.set_requested) - self._member.set_sent
 
-        if any(set_to_send):
+        if set_to_send:
             # We have stuff to send - all is fine
             chunk_to_send = min(set_to_send)
        
@@ -51,9 +50,7 @@ class VODSendRequestedChunks(AbstractSendRequestedChunks):
                 md.data = data
                 md.timestamp = int((time.time() * 1000000))
 
-                mdata_bin = bytearray()
-                mdata_bin[0:4] = struct.pack('>I', self._member.remote_channel)
-                mdata_bin[4:] = md.BuildBinaryMessage()
+                mdata_bin = self._build_data(md)
 
                 self._member.SendAndAccount(mdata_bin)
                 self._member.set_sent.add(chunk_to_send)
@@ -74,6 +71,5 @@ class VODSendRequestedChunks(AbstractSendRequestedChunks):
                 self._member.SendRequestedChunks)
 
         else:
-            # We have nothing to send - throttle sending
-            self._member._sending_handle = asyncio.get_event_loop().call_later(
-                0.01, self._member.SendRequestedChunks)
+            # We have nothing to send - park until woken up by REQUEST or new data
+            self._member._sending_handle = None
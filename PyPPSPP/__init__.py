@@ -18,4 +18,4 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from Messages import *
 
-__all__ = ["LEDBAT", "LEDBATSendRequestedChunks", "PeerProtocolUDP", "PeerProtocolTCP"]
\ No newline at end of file
+__all__ = ["LEDBAT", "CUBIC", "FixedRate", "LEDBATSendRequestedChunks", "PeerProtocolUDP", "PeerProtocolTCP"]
\ No newline at end of file